@@ -16,7 +16,7 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 import gramfuzz
 
 
-def generate(grammar=None, num=1, output=sys.stdout, max_recursion=10, seed=None):
+def generate(grammar=None, num=1, output=sys.stdout, max_recursion=10, seed=None, engine="recursive", workers=None):
     """Load and generate ``num`` number of top-level rules from the specified grammar.
 
     :param list grammar: The grammar file to load and generate data from
@@ -24,16 +24,30 @@ def generate(grammar=None, num=1, output=sys.stdout, max_recursion=10, seed=None
     :param output: The output destination (an open, writable stream-type object. default=``sys.stdout``)
     :param int max_recursion: The maximum reference-recursion when generating data (default=``10``)
     :param int seed: The seed to initialize the PRNG with. If None, will not initialize it.
+    :param str engine: The generation engine to use (default=``"recursive"``)
+    :param int workers: The number of worker processes to generate data with. If None,
+        data is generated in this process without per-sample seeding (default=``None``)
     """
     if seed is not None:
         gramfuzz.rand.seed(seed)
 
-    fuzzer = gramfuzz.GramFuzzer()
+    fuzzer = gramfuzz.GramFuzzer(engine=engine)
     fuzzer.load_grammar(grammar)
 
     cat_group = os.path.basename(grammar).replace(".py", "")
 
-    results = fuzzer.gen(cat_group=cat_group, num=num, max_recursion=max_recursion)
+    if workers is not None:
+        fuzzer.gen_parallel(
+            cat_group     = cat_group,
+            num           = num,
+            max_recursion = max_recursion,
+            workers       = workers,
+            seed          = seed,
+            sink          = lambda res: output.write(res + b"\n"),
+        )
+        return
+
+    results = fuzzer.gen_iter(cat_group=cat_group, num=num, max_recursion=max_recursion)
     for res in results:
         output.write(res + b"\n")
 
@@ -75,6 +89,21 @@ def main(argv):
         type    = int,
         default = 10,
     )
+    parser.add_argument("--engine",
+        metavar = "ENGINE",
+        help    = "The generation engine to use. One of: {} (default=recursive)".format(
+            ",".join(gramfuzz.GramFuzzer.engines)
+        ),
+        choices = gramfuzz.GramFuzzer.engines,
+        default = "recursive",
+    )
+    parser.add_argument("-w", "--workers",
+        metavar = "N",
+        help    = "Generate data with N worker processes. Each sample is seeded separately,\n"
+                  "so the output is the same for any number of workers (default=None)",
+        type    = int,
+        default = None,
+    )
     if six.PY3:
         default_output = sys.stdout.buffer
     else:
@@ -94,6 +123,8 @@ def main(argv):
         output        = args.output,
         max_recursion = args.max_recursion,
         seed          = args.seed,
+        engine        = args.engine,
+        workers       = args.workers,
     )
 
     
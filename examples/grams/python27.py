@@ -15,6 +15,7 @@ E.g.:
 
 
 import gramfuzz
+import gramfuzz.context
 import gramfuzz.utils
 import gramfuzz.errors
 import gramfuzz.rand
@@ -24,19 +25,24 @@ from gramfuzz.fields import *
 TOP_CAT = "python"
 
 
-INDENT_LEVEL = 0
+# the current indentation level is kept in the generation context so that
+# several threads can generate python code at once
+def _indent_state():
+    state = gramfuzz.context.current().state
+    state.setdefault("py_indent_level", 0)
+    return state
+
+
 class INDENT(Field):
     def build(self, pre=None, shortest=False):
-        global INDENT_LEVEL
-        INDENT_LEVEL += 1
+        _indent_state()["py_indent_level"] += 1
         # indent one extra time
         return "    "
 
 
 class DEDENT(Field):
     def build(self, pre=None, shortest=False):
-        global INDENT_LEVEL
-        INDENT_LEVEL -= 1
+        _indent_state()["py_indent_level"] -= 1
         return NEWLINE().build(pre, shortest=shortest)
 
 
@@ -49,7 +55,7 @@ class PyRef(Ref):
 
 class NEWLINE(Field):
     def build(self, pre=None, shortest=False):
-        return "\n" + ("    " * INDENT_LEVEL)
+        return "\n" + ("    " * _indent_state()["py_indent_level"])
 
 # top level rule
 Def("file_input",
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+This script measures how long it takes, and how much memory it takes, to load a
+large, machine-generated grammar file with ``load_grammar``, both as a Python
+grammar file and as a declarative grammar file (Unix only, uses ``resource``).
+"""
+
+import argparse
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import gramfuzz
+
+
+def write_grammar(path, num_rules, seed):
+    """Write a grammar file that defines ``num_rules`` random rules that
+    reference each other
+    """
+    rng = random.Random(seed)
+
+    def ref():
+        return 'Ref("rule{}")'.format(rng.randrange(num_rules))
+
+    def value(depth):
+        choice = rng.randrange(5)
+        if depth > 2 or choice == 0:
+            return '"tok{}"'.format(rng.randrange(100))
+        elif choice == 1:
+            return ref()
+        elif choice == 2:
+            return "Or({})".format(", ".join(value(depth + 1) for x in range(rng.randint(2, 4))))
+        elif choice == 3:
+            return "Opt({})".format(value(depth + 1))
+        return "UInt"
+
+    with open(path, "w") as f:
+        f.write("from gramfuzz.fields import *\n\n")
+        f.write('TOP_CAT = "default"\n\n')
+        for idx in range(num_rules):
+            f.write('Def("rule{}", "leaf{}")\n'.format(idx, idx))
+            f.write('Def("rule{}", {})\n'.format(idx, ", ".join(value(0) for x in range(rng.randint(1, 4)))))
+
+
+def load(path, export_path=None):
+    """Load the grammar file ``path`` in a new process, so that the peak
+    memory used by the process is only the memory used to load the grammar
+    (tracemalloc makes executing large Python grammar files very slow)
+
+    :param str export_path: The path to export the loaded rules to, if any
+    :returns: A tuple of the seconds it took to load the grammar, the growth of
+        the peak memory used by the process while loading it, the number of rule
+        definitions, and the seconds it took to preprocess the rules
+    """
+    cmd = [sys.executable, __file__, "--load", path]
+    if export_path is not None:
+        cmd += ["--export", export_path]
+    secs, peak, num_defs, preprocess_secs = subprocess.check_output(cmd).split()
+    return float(secs), int(peak), int(num_defs), float(preprocess_secs)
+
+
+def _load_child(path, export_path):
+    fuzzer = gramfuzz.GramFuzzer()
+
+    # kilobytes on Linux, bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    fuzzer.load_grammar(path)
+    secs = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    if export_path is not None:
+        fuzzer.export_grammar(export_path)
+
+    num_defs = sum(len(rules) for rules in fuzzer.defs["default"].values())
+    start = time.time()
+    fuzzer.preprocess_rules()
+    preprocess_secs = time.time() - start
+
+    print("{} {} {} {}".format(secs, (after - before) * scale, num_defs, preprocess_secs))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(__file__, description=__doc__)
+    parser.add_argument("-r", "--rules",
+        help    = "The number of rules to define (default=25000, two definitions each)",
+        type    = int,
+        default = 25000,
+    )
+    parser.add_argument("--seed",
+        help    = "The seed used to generate the rules (default=1337)",
+        type    = int,
+        default = 1337,
+    )
+    parser.add_argument("--load",
+        help    = argparse.SUPPRESS,
+    )
+    parser.add_argument("--export",
+        help    = argparse.SUPPRESS,
+    )
+    args = parser.parse_args(argv)
+
+    if args.load is not None:
+        _load_child(args.load, args.export)
+        return
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, "load_benchmark_grammar.py")
+        write_grammar(path, args.rules, args.seed)
+
+        # the grammars are only loaded in child processes, which start with
+        # the peak memory usage of this process
+        json_path = os.path.join(tmpdir, "load_benchmark_grammar.json")
+        py_secs, py_peak, num_defs, _ = load(path, json_path)
+        json_secs, json_peak, _, preprocess_secs = load(json_path)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    print("definitions:           {:>12,}".format(num_defs))
+    print("python loaded in:      {:>12.2f} s".format(py_secs))
+    print("python peak memory:    {:>12,} bytes".format(py_peak))
+    print("json loaded in:        {:>12.2f} s".format(json_secs))
+    print("json peak memory:      {:>12,} bytes".format(json_peak))
+    print("preprocessed in:       {:>12.2f} s".format(preprocess_secs))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+This script measures how much memory the fields of a large, machine-generated
+grammar use (Python 3.4+, uses ``tracemalloc``).
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import gramfuzz
+from gramfuzz.fields import *
+
+
+def define_rules(num_rules, seed):
+    """Define ``num_rules`` random rules that reference each other, the way
+    grammars that are generated from other grammar formats usually look
+    """
+    rng = random.Random(seed)
+
+    def ref():
+        return Ref("rule{}".format(rng.randrange(num_rules)))
+
+    def value(depth):
+        choice = rng.randrange(8)
+        if depth > 2 or choice == 0:
+            return "tok{}".format(rng.randrange(100))
+        elif choice == 1:
+            return ref()
+        elif choice == 2:
+            return Or(*[value(depth + 1) for x in range(rng.randint(2, 4))])
+        elif choice == 3:
+            return And(value(depth + 1), value(depth + 1))
+        elif choice == 4:
+            return Opt(value(depth + 1))
+        elif choice == 5:
+            return Join(value(depth + 1), ref(), sep=",")
+        elif choice == 6:
+            return STAR(value(depth + 1))
+        return rng.choice([UInt, Int(), String(max=10), Q(ref())])
+
+    for idx in range(num_rules):
+        Def("rule{}".format(idx), "leaf{}".format(idx))
+        Def("rule{}".format(idx), *[value(0) for x in range(rng.randint(1, 4))])
+
+
+def count_fields(fuzzer):
+    """Count the field instances reachable from the rules of ``fuzzer``
+    """
+    seen = set()
+    todo = []
+    for cat_defs in fuzzer.defs.values():
+        for rules in cat_defs.values():
+            todo.extend(rules)
+    while len(todo) > 0:
+        field = todo.pop()
+        if not isinstance(field, Field) or id(field) in seen:
+            continue
+        seen.add(id(field))
+        todo.extend(getattr(field, "values", []))
+    return len(seen)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(__file__, description=__doc__)
+    parser.add_argument("-r", "--rules",
+        help    = "The number of rules to define (default=5000)",
+        type    = int,
+        default = 5000,
+    )
+    parser.add_argument("--seed",
+        help    = "The seed used to generate the rules (default=1337)",
+        type    = int,
+        default = 1337,
+    )
+    args = parser.parse_args(argv)
+
+    fuzzer = gramfuzz.GramFuzzer()
+
+    tracemalloc.start()
+    start = time.time()
+    define_rules(args.rules, args.seed)
+    define_secs = time.time() - start
+    fuzzer.preprocess_rules()
+    used, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    num_fields = count_fields(fuzzer)
+    print("rules:            {:>12,}".format(args.rules))
+    print("fields:           {:>12,}".format(num_fields))
+    print("defined in:       {:>12.2f} s".format(define_secs))
+    print("memory used:      {:>12,} bytes".format(used))
+    print("peak memory used: {:>12,} bytes".format(peak))
+    print("per field:        {:>12,.1f} bytes".format(used / float(num_fields)))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
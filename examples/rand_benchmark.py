@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+This script measures how many random decisions per second each random number
+generator backend makes, both for the individual ``gramfuzz.rand`` functions
+and while generating data from one of the example grammars.
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import gramfuzz
+import gramfuzz.context as context
+import gramfuzz.rand as rand
+
+
+SEQ = list(range(10))
+PROBS = [0.2, 0.3, 0.5]
+CHARSET = b"abcdefghijklmnopqrstuvwxyz"
+
+PRIMITIVES = [
+    ("random",          lambda: rand.random()),
+    ("maybe",           lambda: rand.maybe()),
+    ("randint",         lambda: rand.randint(100)),
+    ("choice",          lambda: rand.choice(SEQ)),
+    ("weighted_choice", lambda: rand.weighted_choice(SEQ[:3], PROBS)),
+    ("data",            lambda: rand.data(16, CHARSET)),
+    ("data (1KB)",      lambda: rand.data(1024, CHARSET)),
+]
+
+
+def make_rng(backend, seed):
+    """Create the random number generator of the backend ``backend``
+    """
+    if backend == "random.Random":
+        import random
+        return random.Random(seed)
+    return rand.BufferedRandom(seed=seed, backend=backend)
+
+
+def available_backends():
+    backends = ["random.Random", "python"]
+    try:
+        import numpy
+        backends.append("numpy")
+    except ImportError:
+        pass
+    return backends
+
+
+def bench_primitives(backend, number):
+    """Print the number of calls per second of each ``gramfuzz.rand`` function
+    """
+    with context.use(context.Context(rng=make_rng(backend, 1337))):
+        for name, func in PRIMITIVES:
+            start = time.time()
+            for x in range(number):
+                func()
+            secs = time.time() - start
+            print("  {:<16} {:>12,.0f} calls/s".format(name, number / secs))
+
+
+def bench_grammar(backend, fuzzer, cat_group, num):
+    """Print the number of rules per second generated from ``cat_group``
+    """
+    with context.use(context.Context(rng=make_rng(backend, 1337))):
+        start = time.time()
+        fuzzer.gen(cat_group=cat_group, num=num, max_recursion=10)
+        secs = time.time() - start
+    print("  {:<16} {:>12,.0f} rules/s".format(cat_group, num / secs))
+
+
+def main(argv):
+    grammar_choices = [
+        os.path.basename(x).replace(".py", "") \
+            for x in glob.glob(os.path.join(os.path.dirname(__file__), "grams", "*.py"))
+    ]
+    parser = argparse.ArgumentParser(__file__, description=__doc__)
+    parser.add_argument("-g", "--grammar",
+        help    = "The grammar to generate data from. One of: {} (default=names)".format(",".join(grammar_choices)),
+        choices = grammar_choices,
+        default = "names",
+    )
+    parser.add_argument("-n", "--number",
+        help    = "The number of rules to generate from the grammar (default=2000)",
+        type    = int,
+        default = 2000,
+    )
+    parser.add_argument("--calls",
+        help    = "The number of times to call each rand function (default=200000)",
+        type    = int,
+        default = 200000,
+    )
+    args = parser.parse_args(argv)
+
+    fuzzer = gramfuzz.GramFuzzer()
+    fuzzer.load_grammar(os.path.join(os.path.dirname(__file__), "grams", args.grammar + ".py"))
+    fuzzer.preprocess_rules()
+
+    for backend in available_backends():
+        print(backend)
+        bench_primitives(backend, args.calls)
+        bench_grammar(backend, fuzzer, args.grammar, args.number)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -11,11 +11,14 @@ which rules are defined and rules are randomly generated.
 from collections import deque
 import copy
 import gc
+import heapq
 import os
 import six
 import sys
+import threading
 
 
+import gramfuzz.context as context
 import gramfuzz.errors as errors
 import gramfuzz.rand as rand
 import gramfuzz.utils as utils
@@ -24,6 +27,25 @@ import gramfuzz.utils as utils
 __version__ = "{{VERSION}}"
 
 
+# states of the rules while finding the shortest reference paths
+_WAITING = 0
+_READY = 1
+_PROCESSED = 2
+_PRUNED = 3
+
+
+# the cost of values that can't be built within any budget
+_UNKNOWN_COST = (float("inf"), float("inf"))
+
+
+def _cost_key(cost):
+    """Return the key the ``(bytes, nodes)`` cost of a field is compared by:
+    every reference counts as one byte, and costs that are otherwise the same
+    are cheaper with fewer references
+    """
+    return (cost[0] + cost[1], cost[1])
+
+
 class GramFuzzer(object):
     """
     ``GramFuzzer`` is a singleton class that is used to
@@ -41,6 +63,10 @@ class GramFuzzer(object):
                 ...
             }
         }
+
+    Rules should be added with :any:`gramfuzz.GramFuzzer.add_definition` instead
+    of changing ``defs`` directly, since references are bound to the rule
+    definitions they refer to.
     """
 
     no_prunes = {}
@@ -64,6 +90,61 @@ class GramFuzzer(object):
     from certain grammar files
     """
 
+    engine = "recursive"
+    """The generation engine used to build rules. One of:
+
+    * ``"recursive"`` - each field's ``build()`` recursively builds its values (default)
+    * ``"stack"`` - the non-recursive engine in :any:`gramfuzz.engine`, which is not
+      limited by Python's maximum recursion depth
+    * ``"compiled"`` - rules are compiled into specialized Python functions by
+      :any:`gramfuzz.compiler`
+
+    All engines generate identical data for the same random seed.
+    See :any:`gramfuzz.GramFuzzer.set_engine`.
+    """
+
+    engines = ("recursive", "stack", "compiled")
+    """The names of all available generation engines
+    """
+
+    recursion = "global"
+    """How references are counted towards the max recursion (see
+    :any:`gramfuzz.GramFuzzer.set_max_recursion`). One of:
+
+    * ``"global"`` - every reference that is being built counts (default)
+    * ``"rule"`` - only the references to a rule that is already being built count,
+      separately for each rule
+    * ``"scc"`` - only the references to a rule that is part of the same strongly
+      connected component of the rule graph (a group of rules that can all reference
+      each other) as a rule that is already being built count, separately for each
+      component
+
+    In the ``"rule"`` and ``"scc"`` modes, chains of rules that do not recurse
+    do not make the rules at the end of the chain build their shortest versions
+    until the reference depth reaches :any:`gramfuzz.context.Recursion.DEPTH_SCALE`
+    times the max recursion. Rules (or components) nested within each other
+    could otherwise each nest up to the max recursion, which makes the data of
+    large grammars grow exponentially. References that may refer to any rule
+    (``"*"``) and references to rules defined after the rules were preprocessed
+    are always counted the ``"global"`` way. See :any:`gramfuzz.GramFuzzer.set_recursion`.
+    """
+
+    recursion_modes = ("global", "rule", "scc")
+    """The names of all ways references can be counted towards the max recursion
+    """
+
+    unbound_refs = []
+    """``(category, rule name, ref)`` tuples of the references that could not be
+    bound to a rule definition the last time the rules were preprocessed (see
+    :any:`gramfuzz.GramFuzzer.preprocess_rules`). Building one of these references
+    raises a ``GramFuzzError``.
+    """
+
+    compile_cache = None
+    """The directory that compiled rules are cached in when using the ``"compiled"``
+    engine (default=``None``, compiled rules are not cached). See :any:`gramfuzz.compiler`.
+    """
+
     __instance__ = None
     @classmethod
     def instance(cls):
@@ -74,8 +155,14 @@ class GramFuzzer(object):
         return cls.__instance__
 
 
-    def __init__(self, debug=False):
+    def __init__(self, debug=False, engine=None, recursion=None):
         """Create a new ``GramFuzzer`` instance
+
+        :param bool debug: Whether debug information should be printed (default=``False``)
+        :param str engine: The generation engine to use (default=``"recursive"``).
+            See :any:`gramfuzz.GramFuzzer.engine`.
+        :param str recursion: How references are counted towards the max recursion
+            (default=``"global"``). See :any:`gramfuzz.GramFuzzer.recursion`.
         """
         GramFuzzer.__instance__ = self
         self.debug = debug
@@ -83,29 +170,95 @@ class GramFuzzer(object):
         self.no_prunes = {}
         self.cat_groups = {}
         self.cat_group_defaults = {}
+        self.unbound_refs = []
 
-        # used during rule generation to keep track of things
-        # that can be reverted if things go wrong
-        self._staged_defs = None
+        # incremented whenever a rule name is added to or removed from a
+        # category, which makes Refs bind to their rule definitions again
+        # (see bind_ref)
+        self._defs_version = 0
 
-        # the last-defined preferred category-group names
-        self._last_prefs = None
-
-        # the last-defined rule definition names derived from the ``_last_prefs``
-        self._last_pref_keys = None
+        # used to make sure rules are only preprocessed once when several
+        # threads start generating at the same time
+        self._process_lock = threading.Lock()
 
         # a simple flag to tell if data needs to be auto processed or not
         self._rules_processed = False
+
+        # rules compiled by the "compiled" engine, reset whenever the rules change
+        self._compiled = None
+
+        # the rules passed to context.Recursion for the current recursion mode,
+        # reset whenever the rules change (see _get_recursion_rules)
+        self._recursion_rules = None
+
+        # the state of the shortest reference-path analysis, kept so that only
+        # rule definitions added after the rules were preprocessed need to be
+        # processed the next time rules are generated (see _update_rules)
+        self._ref_lengths = {}
+        self._ref_rules = []
+        self._ref_dependents = {}
+        self._ref_states = []
+        self._new_defs = None
+
+        # (category, rule name) -> the (bytes, nodes) cost of the cheapest
+        # definition of each rule (see _field_cost), kept for the same reason
+        self._rule_costs = {}
+
+        # Or field -> the costs of its values and the highest of those costs,
+        # and Join field with a max -> the cost of a repetition of its first
+        # value (see _assign_budget_costs)
+        self._budget_costs = {}
+
+        # id of an Or field -> its (value, index) tuples with the shortest
+        # reference paths, only kept while the costs are being updated
+        self._or_ref_vals = {}
+
+        # paths of all loaded grammar files, used to load the same grammars
+        # in worker processes (see gen_parallel)
+        self._grammar_paths = []
+
+        # grammar files loaded with lazy=True that have not been executed yet,
+        # as tuples of the path, the category groups and the categories the
+        # grammar defines (None if they are not known)
+        self._lazy_grammars = []
+
+        # categories that the lazy grammars defining them were loaded for
+        self._lazy_cats = set()
+
+        # held while lazy grammars are loaded
+        self._lazy_lock = threading.RLock()
+
+        if engine is not None:
+            self.set_engine(engine)
+        if recursion is not None:
+            self.set_recursion(recursion)
     
-    def load_grammar(self, path):
+    def load_grammar(self, path, lazy=False):
         """Load a grammar file (python file containing grammar definitions) by
         file path. When loaded, the global variable ``GRAMFUZZER`` will be set
         within the module. This is not always needed, but can be useful.
 
+        Grammar files ending in ``.json`` are declarative grammar files (see
+        :any:`gramfuzz.declarative`), which are loaded without executing any
+        Python code.
+
+        If ``lazy`` is true, the grammar file is only executed once rules are
+        generated from one of the categories it defines, or from its category
+        group, or once one of the rules that are generated references one of
+        its categories. The categories and ``TOP_CAT`` of the grammar are found
+        without executing it (see :any:`gramfuzz.utils.grammar_categories`).
+        Grammars whose categories cannot be found this way are executed the
+        first time rules are generated.
+
         :param str path: The path to the grammar file
+        :param bool lazy: Whether to only execute the grammar file once its rules are needed (default=``False``)
         """
         if not os.path.exists(path):
             raise Exception("path does not exist: {!r}".format(path))
+
+        if path.endswith(".json"):
+            self._load_declarative_grammar(path, lazy)
+            return
         
         # this will let grammars reference eachother with relative
         # imports.
@@ -123,118 +276,796 @@ class GramFuzzer(object):
 
         with utils.file_open(path, "r") as f:
             data = f.read()
+        cat_group = os.path.basename(path).replace(".py", "")
+
+        if lazy:
+            top_cat, cats = utils.grammar_categories(data, path)
+            if top_cat is not None:
+                self.set_cat_group_top_level_cat(cat_group, top_cat)
+            self._add_lazy_grammar(path, (cat_group,), cats)
+            return
+
+        self._grammar_paths.append(os.path.abspath(path))
+
         code = compile(data, path, "exec")
         locals_ = {"GRAMFUZZER": self, "__file__": path}
         exec(code, locals_, locals_)
 
         if "TOP_CAT" in locals_:
-            cat_group = os.path.basename(path).replace(".py", "")
             self.set_cat_group_top_level_cat(cat_group, locals_["TOP_CAT"])
 
+    def _load_declarative_grammar(self, path, lazy):
+        """Load the declarative grammar file ``path`` (see :any:`gramfuzz.GramFuzzer.load_grammar`)
+        """
+        import gramfuzz.declarative
+
+        with utils.file_open(path, "r") as f:
+            if lazy:
+                top_cats, cats = gramfuzz.declarative.read_header(f)
+                for cat_group, top_cat in six.iteritems(top_cats):
+                    if top_cat is not None:
+                        self.set_cat_group_top_level_cat(cat_group, top_cat)
+                self._add_lazy_grammar(path, tuple(top_cats.keys()), cats)
+                return
+
+            self._grammar_paths.append(os.path.abspath(path))
+            cat_group = os.path.basename(path).replace(".json", "")
+            gramfuzz.declarative.load(self, f, cat_group)
+
+    def _add_lazy_grammar(self, path, cat_groups, cats):
+        with self._lazy_lock:
+            self._lazy_grammars.append((path, cat_groups, cats))
+            # categories that lazy grammars were already loaded for may
+            # also be defined in this grammar
+            self._lazy_cats.clear()
+
+    def export_grammar(self, path, cat_groups=None):
+        """Write the loaded rule definitions to the declarative grammar file
+        ``path`` (see :any:`gramfuzz.declarative`), which can be loaded with
+        :any:`gramfuzz.GramFuzzer.load_grammar` without executing any Python code.
+        Raises a ``GramFuzzError`` if any of the rules use field classes that cannot
+        be written to grammar files.
+
+        :param str path: The path of the grammar file (should end in ``.json``)
+        :param list cat_groups: The category groups whose rules to write (default=``None``, all rules)
+        """
+        import gramfuzz.declarative
+        gramfuzz.declarative.save(self, path, cat_groups)
+
+    def _load_lazy_grammars(self, cats, cat_group=None):
+        """Load the lazy grammars that define any of the categories ``cats``,
+        belong to the category group ``cat_group``, or whose categories are not
+        known (see :any:`gramfuzz.GramFuzzer.load_grammar`).
+
+        :param set cats: The categories to load the grammars of
+        :param str cat_group: The category group to load the grammars of
+        :returns: Whether any grammars were loaded
+        """
+        with self._lazy_lock:
+            to_load = [x for x in self._lazy_grammars if cat_group in x[1] or x[2] is None or not x[2].isdisjoint(cats)]
+            if len(to_load) == 0:
+                return False
+
+            # rule definitions of grammars are never staged, even if they are
+            # loaded while a rule is being generated
+            ctx = context.current()
+            staging = ctx.staging
+            ctx.staging = False
+            try:
+                for grammar in to_load:
+                    if grammar not in self._lazy_grammars:
+                        continue
+                    self._lazy_grammars.remove(grammar)
+
+                    modules = set(sys.modules.keys())
+                    self.load_grammar(grammar[0])
+
+                    # grammars imported by the loaded grammar (e.g. "import gram2")
+                    # have already defined their rules
+                    imported = set()
+                    for name in set(sys.modules.keys()) - modules:
+                        mod_path = getattr(sys.modules[name], "__file__", None)
+                        if mod_path is not None:
+                            imported.add(os.path.splitext(os.path.abspath(mod_path))[0])
+                    self._lazy_grammars = [
+                        x for x in self._lazy_grammars
+                        if os.path.splitext(os.path.abspath(x[0]))[0] not in imported
+                    ]
+            finally:
+                ctx.staging = staging
+            return True
+
+    def _load_reachable_grammars(self, cat):
+        """Load the lazy grammars that define the category ``cat``, and the lazy
+        grammars that define categories referenced by the loaded rules, until
+        all categories the rules may reference are loaded.
+
+        :param str cat: The category rules are being generated from
+        """
+        with self._lazy_lock:
+            # only rules that were added since the rules were last preprocessed
+            # can reference categories that were not loaded yet
+            scan = not self._rules_processed or len(self._lazy_cats) == 0
+            new_cats = set([cat]) - self._lazy_cats
+
+            while len(self._lazy_grammars) > 0 and (len(new_cats) > 0 or scan):
+                self._lazy_cats.update(new_cats)
+                if not self._load_lazy_grammars(new_cats) and not scan:
+                    break
+                scan = False
+
+                ref_cats = set()
+                for cat_defs in list(self.defs.values()):
+                    for rules in list(cat_defs.values()):
+                        for rule in rules:
+                            ref_cats.update(ref.cat for ref in self._collect_refs(rule))
+                new_cats = ref_cats - self._lazy_cats
+
+    def save_snapshot(self, path):
+        """Save the loaded rules, including their preprocessed shortest
+        reference-paths, to a snapshot file that can be loaded with
+        :any:`gramfuzz.GramFuzzer.load_snapshot` much faster than the grammar
+        files themselves (Python 3.8+). See :any:`gramfuzz.snapshot`.
+
+        :param str path: The path of the snapshot file
+        """
+        import gramfuzz.snapshot
+        gramfuzz.snapshot.save(self, path)
+
+    def load_snapshot(self, path):
+        """Replace the rules of this fuzzer with the rules in the snapshot file
+        ``path`` (see :any:`gramfuzz.GramFuzzer.save_snapshot`). Snapshots are
+        out of date once any of the grammar files they were created from changed.
+
+        :param str path: The path of the snapshot file
+        :returns: Whether the snapshot was loaded, ``False`` if it does not exist or is out of date
+        """
+        import gramfuzz.snapshot
+        return gramfuzz.snapshot.load(self, path)
+
     def set_max_recursion(self, level):
         """Set the maximum reference-recursion depth (not the Python system maximum stack
         recursion level). This controls how many levels deep of nested references are allowed
         before gramfuzz attempts to generate the shortest (reference-wise) rules possible.
+        See :any:`gramfuzz.GramFuzzer.recursion` for which references are counted.
+
+        This sets the default of all threads. Pass ``max_recursion`` to
+        :any:`gramfuzz.GramFuzzer.gen` to use a different max recursion for the
+        rules generated by a single call, e.g. from several threads at once.
 
         :param int level: The new maximum reference level
         """
         import gramfuzz.fields
         gramfuzz.fields.Ref.max_recursion = level
 
+    def set_engine(self, engine):
+        """Set the generation engine used by :any:`gramfuzz.GramFuzzer.gen`.
+        See :any:`gramfuzz.GramFuzzer.engine` for the available engines.
+
+        :param str engine: The name of the engine
+        """
+        if engine not in self.engines:
+            raise errors.GramFuzzError("unknown engine {!r}, must be one of: {}".format(
+                engine,
+                ", ".join(self.engines),
+            ))
+        self.engine = engine
+
+    def set_recursion(self, recursion):
+        """Set how references are counted towards the max recursion. See
+        :any:`gramfuzz.GramFuzzer.recursion` for the available modes.
+
+        :param str recursion: The name of the mode
+        """
+        if recursion not in self.recursion_modes:
+            raise errors.GramFuzzError("unknown recursion mode {!r}, must be one of: {}".format(
+                recursion,
+                ", ".join(self.recursion_modes),
+            ))
+        self.recursion = recursion
+        self._recursion_rules = None
+
+    def _get_recursion_rules(self):
+        """Return the rules used to create the :any:`gramfuzz.context.Recursion`
+        of each generated rule, or ``None`` if every reference is counted the
+        ``"global"`` way and no rule definition sets its own max recursion.
+        """
+        rules = self._recursion_rules
+        if rules is None:
+            rules = self._recursion_rules = self._find_recursion_rules()
+        if self.recursion == "global" and len(rules) == 0:
+            return None
+        return rules
+
+    def _find_recursion_rules(self):
+        """Determine the key each rule's nesting is counted under, and the lowest
+        max recursion set by the rule's definitions.
+
+        :returns: A dict of ``(category, rule name)`` -> ``(key, max recursion)``
+        """
+        import gramfuzz.fields as fields
+
+        limits = {}
+        for cat, cat_defs in six.iteritems(self.defs):
+            for rule_name, rules in six.iteritems(cat_defs):
+                limit = None
+                for rule in rules:
+                    rule_limit = getattr(rule, "max_recursion", None) if isinstance(rule, fields.Def) else None
+                    if rule_limit is not None and (limit is None or rule_limit < limit):
+                        limit = rule_limit
+                limits[(cat, rule_name)] = limit
+
+        if self.recursion == "global":
+            return dict((key, (None, limit)) for key, limit in six.iteritems(limits) if limit is not None)
+
+        if self.recursion == "rule":
+            return dict((key, (key, limit)) for key, limit in six.iteritems(limits))
+
+        components = self._find_rule_components()
+        return dict((key, (components[key], limit)) for key, limit in six.iteritems(limits))
+
+    def _find_rule_components(self):
+        """Find the strongly connected components of the rule graph, in which
+        every rule references the rules its definitions (or the fields within
+        them) refer to.
+
+        :returns: A dict of ``(category, rule name)`` -> the index of the rule's component
+        """
+        edges = {}
+        for cat, cat_defs in six.iteritems(self.defs):
+            for rule_name, rules in six.iteritems(cat_defs):
+                targets = edges[(cat, rule_name)] = []
+                for rule in rules:
+                    for ref in self._collect_refs(rule):
+                        ref_defs = self.defs.get(ref.cat, {})
+                        if ref.refname == "*":
+                            targets.extend((ref.cat, x) for x in ref_defs.keys())
+                        elif ref.refname in ref_defs:
+                            targets.append((ref.cat, ref.refname))
+
+        # Tarjan's algorithm, without recursing so that long chains of rules
+        # don't exceed Python's maximum recursion depth
+        components = {}
+        num_components = 0
+        indices = {}
+        lowlinks = {}
+        on_stack = set()
+        stack = []
+        for root in edges.keys():
+            if root in indices:
+                continue
+            work = [(root, 0)]
+            while len(work) > 0:
+                node, edge_idx = work.pop()
+                if edge_idx == 0:
+                    indices[node] = lowlinks[node] = len(indices)
+                    stack.append(node)
+                    on_stack.add(node)
+
+                targets = edges[node]
+                while edge_idx < len(targets):
+                    target = targets[edge_idx]
+                    edge_idx += 1
+                    if target not in indices:
+                        work.append((node, edge_idx))
+                        work.append((target, 0))
+                        break
+                    if target in on_stack:
+                        lowlinks[node] = min(lowlinks[node], indices[target])
+                else:
+                    if lowlinks[node] == indices[node]:
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            components[member] = num_components
+                            if member == node:
+                                break
+                        num_components += 1
+                    if len(work) > 0:
+                        parent = work[-1][0]
+                        lowlinks[parent] = min(lowlinks[parent], lowlinks[node])
+
+        return components
+
+    def _get_builder(self):
+        """Return the function used to build a value with the current engine. The
+        returned function has the same signature as :any:`gramfuzz.utils.val`.
+        """
+        if self.engine == "stack":
+            import gramfuzz.engine
+            return gramfuzz.engine.build
+        elif self.engine == "compiled":
+            if self._compiled is None:
+                import gramfuzz.compiler
+                self._compiled = gramfuzz.compiler.compile_rules(self, cache_dir=self.compile_cache)
+            return self._compiled.build
+        return utils.val
+
     def preprocess_rules(self):
-        """Calculate shortest reference-paths of each rule (and Or field),
-        and prune all unreachable rules.
+        """Calculate shortest reference-paths of each rule, prune all
+        unreachable rules, and bind the references of the remaining
+        rules to the rule definitions they refer to.
+
+        The cost of each rule and ``Or`` value is estimated as the number of
+        bytes and the number of references it builds with ``shortest=True``.
+        Of the values of each ``Or`` field with the shortest reference-paths, only
+        the cheapest ones are built with ``shortest=True``, counting every reference
+        as one byte. Fields such as ``Int`` and ``String`` count as the average
+        size of the values they build.
         """
         to_prune = self._find_shortest_paths()
         self._prune_rules(to_prune)
+        self._bind_refs()
 
         self._rules_processed = True
+        self._compiled = None
+        self._recursion_rules = None
+
+    def _update_rules(self):
+        """Preprocess the rule definitions that were added since the rules
+        were last preprocessed (see :any:`gramfuzz.GramFuzzer.preprocess_rules`),
+        only updating the shortest reference-paths of rules that reference
+        the new definitions. All rules are preprocessed if they never were.
+        """
+        if self._new_defs is None:
+            self.preprocess_rules()
+            return
+
+        new_defs = self._new_defs
+        to_prune = self._update_shortest_paths()
+        pruned = self._prune_rules(to_prune)
+        self._bind_refs([x for x in new_defs if id(x[2]) not in pruned])
+
+        self._rules_processed = True
+        self._compiled = None
+        self._recursion_rules = None
 
     def _find_shortest_paths(self):
-        leaf_rules = deque()
-        non_leaf_rules = deque()
+        """Calculate the shortest reference-path length of every rule, and
+        choose the shortest values of the ``Or`` fields in the rules.
+
+        Rules that reference other rules are processed in the order they are
+        in ``defs``, sweeping over the remaining rules again and again until no
+        more rules can be processed. A rule is processed the first time it is
+        reached once all of the references it needs have a length, and its
+        length is calculated from the lengths known at that time. Rules are
+        only checked again when one of the rules they reference gets its first
+        length, instead of trying every remaining rule in every sweep.
+
+        :returns: A list of the indices in ``_ref_rules`` of the rules that could not be processed (and should be pruned)
+        """
+        non_leaf_rules = []
         rule_ref_lengths = {}
 
+        # (cat, rule name) -> indices in non_leaf_rules of the rules that
+        # reference it
+        dependents = {}
+
         # first find all rule definitions that *don't* have
         # any references - these are the leaf nodes
+        leaf_rules = []
         for cat in self.defs.keys():
             for rule_name, rules in six.iteritems(self.defs.get(cat, {})):
                 for rule in rules:
                     refs = self._collect_refs(rule)
                     if len(refs) == 0:
-                        leaf_rules.append(rule)
-
-                        if not hasattr(rule, "name"):
-                            rule_ref_lengths[cat + "-:-" + str(rule)] = (0, [rule])
-                        else:
-                            rule_ref_lengths[cat + "-:-" + rule.name] = (0, [rule])
+                        rule_ref_lengths[self._rule_key(cat, rule)] = (0, True)
+                        leaf_rules.append((cat, rule))
                     else:
-                        if not hasattr(rule, "unprocessed_refs"):
-                            rule.unresolved_refs = deque()
-                        rule.unresolved_refs.extend(refs)
-                        non_leaf_rules.append((cat, rule))
+                        self._add_dependent(cat, rule, refs, non_leaf_rules, dependents)
+
+        # rules that can be processed are kept in two heaps of their indices:
+        # those that will be reached in the current sweep (after the index
+        # of the last processed rule), and those reached in the next one
+        state = [_WAITING] * len(non_leaf_rules)
+        this_sweep = []
+        next_sweep = []
+        for idx, (cat, rule) in enumerate(non_leaf_rules):
+            if self._process_shortest_ref(cat, rule, rule_ref_lengths) is not None:
+                state[idx] = _READY
+                this_sweep.append(idx)
 
         # for every referenced rule, determine how many steps away
         # from a leaf node it is
-        post_process = deque()
-        unprocessed_count = 0
-        while len(non_leaf_rules) > 0:
-            # this means we've looped twice over everything
-            # without being able to process the remaining nodes
-            if unprocessed_count // len(non_leaf_rules) == 2:
-                break
+        post_process = []
+        while True:
+            if len(this_sweep) == 0:
+                if len(next_sweep) == 0:
+                    break
+                this_sweep, next_sweep = next_sweep, this_sweep
 
-            cat, curr_rule = non_leaf_rules.popleft()
+            curr_idx = heapq.heappop(this_sweep)
+            cat, curr_rule = non_leaf_rules[curr_idx]
+            state[curr_idx] = _PROCESSED
 
             ref_length = self._process_shortest_ref(cat, curr_rule, rule_ref_lengths)
+
+            ref_key = (cat, curr_rule.name)
+            ref_info = rule_ref_lengths.get(ref_key, None)
+            if ref_info is None or ref_length < ref_info[0]:
+                rule_ref_lengths[ref_key] = (ref_length, False)
+
+            post_process.append((cat, curr_rule))
+
+            if ref_info is not None:
+                continue
+
+            # the first length of this rule may let rules that reference it
+            # be processed
+            for idx in dependents.get(ref_key, []):
+                if state[idx] != _WAITING:
+                    continue
+                dep_cat, dep_rule = non_leaf_rules[idx]
+                if self._process_shortest_ref(dep_cat, dep_rule, rule_ref_lengths) is None:
+                    continue
+                state[idx] = _READY
+                heapq.heappush(this_sweep if idx > curr_idx else next_sweep, idx)
+
+        self._ref_lengths = rule_ref_lengths
+        self._ref_rules = non_leaf_rules
+        self._ref_dependents = dependents
+        self._ref_states = state
+        self._new_defs = []
+
+        self._rule_costs = {}
+        self._budget_costs = {}
+        self._lower_rule_costs(leaf_rules + post_process)
+        self._assign_or_shortest_vals(leaf_rules + post_process, rule_ref_lengths)
+        self._or_ref_vals.clear()
+
+        # these should be pruned
+        return [idx for idx in six.moves.range(len(non_leaf_rules)) if state[idx] != _PROCESSED]
+
+    def _update_shortest_paths(self):
+        """Update the shortest reference-path lengths of the rules, and the
+        shortest values of their ``Or`` fields, with the rule definitions that
+        were added since the shortest paths were last found.
+
+        The new rules are processed first. Whenever the length of a rule is
+        found for the first time or becomes shorter, the rules that reference
+        it are processed again, until no more lengths change. The costs of the
+        rules are lowered the same way (they never become more expensive until
+        all rules are preprocessed again), and the ``Or`` fields of every rule
+        that was processed, or whose cost may have changed, are then updated.
+
+        :returns: A list of the indices in ``_ref_rules`` of the new rules that could not be processed (and should be pruned)
+        """
+        rule_ref_lengths = self._ref_lengths
+        non_leaf_rules = self._ref_rules
+        dependents = self._ref_dependents
+        state = self._ref_states
+        new_defs, self._new_defs = self._new_defs, []
+
+        new_idxs = []
+        new_leaf_rules = []
+        to_process = deque()
+        for cat, def_name, rule in new_defs:
+            refs = self._collect_refs(rule)
+            if len(refs) == 0:
+                new_leaf_rules.append((cat, rule))
+                ref_key = self._rule_key(cat, rule)
+                if rule_ref_lengths.get(ref_key, None) != (0, True):
+                    rule_ref_lengths[ref_key] = (0, True)
+                    to_process.extend(dependents.get(ref_key, []))
+            else:
+                idx = self._add_dependent(cat, rule, refs, non_leaf_rules, dependents)
+                state.append(_WAITING)
+                new_idxs.append(idx)
+                to_process.append(idx)
+
+        processed = set()
+        while len(to_process) > 0:
+            idx = to_process.popleft()
+            if state[idx] == _PRUNED:
+                continue
+            cat, rule = non_leaf_rules[idx]
+
+            ref_length = self._process_shortest_ref(cat, rule, rule_ref_lengths)
             if ref_length is None:
-                non_leaf_rules.append((cat, curr_rule))
-                unprocessed_count += 1
                 continue
+            state[idx] = _PROCESSED
+            processed.add(idx)
+
+            ref_key = (cat, rule.name)
+            ref_info = rule_ref_lengths.get(ref_key, None)
+            if ref_info is None or ref_length < ref_info[0]:
+                rule_ref_lengths[ref_key] = (ref_length, False)
+                to_process.extend(dependents.get(ref_key, []))
+
+        processed.update(self._lower_rule_costs(
+            new_leaf_rules + [non_leaf_rules[idx] for idx in sorted(processed)]
+        ))
+        self._assign_or_shortest_vals(
+            new_leaf_rules + [non_leaf_rules[idx] for idx in sorted(processed)],
+            rule_ref_lengths,
+        )
+        self._or_ref_vals.clear()
 
-            unprocessed_count = 0
+        # these should be pruned
+        return [idx for idx in new_idxs if state[idx] != _PROCESSED]
 
-            ref_key = cat + "-:-" + curr_rule.name
-            if ref_key not in rule_ref_lengths or ref_length < rule_ref_lengths[ref_key][0]:
-                rule_ref_lengths[ref_key] = (ref_length, [curr_rule])
-            elif ref_length == rule_ref_lengths[ref_key][0]:
-                rule_ref_lengths[ref_key][1].append(curr_rule)
+    def _lower_rule_costs(self, rules):
+        """Lower the costs of the rules in ``_rule_costs`` to the costs of the
+        ``(cat, rule)`` tuples in ``rules``, if they are cheaper. Whenever the
+        cost of a rule is found for the first time or becomes cheaper, the rules
+        that reference it are checked again, cheapest rules first, until no more
+        costs change.
 
-            post_process.append((cat, curr_rule))
+        :returns: A set of the indices in ``_ref_rules`` of the rules that were checked again
+        """
+        rule_costs = self._rule_costs
+        queue = []
+        for cat, rule in rules:
+            self._lower_rule_cost(cat, rule, queue)
+
+        checked = set()
+        while len(queue) > 0:
+            key, ref_key = heapq.heappop(queue)
+            if _cost_key(rule_costs[ref_key]) != key:
+                continue
+            for idx in self._ref_dependents.get(ref_key, []):
+                if self._ref_states[idx] != _PROCESSED:
+                    continue
+                checked.add(idx)
+                dep_cat, dep_rule = self._ref_rules[idx]
+                self._lower_rule_cost(dep_cat, dep_rule, queue)
 
-        self._assign_or_shortest_vals(post_process, rule_ref_lengths)
+        return checked
 
-        if self.debug:
-            for cat, rule in non_leaf_rules:
-                if hasattr(rule, "unresolved_refs"):
-                    for ref in rule.unresolved_refs:
-                        if rule_ref_lengths.get(cat + "-:-" + ref.refname, None) is not None:
-                            continue
-                        print("Pruning rule {!r} due to unresolvable reference: {!r}".format(
-                            rule.name,
-                            ref.refname,
-                        ))
+    def _lower_rule_cost(self, cat, rule, queue):
+        """Lower the cost of the rule ``rule`` in ``_rule_costs`` to the cost
+        of the definition ``rule``, and push it onto the heap ``queue`` if it
+        is cheaper
+        """
+        cost = self._field_cost(rule)
+        if cost is None:
+            return
+        ref_key = self._rule_key(cat, rule)
+        curr_cost = self._rule_costs.get(ref_key, None)
+        if curr_cost is None or _cost_key(cost) < _cost_key(curr_cost):
+            self._rule_costs[ref_key] = cost
+            heapq.heappush(queue, (_cost_key(cost), ref_key))
+
+    def _field_cost(self, field):
+        """Estimate the cost of building ``field`` with ``shortest=True`` from
+        the costs in ``_rule_costs``
+
+        :returns: A tuple of the number of bytes and the number of references built, or ``None`` if it can't be determined yet
+        """
+        # strings, ints, hard-coded non-gramfuzz values (normalized to bytes
+        # by the fields)
+        if type(field) is six.binary_type:
+            return (len(field), 0)
+
+        import gramfuzz.fields as fields
+        if not isinstance(field, fields.Field):
+            return (len(utils.val(field)), 0)
+
+        if field.shortest_is_nothing:
+            return (0, 0)
+
+        if isinstance(field, fields.Ref):
+            cost = self._rule_costs.get((field.cat, field.refname), None)
+            if cost is None:
+                return None
+            return (cost[0], cost[1] + 1)
+
+        # Or fields build the cheapest of their values with the shortest
+        # reference paths, which have been found already
+        if isinstance(field, fields.Or):
+            min_vals = self._or_ref_vals.get(id(field), None)
+            if min_vals is None:
+                min_ref = None
+                min_vals = []
+                for idx, val in enumerate(field.values):
+                    val_ref = self._process_shortest_ref(None, val, self._ref_lengths)
+                    if val_ref is None:
+                        continue
+                    elif min_ref is None or val_ref < min_ref:
+                        min_ref = val_ref
+                        min_vals = [(val, idx)]
+                    elif val_ref == min_ref:
+                        min_vals.append((val, idx))
+                self._or_ref_vals[id(field)] = min_vals
+
+            return self._cheapest_vals(min_vals)[1]
+
+        if isinstance(field, fields.Int):
+            size = field._mean_size()
+            if field.value is None:
+                return (size, 0)
+            # the value is built half of the time
+            cost = self._field_cost(field.value)
+            if cost is None:
+                return None
+            return ((size + cost[0]) / 2.0, cost[1])
+
+        # Defs, Ands, Joins, etc build all of their values, except for
+        # Joins with a max, which build their first value once (and
+        # spend a node of budgets on it)
+        if hasattr(field, "values"):
+            vals = field.values
+            num_bytes = 0
+            num_nodes = 0
+            if isinstance(field, fields.Join) and field.max is not None:
+                vals = vals[:1]
+                num_nodes = 1
+
+            num_vals = 0
+            for val in vals:
+                cost = self._field_cost(val)
+                if cost is None:
+                    return None
+                num_bytes += cost[0]
+                num_nodes += cost[1]
+                if not getattr(val, "shortest_is_nothing", False):
+                    num_vals += 1
+
+            num_bytes += len(getattr(field, "sep", b"")) * max(num_vals - 1, 0)
+            if isinstance(field, fields.Q):
+                if field.escape or field.html_js_escape:
+                    num_bytes += 2
                 else:
-                    print("Pruning rule {!r}".format(rule.name))
+                    num_bytes += 2 * len(field.quote)
+            return (num_bytes, num_nodes)
 
-        # these should be pruned
-        return non_leaf_rules
+        # other fields don't reference any rules, and their size isn't known
+        return (0, 0)
+
+    def _assign_budget_costs(self, field):
+        """Record the costs in ``_budget_costs`` that budgets choose the values
+        of the ``Or`` field ``field`` by, or that they limit the repetitions of
+        the ``Join`` field ``field`` by (see :any:`gramfuzz.context.Budget`)
+        """
+        import gramfuzz.fields as fields
 
-    def _prune_rules(self, non_leaf_rules):
-        for cat,rule in non_leaf_rules:
+        if isinstance(field, fields.Or):
+            costs = []
+            for val in field.values:
+                cost = self._field_cost(val)
+                costs.append(_UNKNOWN_COST if cost is None else cost)
+            max_cost = (max(x[0] for x in costs), max(x[1] for x in costs))
+            self._budget_costs[field] = (costs, max_cost)
+
+        elif isinstance(field, fields.Join) and field.max is not None:
+            cost = self._field_cost(field.values[0])
+            if cost is not None:
+                self._budget_costs[field] = (cost[0] + len(field.sep), cost[1] + 1)
+
+    def _cheapest_vals(self, vals):
+        """Find the ``(value, index)`` tuples in ``vals`` with the lowest cost
+        (see ``_field_cost``)
+
+        :returns: A tuple of the cheapest tuples (all of them if none of the costs are known) and their cost
+        """
+        min_cost = None
+        min_key = None
+        min_vals = []
+        for val, idx in vals:
+            cost = self._field_cost(val)
+            if cost is None:
+                continue
+            key = _cost_key(cost)
+            if min_key is None or key < min_key:
+                min_cost = cost
+                min_key = key
+                min_vals = [(val, idx)]
+            elif key == min_key:
+                min_vals.append((val, idx))
+
+        if len(min_vals) == 0:
+            return vals, None
+        return min_vals, min_cost
+
+    def _rule_key(self, cat, rule):
+        """Return the key of ``rule`` in the shortest reference-path lengths
+        """
+        # rules added with add_definition are not always Defs
+        if not hasattr(rule, "name"):
+            return (cat, str(rule))
+        return (cat, rule.name)
+
+    def _add_dependent(self, cat, rule, refs, non_leaf_rules, dependents):
+        """Add the rule ``rule`` to ``non_leaf_rules``, and record it as a
+        dependent of each rule referenced in ``refs``.
+
+        :returns: The index of the rule in ``non_leaf_rules``
+        """
+        idx = len(non_leaf_rules)
+        non_leaf_rules.append((cat, rule))
+        for ref_key in set((ref.cat, ref.refname) for ref in refs):
+            dependents.setdefault(ref_key, []).append(idx)
+        return idx
+
+    def _prune_rules(self, to_prune):
+        """Remove the rules at the indices ``to_prune`` of ``_ref_rules`` from
+        ``defs``, unless they were defined with ``no_prune``.
+
+        :returns: A set of the ids of the removed rules
+        """
+        if self.debug:
+            for idx in to_prune:
+                cat, rule = self._ref_rules[idx]
+                for ref in self._collect_refs(rule):
+                    if self._ref_lengths.get((ref.cat, ref.refname), None) is not None:
+                        continue
+                    print("Pruning rule {!r} due to unresolvable reference: {!r}".format(
+                        rule.name,
+                        ref.refname,
+                    ))
+
+        # the ids of the rules to remove, by category and rule name
+        pruned = {}
+        removed = set()
+        for idx in to_prune:
+            cat, rule = self._ref_rules[idx]
             if cat in self.no_prunes and rule.name in self.no_prunes[cat]:
                 if self.debug:
                     print("Should prune {!r}, but no_prune = True".format(
                         rule.name,
                     ))
                 continue
-
-            rule_list = self.defs.get(cat, {}).get(rule.name, [])
-            rule_list.remove(rule)
+            pruned.setdefault((cat, rule.name), set()).add(id(rule))
+            removed.add(id(rule))
+            self._ref_states[idx] = _PRUNED
+            self._ref_rules[idx] = None
+
+        for (cat, rule_name), rule_ids in six.iteritems(pruned):
+            cat_defs = self.defs.get(cat, {})
+            rule_list = cat_defs.get(rule_name, [])
+            # change the list in place, references are bound to it
+            rule_list[:] = [rule for rule in rule_list if id(rule) not in rule_ids]
             if len(rule_list) == 0:
-                del self.defs.get(cat, {})[rule.name]
+                del cat_defs[rule_name]
+                self._defs_version += 1
+
+        return removed
+
+    def _bind_refs(self, new_defs=None):
+        """Bind the references of every rule, so that unresolvable references
+        are found now instead of while generating rules
+
+        :param list new_defs: If set, only bind the references of the ``(cat, rule name, rule)``
+            tuples in ``new_defs``, and the references that could not be bound before
+        """
+        if new_defs is None:
+            unbound_refs = []
+            new_defs = (
+                (cat, rule_name, rule)
+                for cat in self.defs.keys()
+                for rule_name, rules in six.iteritems(self.defs[cat])
+                for rule in rules
+            )
+        else:
+            unbound_refs = [x for x in self.unbound_refs if not self._bind_ref(x[1], x[2])]
+
+        for cat, rule_name, rule in new_defs:
+            for ref in self._collect_refs(rule):
+                if not self._bind_ref(rule_name, ref):
+                    unbound_refs.append((cat, rule_name, ref))
+        self.unbound_refs = unbound_refs
+
+    def _bind_ref(self, rule_name, ref):
+        """Bind the reference ``ref`` in the rule named ``rule_name``
+
+        :returns: Whether the reference could be bound
+        """
+        try:
+            ref._bind()
+        except errors.GramFuzzError as e:
+            if self.debug:
+                print("Rule {!r} has an unresolvable reference: {}".format(
+                    rule_name,
+                    e,
+                ))
+            return False
+        return True
 
     def _assign_or_shortest_vals(self, fields, rule_ref_lengths):
+        """Choose the values of the ``Or`` fields in the ``(cat, rule)`` tuples
+        of ``fields`` that are built with ``shortest=True``: the cheapest of the
+        values with the shortest reference-paths (see ``_field_cost``)
+        """
         for cat,field in fields:
             self._process_shortest_ref(cat, field, rule_ref_lengths, assign_or=True)
 
@@ -242,7 +1073,15 @@ class GramFuzzer(object):
         import gramfuzz.fields as fields
 
         # strings, ints, hard-coded non-gramfuzz values
-        if not isinstance(field, fields.Field) or getattr(field, "shortest_is_nothing", False):
+        if not isinstance(field, fields.Field):
+            return 0
+        if field.shortest_is_nothing:
+            # the values are never built with shortest=True, but budgets
+            # still need the costs of their Or and Join fields
+            if assign_or and hasattr(field, "values"):
+                for val in field.values:
+                    self._process_shortest_ref(cat, val, rule_ref_lengths, assign_or=True)
+                self._assign_budget_costs(field)
             return 0
 
         # return None if it can't be determined yet
@@ -268,10 +1107,14 @@ class GramFuzzer(object):
                 return None
 
             if assign_or:
+                # only the cheapest of the values with the shortest reference
+                # paths are built
+                min_vals = self._cheapest_vals(min_vals)[0]
                 # WeightedOr needs to know the indices of the values that are
                 # shortest to be able to use the correct weights
                 field.shortest_vals = [x[0] for x in min_vals]
                 field.shortest_indices = [x[1] for x in min_vals]
+                self._assign_budget_costs(field)
 
             return min_ref
 
@@ -297,27 +1140,29 @@ class GramFuzzer(object):
 
             if max_ref_length == -1:
                 return None
+            if assign_or:
+                self._assign_budget_costs(field)
             return max_ref_length
 
         if isinstance(field, fields.Ref):
-            ref_key = field.cat + "-:-" + field.refname
-            ref_val = rule_ref_lengths.get(ref_key, (-1, []))[0]
-            if ref_val == -1:
+            ref_info = rule_ref_lengths.get((field.cat, field.refname), None)
+            if ref_info is None:
                 return None
-            ref_rule_val = rule_ref_lengths[ref_key][1][0]
+            ref_val, is_leaf = ref_info
 
             # if the referenced value is a native python type,
             # don't increment the reference value
             #
             # E.g. If it's a Ref("string"), and Def("string") doesn't contain
             # any references, don't increment the value
-            if ref_val == 0 and len(self._collect_refs(ref_rule_val)) == 0:
+            if ref_val == 0 and is_leaf:
                 return 0
                 
             # add one if the reference value is more than 0
             return ref_val + 1
 
-        return None
+        # other fields (Int, String, etc) don't reference any rules
+        return 0
 
     def _collect_refs(self, item_val, acc=None, no_opt=False):
         if acc is None:
@@ -352,19 +1197,41 @@ class GramFuzzer(object):
             be pruned even if it has been determined to be unreachable (default=``False``)
         :param str gram_file: The file the rule was defined in (default=``"default"``).
         """
-        self._rules_processed = False
-
         self.add_to_cat_group(cat, gram_file, def_name)
 
         if no_prune:
             self.no_prunes.setdefault(cat, {}).setdefault(def_name, True)
 
-        if self._staged_defs is not None:
+        ctx = context.current()
+        if ctx.staging:
             # if we're tracking changes during rule generation, add any new rules
-            # to _staged_defs so they can be reverted if something goes wrong
-            self._staged_defs.append((cat, def_name, def_val))
+            # to staged_defs so they can be reverted if something goes wrong
+            if ctx.staged_defs is None:
+                ctx.staged_defs = context.StagedDefs(self.defs)
+            ctx.staged_defs.add(cat, def_name, def_val)
         else:
-            self.defs.setdefault(cat, {}).setdefault(def_name, deque()).append(def_val)
+            self._commit_definition(cat, def_name, def_val)
+
+    def _commit_definition(self, cat, def_name, def_val):
+        """Add the rule definition to ``defs``. Definitions of a rule are kept
+        in the same list for as long as the rule exists, so only adding
+        a new rule name invalidates the rules bound by :any:`gramfuzz.GramFuzzer.bind_ref`.
+        """
+        self._rules_processed = False
+        self._compiled = None
+        self._recursion_rules = None
+
+        cat_defs = self.defs.setdefault(cat, {})
+        rules = cat_defs.get(def_name, None)
+        if rules is None:
+            # lists are much smaller than deques, which matters for
+            # grammars with many rules
+            rules = cat_defs[def_name] = []
+            self._defs_version += 1
+        rules.append(def_val)
+
+        if self._new_defs is not None:
+            self._new_defs.append((cat, def_name, def_val))
 
     def set_cat_group_top_level_cat(self, cat_group, top_level_cat):
         """Set the default category when generating data from the grammars defined
@@ -396,19 +1263,44 @@ class GramFuzzer(object):
             ``"*"``, then a rule name will be chosen at random from within the category ``cat``.
         :returns: gramfuzz.fields.Def
         """
+        binding = None
+        staged_defs = context.current().staged_defs
+        if staged_defs is not None:
+            # rule definitions staged while generating the current rule
+            binding = staged_defs.bind_ref(cat, refname)
+        if binding is None:
+            binding = self.bind_ref(cat, refname)
+
+        rules, cat_defs = binding
+        if cat_defs is not None:
+            rules = cat_defs[rand.choice(rules)]
+        return rand.choice(rules)
+
+    def bind_ref(self, cat, refname):
+        """Look up the rule definitions that references to ``refname`` in the
+        category ``cat`` choose from. The result stays valid until a rule name
+        is added to or removed from one of the categories.
+
+        :param str cat: The category to look for the rule in.
+        :param str refname: The name of the rule definition, or ``"*"``
+        :returns: A tuple of the list of rule definitions and ``None``, or for
+            ``"*"`` references, a tuple of the rule names in the category and the
+            rule definitions of the category by rule name
+        """
         if cat not in self.defs:
             raise errors.GramFuzzError("referenced definition category ({!r}) not defined".format(cat))
-        
+
+        cat_defs = self.defs[cat]
         if refname == "*":
-            refname = rand.choice(list(self.defs[cat].keys()))
-            
-        if refname not in self.defs[cat]:
+            return tuple(cat_defs.keys()), cat_defs
+
+        if refname not in cat_defs:
             raise errors.GramFuzzError("referenced definition ({!r}) not defined".format(refname))
 
-        return rand.choice(self.defs[cat][refname])
+        return cat_defs[refname], None
 
 
-    def gen(self, num, cat=None, cat_group=None, preferred=None, preferred_ratio=0.5, max_recursion=None, auto_process=True):
+    def gen(self, num, cat=None, cat_group=None, preferred=None, preferred_ratio=0.5, max_recursion=None, auto_process=True, sink=None, budget=None):
         """Generate ``num`` rules from category ``cat``, optionally specifying
         preferred category groups ``preferred`` that should be preferred at
         probability ``preferred_ratio`` over other randomly-chosen rule definitions.
@@ -423,17 +1315,162 @@ class GramFuzzer(object):
         :param float preferred_ratio: The percent probability that the preferred
             groups will be chosen over randomly choosen rule definitions from category ``cat``.
         :param int max_recursion: The maximum amount to allow references to recurse
+            while generating these rules (default=``None``, see :any:`gramfuzz.GramFuzzer.set_max_recursion`)
         :param bool auto_process: Whether rules should be automatically pruned and
             shortest reference paths determined. See :any:`gramfuzz.GramFuzzer.preprocess_rules`
             for what would automatically be done.
+        :param callable sink: If set, each generated value is passed to ``sink``
+            as soon as it is built instead of being collected and returned. See
+            :any:`gramfuzz.GramFuzzer.gen_iter`.
+        :param gramfuzz.context.Budget budget: The limits on the size of each generated
+            rule (default=``None``, only the max recursion limits it). See :any:`gramfuzz.context.Budget`.
+        :returns: A ``deque`` of the generated values, or ``None`` if ``sink`` is set
         """
-        import gramfuzz.fields
-        gramfuzz.fields.REF_LEVEL = 1
+        cat, preferred = self._gen_setup(cat, cat_group, preferred, auto_process)
+
+        if sink is not None:
+            for sample in self._gen_samples(num, cat, preferred, preferred_ratio, max_recursion=max_recursion, budget=budget):
+                for item in sample:
+                    sink(item)
+            return None
+
+        res = deque()
+        for sample in self._gen_samples(num, cat, preferred, preferred_ratio, res=res, max_recursion=max_recursion, budget=budget):
+            pass
+        return res
+
+    def gen_iter(self, num=None, cat=None, cat_group=None, preferred=None, preferred_ratio=0.5, max_recursion=None, auto_process=True, budget=None):
+        """Lazily generate ``num`` rules. This accepts the same arguments as
+        :any:`gramfuzz.GramFuzzer.gen` and yields the same values that ``gen``
+        would have returned (the prerequisites of each rule, followed by the rule
+        itself), but each value is yielded as soon as it is built. Only a single
+        generated rule is held in memory at a time.
+
+        Staged rule definitions are committed (see :any:`gramfuzz.GramFuzzer.post_revert`)
+        before the values of a rule are yielded. The ``res`` argument of
+        ``post_revert`` will only contain the values of the current rule.
+
+        Each rule is generated with the ``max_recursion`` of the iterator that
+        generates it, even if several iterators are consumed at a time.
+
+        .. code-block:: python
+
+            for value in fuzzer.gen_iter(cat="name", num=1000000):
+                outfile.write(value + b"\\n")
+
+        :param int num: The number of rules to generate, or ``None`` to generate rules forever
+        :returns: A generator of the generated values
+        """
+        cat, preferred = self._gen_setup(cat, cat_group, preferred, auto_process)
+        samples = self._gen_samples(num, cat, preferred, preferred_ratio, max_recursion=max_recursion, budget=budget)
+        return (item for sample in samples for item in sample)
+
+    def agen(self, num=None, cat=None, cat_group=None, preferred=None, preferred_ratio=0.5, max_recursion=None, auto_process=True, seed=None, chunksize=None, max_pending=None, executor=None, budget=None):
+        """Generate ``num`` rules without blocking the asyncio event loop
+        (Python 3.6+). This accepts the same arguments as :any:`gramfuzz.GramFuzzer.gen_iter`,
+        and returns an asynchronous iterator of the same values ``gen_iter``
+        yields.
+
+        Rules are generated ``chunksize`` at a time in ``executor``, and at most
+        ``max_pending`` generated chunks wait to be consumed at a time. See
+        :any:`gramfuzz.aio` for details.
+
+        .. code-block:: python
+
+            async for value in fuzzer.agen(cat="name", num=1000000):
+                await send(value)
+
+        :param int num: The number of rules to generate, or ``None`` to generate rules forever
+        :param int seed: The seed of the generation context the rules are generated with.
+            If ``None``, a seed is chosen with :any:`gramfuzz.rand`.
+        :param int chunksize: The number of rules to generate at a time (default=``None``, :any:`gramfuzz.aio.CHUNKSIZE`)
+        :param int max_pending: The maximum number of generated chunks waiting to be consumed (default=``None``, :any:`gramfuzz.aio.MAX_PENDING`)
+        :param executor: The ``concurrent.futures`` thread pool executor to generate rules in (default=``None``, the event loop's default executor)
+        :returns: An asynchronous generator of the generated values
+        """
+        import gramfuzz.aio
+
+        cat, preferred = self._gen_setup(cat, cat_group, preferred, auto_process)
+        return gramfuzz.aio.gen_samples(
+            self,
+            num,
+            cat,
+            preferred,
+            preferred_ratio,
+            max_recursion = max_recursion,
+            seed          = seed,
+            chunksize     = chunksize,
+            max_pending   = max_pending,
+            executor      = executor,
+            budget        = budget,
+        )
+
+    def gen_parallel(self, num, workers=None, seed=None, cat=None, cat_group=None, preferred=None, preferred_ratio=0.5, max_recursion=None, auto_process=True, sink=None, chunksize=None, budget=None):
+        """Generate ``num`` rules using a pool of ``workers`` processes. This
+        accepts the same arguments as :any:`gramfuzz.GramFuzzer.gen`, and returns
+        the values in the same format.
+
+        Every rule is generated with its own seed, derived from the base seed
+        ``seed`` and the index of the rule (see :any:`gramfuzz.rand.sample_seed`),
+        so the generated values are identical no matter how many workers are used,
+        and any single rule can be reproduced by its index. Rule definitions
+        that are added while generating a rule are discarded after the rule is
+        generated.
+
+        Worker processes that are forked from this process use this fuzzer's
+        rules directly. Other worker processes load a snapshot of this fuzzer's
+        rules (see :any:`gramfuzz.snapshot`) once, when they are started, or the
+        grammar files that were loaded with :any:`gramfuzz.GramFuzzer.load_grammar`
+        if no snapshot can be created.
+
+        :param int num: The number of rules to generate
+        :param int workers: The number of worker processes (default=``None``, the number of CPUs).
+            If ``1``, rules are generated in this process.
+        :param int seed: The base seed. If ``None``, a base seed is chosen with :any:`gramfuzz.rand`.
+        :param int chunksize: The number of rules each worker generates at a time
+        :returns: A ``deque`` of the generated values, or ``None`` if ``sink`` is set
+        """
+        import gramfuzz.parallel
+
+        cat, preferred = self._gen_setup(cat, cat_group, preferred, auto_process)
+        samples = gramfuzz.parallel.gen_samples(
+            self,
+            num,
+            workers         = workers,
+            seed            = seed,
+            cat             = cat,
+            preferred       = preferred,
+            preferred_ratio = preferred_ratio,
+            max_recursion   = max_recursion,
+            chunksize       = chunksize,
+            budget          = budget,
+        )
+
+        if sink is not None:
+            for sample in samples:
+                for item in sample:
+                    sink(item)
+            return None
+
+        res = deque()
+        for sample in samples:
+            res.extend(sample)
+        return res
+
+    def _gen_setup(self, cat, cat_group, preferred, auto_process):
+        """Validate the arguments of :any:`gramfuzz.GramFuzzer.gen` and prepare
+        the fuzzer for generating rules.
+
+        :returns: A tuple of the category to generate rules from and the list of preferred category groups
+        """
+        context.current().ref_level = 1
 
         if cat is None and cat_group is None:
             raise gramfuzz.errors.GramFuzzError("cat and cat_group are None, one must be set")
 
         if cat is None and cat_group is not None:
+            if len(self._lazy_grammars) > 0:
+                self._load_lazy_grammars((), cat_group)
             if cat_group not in self.cat_group_defaults:
                 raise gramfuzz.errors.GramFuzzError(
                     "cat_group {!r} did not define a TOP_CAT variable"
@@ -444,39 +1481,52 @@ class GramFuzzer(object):
                     "cat_group {!r}'s TOP_CAT variable was not a string"
                 )
 
-        if auto_process and self._rules_processed == False:
-            self.preprocess_rules()
+        if len(self._lazy_grammars) > 0:
+            self._load_reachable_grammars(cat)
 
-        if max_recursion is not None:
-            self.set_max_recursion(max_recursion)
+        if auto_process and self._rules_processed == False:
+            with self._process_lock:
+                if self._rules_processed == False:
+                    self._update_rules()
 
         if preferred is None:
             preferred = []
 
-        res = deque()
-            
+        return cat, preferred
+
+    def _gen_samples(self, num, cat, preferred, preferred_ratio, res=None, commit=True, max_recursion=None, budget=None):
+        """Generate ``num`` rules from category ``cat``, yielding a ``deque``
+        of the prerequisites of each rule followed by the rule itself.
+
+        :param list res: If set, the values of each rule are also added to ``res``,
+            which is then used as the ``res`` argument of :any:`gramfuzz.GramFuzzer.post_revert`.
+        :param bool commit: Whether rule definitions staged while generating each rule
+            should be committed (the default), or discarded so that every rule is
+            generated from the same set of rule definitions.
+        :param int max_recursion: The max recursion each rule is generated with
+            (default=``None``, :any:`gramfuzz.fields.Ref.max_recursion`)
+        :param gramfuzz.context.Budget budget: The limits on the size of each generated rule
+        """
         cat_defs = self.defs[cat]
 
         # optimizations
-        _res_append = res.append
-        _res_extend = res.extend
         _choice = rand.choice
         _maybe = rand.maybe
-        _val = utils.val
+        _val = self._get_builder()
 
         keys = list(self.defs[cat].keys())
 
-        self._last_pref_keys = self._get_pref_keys(cat, preferred)
-        # be sure to set this *after* fetching the pref keys (above^)
-        self._last_prefs = preferred
+        recursion_rules = self._get_recursion_rules()
+        limited = (recursion_rules is not None or budget is not None or max_recursion is not None)
+
+        pref_keys = self._get_pref_keys(cat, preferred)
 
-        total_errors = deque()
         total_gend = 0
-        while total_gend < num:
+        while num is None or total_gend < num:
             # use a rule definition from one of the preferred category
             # groups
-            if len(self._last_pref_keys) > 0 and _maybe(preferred_ratio):
-                rand_key = _choice(self._last_pref_keys)
+            if len(pref_keys) > 0 and _maybe(preferred_ratio):
+                rand_key = _choice(pref_keys)
                 if rand_key not in cat_defs:
                     # TODO this means it was removed / pruned b/c it was unreachable??
                     # TODO look into this more
@@ -500,8 +1550,20 @@ class GramFuzzer(object):
             self.pre_revert(info)
             val_res = None
 
+            if limited:
+                ctx = context.current()
+                prev_limits = (ctx.max_recursion, ctx.recursion, ctx.budget)
+                if max_recursion is not None:
+                    ctx.max_recursion = max_recursion
+                if recursion_rules is not None:
+                    ctx.recursion = context.Recursion(recursion_rules)
+                if budget is not None:
+                    ctx.budget = budget.start()
+
             try:
                 val_res = _val(v, pre)
+                if val_res is utils.NOTHING:
+                    raise errors.OptGram
             except errors.GramFuzzError as e:
                 raise
                 #total_errors.append(e)
@@ -511,46 +1573,69 @@ class GramFuzzer(object):
                 print("RUNTIME ERROR")
                 self.revert(info)
                 continue
+            finally:
+                if limited:
+                    ctx.max_recursion, ctx.recursion, ctx.budget = prev_limits
 
             if val_res is not None:
-                _res_extend(pre)
-                _res_append(val_res)
+                pre.append(val_res)
+                if res is not None:
+                    res.extend(pre)
 
                 total_gend += 1
-                self.post_revert(cat, res, total_gend, num, info)
+                if commit:
+                    self.post_revert(cat, pre if res is None else res, total_gend, num, info)
+                else:
+                    self.revert(info)
+                yield pre
 
-        return res
-    
     def pre_revert(self, info=None):
-        """Signal to begin saving any changes that might need to be reverted
+        """Signal to begin saving any changes that might need to be reverted.
+        Rule definitions added from now on are staged in the current context
+        (see :any:`gramfuzz.context.StagedDefs`), which is only created once
+        the first rule definition is added.
         """
-        self._staged_defs = deque()
+        ctx = context.current()
+        ctx.staging = True
+        ctx.staged_defs = None
     
     def post_revert(self, cat, res, total_num, num, info):
         """Commit any staged rule definition changes (rule generation went
         smoothly).
         """
-        if self._staged_defs is None:
+        ctx = context.current()
+        staged_defs = ctx.staged_defs
+        ctx.staging = False
+        ctx.staged_defs = None
+        if staged_defs is None:
             return
-        for cat,def_name,def_value in self._staged_defs:
-            self.defs.setdefault(cat, {}).setdefault(def_name, deque()).append(def_value)
-        self._staged_defs = None
+        for cat,def_name,def_value in staged_defs:
+            self._commit_definition(cat, def_name, def_value)
     
     def revert(self, info=None):
         """Revert after a single def errored during generate (throw away all
         staged rule definition changes)
         """
-        self._staged_defs = None
+        ctx = context.current()
+        ctx.staging = False
+        ctx.staged_defs = None
 
     def _get_pref_keys(self, cat, preferred):
-        if preferred == self._last_prefs:
-            pref_keys = self._last_pref_keys
-        else:
-            pref_keys = deque()
-            for pref in preferred:
-                if pref in self.cat_groups[cat]:
-                    pref_keys.extend(self.cat_groups[cat][pref])
-                elif pref in self.defs[cat]:
-                    pref_keys.append(pref)
-
+        # the last lookup is cached on the generation context, so that
+        # threads generating with different preferences don't invalidate
+        # each other's cache
+        ctx = context.current()
+        prefs = (self, self._defs_version, cat, tuple(preferred))
+        if prefs == ctx._last_prefs:
+            return ctx._last_pref_keys
+
+        pref_keys = deque()
+        for pref in preferred:
+            if pref in self.cat_groups[cat]:
+                pref_keys.extend(self.cat_groups[cat][pref])
+            elif pref in self.defs[cat]:
+                pref_keys.append(pref)
+
+        ctx._last_prefs = prefs
+        ctx._last_pref_keys = pref_keys
         return pref_keys
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+
+"""
+This module generates rules for asyncio applications (Python 3.6+). Use
+:any:`gramfuzz.GramFuzzer.agen` instead of using this module directly:
+
+.. code-block:: python
+
+    async def fuzz(fuzzer, writer):
+        async for value in fuzzer.agen(cat="default", num=100000, seed=1337):
+            writer.write(value + b"\\n")
+            await writer.drain()
+
+Rules are generated in chunks in an executor (the event loop's default thread
+pool unless another executor is given), so the event loop keeps running while
+rules are generated. Finished chunks are stored in a bounded queue: once
+``max_pending`` chunks are waiting to be consumed, no more rules are generated
+until the consumer catches up.
+
+Rules are generated in their own generation context (see :any:`gramfuzz.context`),
+which is seeded with ``seed``, so the generated values are the same as the
+values ``gen_iter`` generates with a context that was created with the same
+seed.
+"""
+
+
+import asyncio
+from collections import deque
+import itertools
+
+
+import gramfuzz.context as context
+import gramfuzz.rand as rand
+
+
+# the default number of rules generated at a time
+CHUNKSIZE = 100
+
+# the default number of generated chunks that may be waiting to be consumed
+MAX_PENDING = 4
+
+# marks the end of the generated chunks
+_DONE = object()
+
+
+class _Failure(object):
+    """Wraps an exception raised while generating a chunk so that it can be
+    re-raised by the consumer
+    """
+    def __init__(self, exc):
+        self.exc = exc
+
+
+def gen_samples(fuzzer, num, cat, preferred, preferred_ratio, max_recursion=None, seed=None, chunksize=None, max_pending=None, executor=None, budget=None):
+    """Generate ``num`` rules from category ``cat`` of ``fuzzer``. See
+    :any:`gramfuzz.GramFuzzer.agen`.
+
+    :returns: An asynchronous generator of the generated values
+    """
+    if seed is None:
+        seed = rand.randint(2**32)
+    if chunksize is None:
+        chunksize = CHUNKSIZE
+    if max_pending is None:
+        max_pending = MAX_PENDING
+
+    ctx = context.Context(seed=seed)
+    samples = fuzzer._gen_samples(num, cat, preferred, preferred_ratio, max_recursion=max_recursion, budget=budget)
+    return _consume(samples, ctx, chunksize, max_pending, executor)
+
+
+async def _consume(samples, ctx, chunksize, max_pending, executor):
+    """Yield the values of the chunks generated by :any:`gramfuzz.aio._produce`.
+    The producer is cancelled when the consumer stops early.
+    """
+    queue = asyncio.Queue(maxsize=max_pending)
+    producer = asyncio.ensure_future(_produce(queue, samples, ctx, chunksize, executor))
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is _DONE:
+                break
+            if isinstance(chunk, _Failure):
+                raise chunk.exc
+            for item in chunk:
+                yield item
+    finally:
+        producer.cancel()
+
+
+async def _produce(queue, samples, ctx, chunksize, executor):
+    """Generate chunks of rules in ``executor`` and add them to ``queue``
+    """
+    loop = asyncio.get_event_loop()
+    try:
+        while True:
+            chunk, count = await loop.run_in_executor(executor, _gen_chunk, samples, ctx, chunksize)
+            if len(chunk) > 0:
+                await queue.put(chunk)
+            if count < chunksize:
+                break
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        await queue.put(_Failure(e))
+        return
+    await queue.put(_DONE)
+
+
+def _gen_chunk(samples, ctx, chunksize):
+    """Generate at most ``chunksize`` rules from ``samples`` using the generation
+    context ``ctx``.
+
+    :returns: A tuple of the generated values and the number of rules generated
+    """
+    chunk = deque()
+    count = 0
+    with context.use(ctx):
+        for sample in itertools.islice(samples, chunksize):
+            chunk.extend(sample)
+            count += 1
+    return chunk, count
@@ -0,0 +1,671 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+
+"""
+This module compiles the rules defined in a :any:`gramfuzz.GramFuzzer`
+instance into specialized Python code.
+
+Each rule definition (``Def``) becomes a single Python function. The core
+fields within a rule (``And``, ``Q``, ``Join``, ``Or``, ``Opt``, ``PLUS``, ``STAR``, etc.)
+are inlined into that function, constant values are pre-encoded, and ``Ref``
+fields call the function of the referenced rule directly instead of looking
+the rule up by name on every build.
+
+The compiled functions write their output into a single shared ``bytearray``:
+separators are written in place, skipped values are truncated from the buffer,
+and ``Q`` fields quote the data they wrote in place.
+
+All other fields (``Int``, ``String``, custom ``Field`` subclasses, etc.) are
+built by calling their ``build()`` method, the same as the recursive engine.
+The compiled code makes the same random decisions in the same order as the
+recursive engine, so the output is identical for the same seed.
+
+The compiled engine can be selected with :any:`gramfuzz.GramFuzzer.set_engine`:
+
+.. code-block:: python
+
+    fuzzer = gramfuzz.GramFuzzer(engine="compiled")
+    # optionally cache compiled code on disk
+    fuzzer.compile_cache = "/tmp/gramfuzz_cache"
+    fuzzer.load_grammar("python27.py")
+    fuzzer.gen(cat_group="python27", num=10)
+
+Rules are compiled the first time they are generated after being preprocessed
+(see :any:`gramfuzz.GramFuzzer.preprocess_rules`). When ``compile_cache`` is set,
+the compiled code is stored in that directory, keyed by a hash of the generated
+source, so that subsequent processes loading the same grammar skip compiling it.
+"""
+
+
+from collections import deque
+import hashlib
+import marshal
+import os
+import sys
+import tempfile
+import six
+
+
+import gramfuzz.context as context
+import gramfuzz.engine as engine
+import gramfuzz.errors as errors
+import gramfuzz.fields as fields
+import gramfuzz.rand as rand
+import gramfuzz.utils as utils
+
+
+# Python limits the number of statically nested blocks in a single
+# function to 20. Fields nested deeper than this within a rule are compiled
+# into their own function.
+MAX_NESTING = 12
+
+
+def _stock(field, base, name):
+    """Return ``True`` if the method ``name`` of ``field`` is the
+    one defined by ``base`` (i.e. it has not been overridden)
+    """
+    return getattr(type(field), name) == getattr(base, name)
+
+
+def _budgeted(func, pre, shortest, b, ctx):
+    """Call the rule function ``func`` for a reference (or the function of
+    a repetition of a ``Join`` item), spending the current context's budget
+    (see :any:`gramfuzz.context.Budget`)
+    """
+    budget = ctx.budget
+    if budget.enter():
+        shortest = True
+    start = len(b)
+    length = None
+    try:
+        res = func(pre, shortest, b, ctx)
+        length = len(b) - start
+        return res
+    finally:
+        budget.exit(length)
+
+
+class CompiledGrammar(object):
+    """The result of compiling the rules of a ``GramFuzzer`` instance. Use
+    :any:`gramfuzz.compiler.CompiledGrammar.build` to build values with the
+    compiled code.
+    """
+
+    def __init__(self, source, code, fields_table, funcs_by_def):
+        """Create a new ``CompiledGrammar``. Use :any:`gramfuzz.compiler.compile_rules`
+        instead of calling this directly.
+        """
+        self.source = source
+        """The generated Python source code
+        """
+
+        self.fields = fields_table
+        """Field instances referenced by the compiled code
+        """
+
+        namespace = {
+            "__builtins__": six.moves.builtins,
+            "_rand":            rand,
+            "_val":             utils.val,
+            "_NOTHING":         utils.NOTHING,
+            "_deque":           deque,
+            "_range":           six.moves.range,
+            "_OptGram":         errors.OptGram,
+            "_FlushGrams":      errors.FlushGrams,
+            "_GramFuzzError":   errors.GramFuzzError,
+            "_budgeted":        _budgeted,
+            "F":                fields_table,
+        }
+        exec(code, namespace)
+
+        self.funcs = {}
+        """Compiled rule functions, keyed by their ``Def`` instance
+        """
+        for definition, func_name in funcs_by_def:
+            self.funcs[definition] = namespace[func_name]
+
+    def build(self, val, pre=None, shortest=False):
+        """Build the provided value using the compiled code if it is a
+        compiled rule definition, otherwise use :any:`gramfuzz.utils.val`.
+        This is a drop-in replacement for :any:`gramfuzz.utils.val`.
+
+        :param val: The value to build
+        :param list pre: The prerequisites list
+        :param bool shortest: Whether or not the shortest reference-chain (most minimal) version of the field should be generated.
+        :returns: bytes, or :any:`gramfuzz.utils.NOTHING` if the value should be skipped
+        """
+        if pre is None:
+            pre = []
+
+        func = None
+        if isinstance(val, fields.Def):
+            func = self.funcs.get(val, None)
+        if func is None:
+            return utils.val(val, pre, shortest=shortest)
+
+        buf = bytearray()
+        func(pre, shortest, buf, context.current())
+        return bytes(buf)
+
+
+class _Emitter(object):
+    """Generates the Python source for all rules of a ``GramFuzzer``
+    """
+
+    def __init__(self, fuzzer):
+        self.fuzzer = fuzzer
+        self.lines = []
+        self.fields = []
+        self._field_idxs = {}
+        self._rule_funcs = {}
+        self._def_funcs = deque()
+        self._nested = deque()
+        self._var_count = 0
+
+    def _var(self, prefix):
+        self._var_count += 1
+        return "{}{}".format(prefix, self._var_count)
+
+    def _field(self, field):
+        """Return an expression that references ``field`` at runtime
+        """
+        key = id(field)
+        if key not in self._field_idxs:
+            self._field_idxs[key] = len(self.fields)
+            self.fields.append(field)
+        return "F[{}]".format(self._field_idxs[key])
+
+    def _const(self, val):
+        """Return the pre-built bytes of ``val`` if it is a constant, else ``None``
+        """
+        if isinstance(val, six.binary_type):
+            return val
+        if type(val) in six.integer_types + (float,):
+            return utils.binstr(str(val))
+        if isinstance(val, six.text_type):
+            return utils.binstr(val)
+        return None
+
+    def emit_all(self):
+        """Emit a function for every rule definition, and a dispatch function
+        for every rule name.
+        """
+        defs = self.fuzzer.defs
+        for cat in defs.keys():
+            for rule_name in defs[cat].keys():
+                self._rule_funcs[(cat, rule_name)] = self._var("r")
+
+        for cat in defs.keys():
+            for rule_name, rules in six.iteritems(defs[cat]):
+                def_funcs = []
+                for rule in rules:
+                    if isinstance(rule, fields.Field) and engine._kind(type(rule)) == engine._DEF:
+                        def_funcs.append(self._emit_def(rule))
+                    else:
+                        def_funcs = None
+                        break
+                self._emit_rule(cat, rule_name, rules, def_funcs)
+
+    def _emit_rule(self, cat, rule_name, rules, def_funcs):
+        """Emit a function that chooses one of the definitions of the rule
+        at random (see :any:`gramfuzz.GramFuzzer.get_ref`)
+        """
+        func_name = self._rule_funcs[(cat, rule_name)]
+        alts = self._field(rules)
+        add = self.lines.append
+        add("def {}(pre, shortest, b, ctx):".format(func_name))
+        add("    # {!r}:{!r}".format(cat, rule_name))
+        if def_funcs is not None:
+            # rule definitions may be added during generation
+            add("    if ctx.staged_defs is None and len({}) == {}:".format(alts, len(def_funcs)))
+            add("        return _rand.choice(({},))(pre, shortest, b, ctx)".format(", ".join(def_funcs)))
+        # rule definitions staged while generating the current rule are
+        # chosen from as well
+        add("    _rules = {}".format(alts))
+        add("    if ctx.staged_defs is not None:")
+        add("        _rules = ctx.staged_defs.get({!r}, {!r}, _rules)".format(cat, rule_name))
+        add("    _r = _val(_rand.choice(_rules), pre, shortest=shortest)")
+        add("    if _r is _NOTHING:")
+        add("        return _r")
+        add("    b += _r")
+        add("")
+
+    def _emit_def(self, rule):
+        func_name = self._var("d")
+        self._def_funcs.append((rule, func_name))
+
+        add = self.lines.append
+        add("def {}(pre, shortest, b, ctx):".format(func_name))
+
+        const = self._const_seq(rule.values, rule.sep)
+        if const is not None:
+            add("    b += {!r}".format(const))
+            add("")
+            return func_name
+
+        add("    try:")
+        self._emit_values(rule, engine._DEF, rule.values, 2)
+        add("    except _GramFuzzError as e:")
+        add("        print({!r} + \" : \" + str(e))".format(rule.name))
+        add("        raise")
+        add("")
+        return func_name
+
+    def _emit_lines(self, lines, depth):
+        indent = "    " * depth
+        for line in lines:
+            self.lines.append(indent + line)
+
+    def _emit_values(self, field, kind, values, depth, repeat=None, start_var=None):
+        """Emit the code to write ``values`` into the buffer ``b`` the
+        same way ``And.build`` (or ``Join.build`` if ``kind`` is a join) would.
+
+        Separators are written before each value that is not skipped.
+        Whether a value has already been written is tracked statically where
+        possible, and with a flag variable otherwise.
+        """
+        indent = "    " * depth
+        add = self.lines.append
+
+        sep = field.sep
+        flush = kind in engine._FLUSH_CATCHERS
+        if flush and start_var is None:
+            start_var = self._var("s")
+            add("{}{} = len(b)".format(indent, start_var))
+
+        # whether a value has been written: 0, 1, or None if unknown
+        state = 0
+        flag_var = None
+        if sep:
+            flag_var = self._var("c")
+            add("{}{} = 0".format(indent, flag_var))
+
+        if repeat is not None:
+            loop_var = self._var("_n")
+            add("{}for {} in _range({}):".format(indent, loop_var, repeat))
+            indent += "    "
+            depth += 1
+            # stop repeating the item once the budget is exhausted
+            add("{}if {} and ctx.budget is not None and ctx.budget.exhausted:".format(indent, loop_var))
+            add("{}    break".format(indent))
+            state = None
+
+        for val in values:
+            const = self._const(val)
+            if const is not None and repeat is None:
+                if not sep:
+                    add("{}b += {!r}".format(indent, const))
+                    continue
+                if state == 1:
+                    add("{}b += {!r}".format(indent, sep + const))
+                    continue
+                if state is None:
+                    add("{}if {}:".format(indent, flag_var))
+                    add("{}    b += {!r}".format(indent, sep))
+                add("{}b += {!r}".format(indent, const))
+                add("{}{} = 1".format(indent, flag_var))
+                state = 1
+                continue
+
+            val_kind = engine._LEAF
+            if isinstance(val, fields.Field):
+                val_kind = self._compilable_kind(val)
+
+            # offset to truncate to if the value is skipped or flushed after
+            # it (or its separator) has been partially written
+            mark = None
+            if (sep and state != 0) or (flush and val_kind != engine._LEAF and (
+                    val_kind in (engine._JOIN, engine._STAR, engine._OR) or depth + 1 > MAX_NESTING)):
+                mark = self._var("m")
+                add("{}{} = len(b)".format(indent, mark))
+
+            before = []
+            after = []
+            if sep:
+                if state == 1:
+                    before = ["b += {!r}".format(sep)]
+                elif state is None:
+                    before = ["if {}:".format(flag_var), "    b += {!r}".format(sep)]
+                after = ["{} = 1".format(flag_var)]
+
+            add("{}try:".format(indent))
+            if repeat is not None:
+                self._emit_repetition(val, depth + 1, before, after, mark)
+            else:
+                self._emit(val, depth + 1, before, after, mark)
+            add("{}except _OptGram:".format(indent))
+            if mark is not None:
+                add("{}    del b[{}:]".format(indent, mark))
+            else:
+                add("{}    pass".format(indent))
+            if flush:
+                add("{}except _FlushGrams:".format(indent))
+                add("{}    {}._flush_grams(_deque([bytes(b[{}:{}])]), pre)".format(
+                    indent, self._field(field), start_var, "" if mark is None else mark,
+                ))
+                add("{}    del b[{}:]".format(indent, start_var))
+                if sep:
+                    add("{}    {} = 0".format(indent, flag_var))
+
+            if sep:
+                if flush:
+                    state = None
+                elif self._always_writes(val):
+                    state = 1
+                elif state != 1:
+                    state = None
+
+    def _always_writes(self, val):
+        """Return ``True`` if ``val`` is never skipped
+        """
+        if self._const(val) is not None:
+            return True
+        if not isinstance(val, fields.Field):
+            return False
+        kind = self._compilable_kind(val)
+        if kind in (engine._AND, engine._Q, engine._DEF, engine._JOIN):
+            return True
+        if kind == engine._OR:
+            return all(self._always_writes(v) for v in val.values)
+        return False
+
+    def _emit(self, val, depth, before, after, mark):
+        """Emit the code that builds ``val`` and writes the result to the
+        buffer ``b``. The ``before`` lines are emitted right before the result
+        is written (if it is not skipped), and the ``after`` lines right after.
+
+        :param str mark: The variable holding the offset of the buffer before ``before`` was emitted
+        """
+        indent = "    " * depth
+        add = self.lines.append
+
+        const = self._const(val)
+        if const is not None:
+            self._emit_lines(before, depth)
+            add("{}b += {!r}".format(indent, const))
+            self._emit_lines(after, depth)
+            return
+
+        kind = engine._LEAF
+        if isinstance(val, fields.Field):
+            kind = self._compilable_kind(val)
+
+        if kind != engine._LEAF and depth > MAX_NESTING:
+            self._emit_nested_func(val, depth, before, after, mark)
+            return
+
+        if kind == engine._LEAF:
+            self._emit_result("_val({}, pre, shortest)".format(self._field(val)), depth, before, after)
+
+        elif kind == engine._REF:
+            self._emit_ref(val, depth, before, after, mark)
+
+        elif kind == engine._OR:
+            self._emit_or(val, depth, before, after, mark)
+
+        elif kind == engine._OPT:
+            add("{}if not (shortest or _rand.maybe({!r})):".format(indent, val.prob))
+            self._emit_seq(val, engine._AND, depth + 1, before, after)
+
+        elif kind == engine._STAR:
+            add("{}if not shortest and _rand.maybe():".format(indent))
+            self._emit_seq(val, engine._JOIN, depth + 1, before, after)
+
+        else:
+            self._emit_seq(val, kind, depth, before, after)
+
+    def _emit_result(self, expr, depth, before, after):
+        """Emit the code that writes the result of ``expr`` to the buffer
+        ``b``, unless the result is ``NOTHING``
+        """
+        indent = "    " * depth
+        self.lines.append("{}_r = {}".format(indent, expr))
+        self.lines.append("{}if _r is not _NOTHING:".format(indent))
+        self._emit_lines(before, depth + 1)
+        self.lines.append("{}    b += _r".format(indent))
+        self._emit_lines(after, depth + 1)
+
+    def _emit_call(self, call, depth, before, after, mark):
+        """Emit ``call``, which writes to the buffer ``b`` and returns
+        ``NOTHING`` if it was skipped
+        """
+        indent = "    " * depth
+        add = self.lines.append
+        self._emit_lines(before, depth)
+        if len(before) == 0 and len(after) == 0:
+            add("{}{}".format(indent, call))
+            return
+
+        add("{}_r = {}".format(indent, call))
+        if len(before) == 0:
+            add("{}if _r is not _NOTHING:".format(indent))
+            self._emit_lines(after, depth + 1)
+            return
+
+        add("{}if _r is _NOTHING:".format(indent))
+        add("{}    del b[{}:]".format(indent, mark))
+        if len(after) > 0:
+            add("{}else:".format(indent))
+            self._emit_lines(after, depth + 1)
+
+    def _const_seq(self, values, sep):
+        """Return the joined constant values, or ``None`` if any of the values
+        are not constant
+        """
+        consts = [self._const(v) for v in values]
+        if None in consts:
+            return None
+        return sep.join(consts)
+
+    def _emit_seq(self, val, kind, depth, before, after):
+        indent = "    " * depth
+        add = self.lines.append
+        repeat = None
+        values = val.values
+
+        if kind != engine._JOIN or val.max is None:
+            const = self._const_seq(values, val.sep)
+            if const is not None:
+                if kind == engine._Q:
+                    const = val._quote(const)
+                self._emit_lines(before, depth)
+                add("{}b += {!r}".format(indent, const))
+                self._emit_lines(after, depth)
+                return
+
+        if kind == engine._JOIN and val.max is not None:
+            values = val.values[:1]
+            repeat = "1 if shortest else (_rand.randint(1, {0!r}) if ctx.budget is None else ctx.budget.repeats(_rand.randint(1, {0!r}), {1}._item_cost()))".format(
+                val.max + 1, self._field(val),
+            )
+
+        self._emit_lines(before, depth)
+        start_var = None
+        if kind == engine._Q or kind in engine._FLUSH_CATCHERS:
+            start_var = self._var("s")
+            add("{}{} = len(b)".format(indent, start_var))
+        self._emit_values(val, kind, values, depth, repeat=repeat, start_var=start_var)
+        if kind == engine._Q:
+            # quote the data in place
+            add("{0}b[{1}:] = {2}._quote(bytes(b[{1}:]))".format(indent, start_var, self._field(val)))
+        self._emit_lines(after, depth)
+
+    def _emit_or(self, val, depth, before, after, mark):
+        indent = "    " * depth
+        add = self.lines.append
+        idx_var = self._var("_i")
+
+        if isinstance(val, fields.WeightedOr):
+            add("{}{} = {}._pick(shortest)".format(indent, idx_var, self._field(val)))
+        elif val.shortest_vals is not None:
+            add("{}if shortest:".format(indent))
+            add("{}    {} = {!r}[_rand.randint({})]".format(
+                indent, idx_var, tuple(val.shortest_indices), len(val.shortest_indices)
+            ))
+            add("{}elif ctx.budget is None:".format(indent))
+            add("{}    {} = _rand.randint({})".format(indent, idx_var, len(val.values)))
+            # budgets choose from the values that fit within them
+            add("{}else:".format(indent))
+            add("{}    {} = {}._pick(shortest)".format(indent, idx_var, self._field(val)))
+        else:
+            add("{}{} = _rand.randint({}) if ctx.budget is None else {}._pick(shortest)".format(
+                indent, idx_var, len(val.values), self._field(val),
+            ))
+
+        consts = [self._const(v) for v in val.values]
+        if None not in consts:
+            self._emit_lines(before, depth)
+            add("{}b += {!r}[{}]".format(indent, tuple(consts), idx_var))
+            self._emit_lines(after, depth)
+            return
+
+        for idx, sub_val in enumerate(val.values):
+            add("{}{} {} == {}:".format(indent, "if" if idx == 0 else "elif", idx_var, idx))
+            self._emit(sub_val, depth + 1, before, after, mark)
+
+    def _emit_ref(self, val, depth, before, after, mark):
+        indent = "    " * depth
+        add = self.lines.append
+
+        func_name = self._rule_funcs.get((val.cat, val.refname), None)
+        if func_name is None:
+            # "*" references, or references to undefined rules
+            self._emit_result("_val({}, pre, shortest)".format(self._field(val)), depth, before, after)
+            return
+
+        ref = self._field(val)
+        add("{}ctx.ref_level += 1".format(indent))
+        add("{}_rc = ctx.recursion".format(indent))
+        add("{}try:".format(indent))
+        # rule functions only return NOTHING if a non-Def rule definition
+        # was added with add_definition
+        self._emit_call(
+            "({0}(pre, {1}, b, ctx) if ctx.budget is None else _budgeted({0}, pre, {1}, b, ctx))".format(
+                func_name,
+                "(shortest or ctx.ref_level >= {0}._recursion_limit(ctx) if _rc is None else _rc.enter({0}, ctx.ref_level, {0}._recursion_limit(ctx)) or shortest)".format(ref),
+            ),
+            depth + 1,
+            before,
+            after,
+            mark,
+        )
+        add("{}finally:".format(indent))
+        add("{}    ctx.ref_level -= 1".format(indent))
+        add("{}    if _rc is not None:".format(indent))
+        add("{}        _rc.exit()".format(indent))
+
+    def _emit_nested_func(self, val, depth, before, after, mark):
+        """Emit ``val`` as its own function to avoid nesting too many
+        blocks within a single function. The function returns ``NOTHING``
+        if ``val`` was skipped.
+        """
+        func_name = self._nested_func(val)
+        self._emit_call("{}(pre, shortest, b, ctx)".format(func_name), depth, before, after, mark)
+
+    def _emit_repetition(self, val, depth, before, after, mark):
+        """Emit a repetition of the item ``val`` of a ``Join``. The item is
+        built by its own function, so that the budget can spend a node on
+        every repetition the same way it does for references.
+        """
+        func_name = self._nested_func(val)
+        self._emit_call(
+            "({0}(pre, shortest, b, ctx) if ctx.budget is None else _budgeted({0}, pre, shortest, b, ctx))".format(func_name),
+            depth,
+            before,
+            after,
+            mark,
+        )
+
+    def _nested_func(self, val):
+        """Emit a function that builds ``val`` and returns ``NOTHING`` if
+        ``val`` was skipped
+
+        :returns: The name of the function
+        """
+        func_name = self._var("n")
+        func_lines = deque()
+        lines, self.lines = self.lines, func_lines
+        self.lines.append("def {}(pre, shortest, b, ctx):".format(func_name))
+        self._emit(val, 1, [], ["return"], None)
+        self.lines.append("    return _NOTHING")
+        self.lines.append("")
+        self.lines = lines
+
+        self._nested.extend(func_lines)
+        return func_name
+
+    def _compilable_kind(self, val):
+        """Return the engine kind of ``val``, or ``_LEAF`` if ``val`` must
+        be built by calling its ``build()`` method.
+        """
+        kind = engine._kind(type(val))
+        if kind == engine._OR:
+            base = fields.WeightedOr if isinstance(val, fields.WeightedOr) else fields.Or
+            if not _stock(val, base, "_pick"):
+                return engine._LEAF
+        if kind in (engine._JOIN, engine._STAR) and not _stock(val, fields.Join, "_items"):
+            return engine._LEAF
+        if kind == engine._OPT and not _stock(val, fields.Opt, "_skip"):
+            return engine._LEAF
+        if kind == engine._STAR and not _stock(val, fields.STAR, "_skip"):
+            return engine._LEAF
+        if kind == engine._Q and not _stock(val, fields.Q, "_quote"):
+            return engine._LEAF
+        if kind == engine._REF and not _stock(val, fields.Ref, "_resolve"):
+            return engine._LEAF
+        return kind
+
+
+def generate_source(fuzzer):
+    """Generate the Python source code for all rules in ``fuzzer``.
+
+    :param gramfuzz.GramFuzzer fuzzer: The fuzzer whose rules should be compiled
+    :returns: tuple of ``(source, fields_table, funcs_by_def)``
+    """
+    emitter = _Emitter(fuzzer)
+    emitter.emit_all()
+    source = "\n".join(list(emitter._nested) + emitter.lines) + "\n"
+    return source, emitter.fields, list(emitter._def_funcs)
+
+
+def compile_rules(fuzzer, cache_dir=None):
+    """Compile all rules in ``fuzzer`` into specialized Python functions.
+
+    :param gramfuzz.GramFuzzer fuzzer: The fuzzer whose rules should be compiled
+    :param str cache_dir: The directory compiled code should be cached in (default=``None``, no caching)
+    :returns: gramfuzz.compiler.CompiledGrammar
+    """
+    source, fields_table, funcs_by_def = generate_source(fuzzer)
+
+    code = None
+    cache_path = None
+    if cache_dir is not None:
+        key = hashlib.sha1(utils.binstr(source)).hexdigest()
+        cache_path = os.path.join(cache_dir, "gramfuzz-{}-py{}{}.bin".format(
+            key,
+            sys.version_info[0],
+            sys.version_info[1],
+        ))
+        if os.path.exists(cache_path):
+            with open(cache_path, "rb") as f:
+                code = marshal.loads(f.read())
+
+    if code is None:
+        code = compile(source, "<gramfuzz compiled rules>", "exec")
+        if cache_path is not None:
+            _write_cache(cache_dir, cache_path, marshal.dumps(code))
+
+    return CompiledGrammar(source, code, fields_table, funcs_by_def)
+
+
+def _write_cache(cache_dir, cache_path, data):
+    """Atomically write ``data`` to ``cache_path`` so that other processes
+    never read a partially-written cache file
+    """
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.rename(tmp_path, cache_path)
@@ -0,0 +1,473 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+
+"""
+This module defines generation contexts. A :any:`gramfuzz.context.Context`
+holds all of the state of an ongoing generation:
+
+* the random number generator used by :any:`gramfuzz.rand`
+* the current reference depth used by :any:`gramfuzz.fields.Ref`, and how deeply
+  each rule is nested within itself (see :any:`gramfuzz.context.Recursion`)
+* rule definitions staged during generation (see :any:`gramfuzz.context.StagedDefs`)
+* the budget of the rule being generated (see :any:`gramfuzz.context.Budget`)
+* a ``state`` dict that stateful grammars can use to keep track of things
+  (e.g. the current indentation level)
+
+Every thread has its own current context, which lets several threads generate
+data from the same loaded grammar at once. The main thread's default context
+uses :any:`gramfuzz.rand.RANDOM`, and other threads' default contexts use a new
+randomly-seeded random number generator. Use :any:`gramfuzz.context.use` to
+generate data with a specific context:
+
+.. code-block:: python
+
+    import gramfuzz.context
+
+    def worker(seed):
+        with gramfuzz.context.use(gramfuzz.context.Context(seed=seed)):
+            return fuzzer.gen(cat="default", num=100)
+
+Custom fields should keep their state in the current context instead of in
+global variables:
+
+.. code-block:: python
+
+    class INDENT(Field):
+        def build(self, pre=None, shortest=False):
+            state = gramfuzz.context.current().state
+            state["indent"] = state.get("indent", 0) + 1
+            return "    "
+"""
+
+
+import contextlib
+import random
+import threading
+import time
+
+
+DEFAULT_RANDOM = random.Random()
+"""The random number generator used by the main thread's default context
+(also available as :any:`gramfuzz.rand.RANDOM`)
+"""
+
+
+class Context(object):
+    """Holds the state of a single generation (random number generator,
+    reference depth, user state, etc). A context should only be used by one
+    thread at a time.
+    """
+
+    def __init__(self, seed=None, rng=None):
+        """Create a new generation context.
+
+        :param seed: The seed of the new random number generator (default=``None``, randomly seeded)
+        :param random.Random rng: The random number generator to use instead of creating a new one
+        """
+        if rng is None:
+            rng = random.Random(seed)
+
+        self.random = rng
+        """The ``random.Random`` instance used by :any:`gramfuzz.rand`
+        """
+
+        self.ref_level = 1
+        """The current reference depth (see :any:`gramfuzz.fields.Ref`)
+        """
+
+        self.max_recursion = None
+        """The max recursion of the references that use the max recursion of all
+        references, or ``None`` to use :any:`gramfuzz.fields.Ref.max_recursion`
+        (see the ``max_recursion`` argument of :any:`gramfuzz.GramFuzzer.gen`)
+        """
+
+        self.staging = False
+        """Whether rule definitions added during generation are staged instead
+        of being added to the fuzzer's rule definitions right away (see
+        :any:`gramfuzz.GramFuzzer.pre_revert`)
+        """
+
+        self.staged_defs = None
+        """The :any:`gramfuzz.context.StagedDefs` that were added during
+        generation and that have not been committed yet, or ``None`` if no
+        rule definitions were staged
+        """
+
+        self.recursion = None
+        """The :any:`gramfuzz.context.Recursion` of the rule being generated, or
+        ``None`` if only the reference depth ``ref_level`` limits recursion
+        """
+
+        self.budget = None
+        """The :any:`gramfuzz.context.Budget` of the rule being generated, or
+        ``None`` if the rule's size is only limited by the max recursion
+        """
+
+        self.state = {}
+        """A dict that custom fields can use to store state during generation
+        """
+
+        # the fuzzer, rule definitions version, category and preferred
+        # category-group names that were last looked up by
+        # GramFuzzer._get_pref_keys, and the rule names derived from them
+        self._last_prefs = None
+        self._last_pref_keys = None
+
+
+class Recursion(object):
+    """Tracks how deeply the rules being built are nested within themselves,
+    for fuzzers that do not count every reference towards the max recursion
+    (see :any:`gramfuzz.GramFuzzer.recursion`), or whose rules set their own
+    ``max_recursion``.
+    """
+
+    DEPTH_SCALE = 1.2
+    """How many times the max recursion the reference depth may reach when not
+    every reference is counted (the ``"rule"`` and ``"scc"`` recursion modes).
+    Each level of nesting multiplies the size of the data that grammars with many
+    rules build, so this is only a little more than the max recursion.
+    """
+
+    def __init__(self, rules):
+        """Create a new recursion tracker, with no rules being built.
+
+        :param dict rules: ``(category, rule name)`` -> a tuple of the key the
+            nesting of the rule is counted under (``None`` to use the reference depth),
+            and the rule's max recursion (``None`` for the ``Ref`` max recursion)
+        """
+        self.rules = rules
+
+        self.levels = {}
+        """The nesting level of each key that is being built
+        """
+
+        # the keys of the references that are being built
+        self._keys = []
+
+    def enter(self, ref, ref_level, ref_limit):
+        """Count a reference that is about to be built. Every call must
+        be followed by a call to :any:`gramfuzz.context.Recursion.exit`.
+
+        The ``max_recursion`` of the reference takes precedence over the
+        ``max_recursion`` of the rule definitions it references, which takes
+        precedence over the max recursion of all references.
+
+        :param gramfuzz.fields.Ref ref: The reference
+        :param int ref_level: The current reference depth, including ``ref``
+        :param int ref_limit: The max recursion of the reference in the current
+            context (see :any:`gramfuzz.fields.Ref._recursion_limit`)
+        :returns: Whether the max recursion was reached, in which case the shortest version of the rule should be built
+        """
+        key, limit = self.rules.get((ref.cat, ref.refname), _UNKNOWN_RULE)
+        own_limit = ref._own_max_recursion
+        if own_limit is not None:
+            limit = own_limit
+        elif limit is None:
+            limit = ref_limit
+
+        self._keys.append(key)
+        if key is None:
+            return ref_level >= limit
+
+        levels = self.levels
+        level = levels.get(key, 1) + 1
+        levels[key] = level
+        # rules (or components) that are nested within each other, e.g.
+        # statements that contain expressions, could each nest up to their
+        # max recursion, so the reference depth is capped as well
+        return level >= limit or ref_level >= limit * self.DEPTH_SCALE
+
+    def exit(self):
+        """Count a reference that was built (or failed to be built)
+        """
+        key = self._keys.pop()
+        if key is not None:
+            self.levels[key] -= 1
+
+
+# rules that were not known when the recursion keys were determined (e.g. "*"
+# references) are limited by the reference depth
+_UNKNOWN_RULE = (None, None)
+
+
+class Budget(object):
+    """Limits on how much work may be spent generating a single rule. Pass a
+    budget to :any:`gramfuzz.GramFuzzer.gen` (or ``gen_iter``, ``agen``, ``gen_parallel``)
+    to limit the size of every generated rule:
+
+    .. code-block:: python
+
+        budget = gramfuzz.context.Budget(max_nodes=500, max_bytes=4096, timeout=0.1)
+        fuzzer.gen(cat_group="python27", num=1000, budget=budget)
+
+    Every ``Ref`` that is built, and every repetition of the item of a ``Join``
+    (with a ``max``), ``PLUS`` or ``STAR`` field, spends one node of the budget
+    and adds the bytes it built that were not already built by the references
+    and repetitions within it.
+
+    While generating, the budget steers the fields towards values that fit
+    within what is left of it, using the costs found while preprocessing the
+    rules (the bytes and nodes each value builds at least):
+
+    * ``Or`` and ``WeightedOr`` fields only choose from the values whose cost
+      fits within the budget
+    * ``Join``, ``PLUS`` and ``STAR`` fields don't repeat their item more often
+      than its cost fits within the budget
+
+    Once any of the limits has been reached, the budget is exhausted and every
+    reference and repetition built after that builds the shortest version of its
+    value, the same as when the max recursion is reached: ``Or`` fields choose
+    from the cheapest values with the shortest precomputed reference paths,
+    ``Join``, ``PLUS`` and ``STAR`` fields build a single item, and ``Opt``
+    fields are skipped. ``Join``, ``PLUS`` and ``STAR`` fields that are already
+    being built stop repeating their item.
+
+    Node and byte limits do not change the generated values for the same seed.
+    The time limit depends on how fast the values are built.
+    """
+
+    def __init__(self, max_nodes=None, max_bytes=None, timeout=None):
+        """Create a new budget. Limits that are ``None`` are not enforced.
+
+        :param int max_nodes: The maximum number of references to build normally (default=``None``)
+        :param int max_bytes: The number of bytes after which references are built as short as possible (default=``None``)
+        :param float timeout: The number of seconds after which references are built as short as possible (default=``None``)
+        """
+        self.max_nodes = max_nodes
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+
+        self.nodes = 0
+        """The number of references and repetitions that have been built
+        """
+
+        self.bytes = 0
+        """The number of bytes that have been built by references and repetitions
+        """
+
+        self.deadline = None
+        """The ``time.time()`` after which the budget is exhausted, or ``None``
+        """
+
+        self.exhausted = False
+        """Whether any of the limits has been reached
+        """
+
+        # the number of bytes built by the references and repetitions
+        # within each reference or repetition that is being built
+        self._nested_bytes = []
+
+    def start(self):
+        """Return a copy of this budget with nothing spent, to generate
+        a new rule with
+
+        :returns: gramfuzz.context.Budget
+        """
+        budget = Budget(self.max_nodes, self.max_bytes, self.timeout)
+        if self.timeout is not None:
+            budget.deadline = time.time() + self.timeout
+        return budget
+
+    def enter(self):
+        """Spend a node on a reference or repetition that is about to be built.
+        Every call must be followed by a call to :any:`gramfuzz.context.Budget.exit`.
+
+        :returns: Whether the budget is exhausted, in which case the shortest version of the value should be built
+        """
+        self.nodes += 1
+        self._nested_bytes.append(0)
+        if not self.exhausted:
+            self.exhausted = (
+                (self.max_nodes is not None and self.nodes > self.max_nodes)
+                or (self.deadline is not None and time.time() >= self.deadline)
+            )
+        return self.exhausted
+
+    def exit(self, length=None):
+        """Spend the bytes built by a reference or repetition
+
+        :param int length: The length of the built data, or ``None`` if building it failed
+        """
+        nested = self._nested_bytes.pop()
+        if length is None:
+            return
+        self.bytes += length - nested
+        if len(self._nested_bytes) > 0:
+            self._nested_bytes[-1] += length
+        if self.max_bytes is not None and self.bytes >= self.max_bytes:
+            self.exhausted = True
+
+    def fits(self, cost):
+        """Return whether a value with the cost ``cost`` fits within what is
+        left of the budget
+
+        :param tuple cost: The number of bytes and the number of nodes the value builds at least
+        :returns: bool
+        """
+        if self.exhausted:
+            return False
+        return (
+            (self.max_bytes is None or self.bytes + cost[0] < self.max_bytes)
+            and (self.max_nodes is None or self.nodes + cost[1] <= self.max_nodes)
+        )
+
+    def fitting(self, costs):
+        """Return the indices of the costs in ``costs`` that fit within what
+        is left of the budget (see :any:`gramfuzz.context.Budget.fits`)
+
+        :param list costs: The costs of the values to choose from
+        :returns: list
+        """
+        return [idx for idx, cost in enumerate(costs) if self.fits(cost)]
+
+    def repeats(self, count, cost):
+        """Return how many of ``count`` repetitions of a value with the cost
+        ``cost`` fit within what is left of the budget. At least one
+        repetition is always built.
+
+        :param int count: The number of repetitions that were chosen
+        :param tuple cost: The number of bytes and the number of nodes each repetition builds at least, or ``None`` if it is not known
+        :returns: int
+        """
+        if cost is None:
+            return count
+        if self.max_bytes is not None and cost[0] > 0:
+            count = min(count, int((self.max_bytes - self.bytes) // cost[0]))
+        if self.max_nodes is not None and cost[1] > 0:
+            count = min(count, int((self.max_nodes - self.nodes) // cost[1]))
+        return max(count, 1)
+
+
+class StagedDefs(object):
+    """Rule definitions that were added while generating a single rule, on
+    top of the rule definitions of a fuzzer. Staged rules are visible to
+    the references built after they were added, but only in the context
+    that staged them, until they are committed or thrown away.
+
+    The first rule definition staged for a rule name copies the fuzzer's rule
+    definitions of that name, so adding, committing and reverting staged
+    rule definitions costs nothing for the rules that were not changed.
+    """
+
+    def __init__(self, defs):
+        """Create a new, empty set of staged rule definitions.
+
+        :param dict defs: The rule definitions of the fuzzer (see :any:`gramfuzz.GramFuzzer.defs`)
+        """
+        self.defs = defs
+
+        # the staged (cat, rule name, rule) tuples, in the order they
+        # were added
+        self.changes = []
+
+        # category -> rule name -> all rule definitions of the rule,
+        # including the staged ones
+        self.rules = {}
+
+        # category -> the rule names of the category and the rule definitions
+        # by rule name, including the staged ones (used by "*" references)
+        self._cat_defs = {}
+
+    def add(self, cat, def_name, def_val):
+        """Stage a new rule definition
+
+        :param str cat: The category of the rule
+        :param str def_name: The name of the rule definition
+        :param def_val: The value of the rule definition
+        """
+        self.changes.append((cat, def_name, def_val))
+
+        cat_rules = self.rules.setdefault(cat, {})
+        rules = cat_rules.get(def_name, None)
+        if rules is None:
+            rules = cat_rules[def_name] = list(self.defs.get(cat, {}).get(def_name, []))
+            self._cat_defs.pop(cat, None)
+        rules.append(def_val)
+
+    def get(self, cat, refname, default=None):
+        """Return all rule definitions of the rule ``refname`` in the category
+        ``cat`` if any were staged, else ``default``
+        """
+        cat_rules = self.rules.get(cat, None)
+        if cat_rules is None:
+            return default
+        return cat_rules.get(refname, default)
+
+    def bind_ref(self, cat, refname):
+        """Look up the rule definitions a reference chooses from, like
+        :any:`gramfuzz.GramFuzzer.bind_ref`, if rules were staged for them.
+
+        :returns: The same as :any:`gramfuzz.GramFuzzer.bind_ref`, or ``None`` if
+            no rule definitions were staged that the reference could choose from
+        """
+        cat_rules = self.rules.get(cat, None)
+        if cat_rules is None:
+            return None
+
+        if refname == "*":
+            binding = self._cat_defs.get(cat, None)
+            if binding is None:
+                cat_defs = dict(self.defs.get(cat, {}))
+                cat_defs.update(cat_rules)
+                binding = self._cat_defs[cat] = (tuple(cat_defs.keys()), cat_defs)
+            return binding
+
+        rules = cat_rules.get(refname, None)
+        if rules is None:
+            return None
+        return rules, None
+
+    def __iter__(self):
+        return iter(self.changes)
+
+    def __len__(self):
+        return len(self.changes)
+
+
+def _is_main_thread():
+    if hasattr(threading, "main_thread"):
+        return threading.current_thread() is threading.main_thread()
+    return isinstance(threading.current_thread(), threading._MainThread)
+
+
+class _Local(threading.local):
+    def __init__(self):
+        rng = DEFAULT_RANDOM if _is_main_thread() else None
+        self.context = Context(rng=rng)
+
+
+_local = _Local()
+
+
+def current():
+    """Return the current thread's generation context
+
+    :returns: gramfuzz.context.Context
+    """
+    return _local.context
+
+
+def set_current(ctx):
+    """Set the current thread's generation context
+
+    :param gramfuzz.context.Context ctx: The new context
+    :returns: The previous context
+    """
+    prev = _local.context
+    _local.context = ctx
+    return prev
+
+
+@contextlib.contextmanager
+def use(ctx):
+    """Use ``ctx`` as the current thread's generation context within a
+    ``with`` block
+
+    :param gramfuzz.context.Context ctx: The context to use
+    """
+    prev = set_current(ctx)
+    try:
+        yield ctx
+    finally:
+        set_current(prev)
@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+
+"""
+This module reads and writes grammars in a declarative JSON format, which can
+be loaded without executing any Python code. Grammar files in this format
+(ending in ``.json``) are loaded with :any:`gramfuzz.GramFuzzer.load_grammar`,
+and already loaded rules are written to one with
+:any:`gramfuzz.GramFuzzer.export_grammar`:
+
+.. code-block:: python
+
+    fuzzer = gramfuzz.GramFuzzer()
+    fuzzer.load_grammar("names.py")
+    fuzzer.export_grammar("names.json")
+
+    # e.g. in another process
+    fuzzer = gramfuzz.GramFuzzer()
+    fuzzer.load_grammar("names.json")
+
+The file contains one JSON object per line. The first line describes the
+grammar:
+
+.. code-block:: text
+
+    {"gramfuzz_grammar": 1, "cat_groups": {"names": "name"}, "cats": ["name", "name_def"]}
+
+``cat_groups`` maps each category group of the grammar to its top-level
+category (``TOP_CAT``, or ``null``), and ``cats`` lists the categories the
+grammar defines rules in. Every other line is a rule definition:
+
+.. code-block:: text
+
+    {"group": "names", "cat": "name_def", "name": "last_name", "values": [{"type": "Or", "values": ["Blart", "Tralb"]}]}
+
+Values are encoded as:
+
+* ``bytes`` - JSON strings, with every byte as the character of the same code point
+* ``str`` - ``{"str": "..."}``
+* numbers, booleans, ``null`` and lists - the same JSON values
+* fields - ``{"type": "<field class>", "values": [...], <options>}``, with only the
+  options that differ from the field class's defaults, e.g.
+  ``{"type": "Ref", "refname": "last_name", "cat": "name_def"}``
+* field classes - ``{"class": "<field class>"}``
+
+Only the fields defined in :any:`gramfuzz.fields` can be written to grammar files,
+as well as subclasses of them that only change the defaults of their options
+(such as ``class NRef(Ref): cat = "name_def"``). Rules are loaded one line at
+a time, so a grammar file never has to be held in memory at once.
+"""
+
+
+import io
+import json
+import os
+import six
+import tempfile
+
+
+import gramfuzz.errors as errors
+import gramfuzz.fields as fields
+
+
+# incremented whenever the format of grammar files changes
+FORMAT = 1
+
+# the options of each field class that are written to grammar files, and
+# passed to the field's constructor when loading
+OPTIONS = {
+    "Int":        ("value", "min", "max", "odds"),
+    "UInt":       ("value", "min", "max", "odds"),
+    "Float":      ("value", "min", "max", "odds"),
+    "UFloat":     ("value", "min", "max", "odds"),
+    "String":     ("value", "min", "max", "odds", "charset"),
+    "Join":       ("sep", "max"),
+    "PLUS":       ("sep", "max"),
+    "STAR":       ("sep", "max"),
+    "And":        ("sep",),
+    "Q":          ("sep", "escape", "html_js_escape", "quote"),
+    "Opt":        ("sep", "prob"),
+    "Or":         (),
+    "WeightedOr": (),
+    "Ref":        ("cat", "failsafe", "max_recursion"),
+    "Def":        ("sep", "cat", "no_prune", "max_recursion"),
+}
+
+# options that are always strings, and are written as plain JSON strings
+_STR_OPTIONS = ("cat",)
+
+# class attributes that subclasses of the field classes may define without
+# changing how the field is built
+_IGNORED_CLASS_ATTRS = (
+    "__module__", "__qualname__", "__doc__", "__slots__", "__dict__",
+    "__weakref__", "_shared_instance", "_odds_cache",
+)
+
+# instance attributes that are not written to grammar files
+_IGNORED_ATTRS = ("rolling", "_odds_cache", "_own_max_recursion")
+
+
+def save(fuzzer, path, cat_groups=None):
+    """Write the rule definitions of ``fuzzer`` to the grammar file ``path``.
+    The file is written atomically.
+
+    :param gramfuzz.GramFuzzer fuzzer: The fuzzer whose rules to write
+    :param str path: The path of the grammar file
+    :param list cat_groups: The category groups whose rules to write (default=``None``, all rules)
+    """
+    path = os.path.abspath(path)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with io.open(fd, "w", encoding="utf-8") as f:
+            dump(fuzzer, f, cat_groups)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    os.rename(tmp_path, path)
+
+
+def dump(fuzzer, f, cat_groups=None):
+    """Write the rule definitions of ``fuzzer`` to the text file ``f``
+
+    :param gramfuzz.GramFuzzer fuzzer: The fuzzer whose rules to write
+    :param f: The file to write to
+    :param list cat_groups: The category groups whose rules to write (default=``None``, all rules)
+    """
+    rules = _group_rules(fuzzer, cat_groups)
+
+    groups = {}
+    cats = []
+    for group, cat, rule in rules:
+        groups.setdefault(group, fuzzer.cat_group_defaults.get(group, None))
+        if cat not in cats:
+            cats.append(cat)
+
+    header = {"gramfuzz_grammar": FORMAT, "cat_groups": groups, "cats": cats}
+    f.write(six.text_type(json.dumps(header, sort_keys=True)) + u"\n")
+
+    for group, cat, rule in rules:
+        encoded = _encode_field(rule)
+        del encoded["type"]
+        encoded["group"] = group
+        # the rule's own cat may be a class default that does not match
+        # the category the rule was added to
+        encoded["cat"] = cat
+        f.write(six.text_type(json.dumps(encoded, sort_keys=True)) + u"\n")
+
+
+def load(fuzzer, f, cat_group="default"):
+    """Load the rule definitions in the grammar file ``f`` into ``fuzzer``,
+    one line at a time
+
+    :param gramfuzz.GramFuzzer fuzzer: The fuzzer to load the rules into
+    :param f: The text file to read from
+    :param str cat_group: The category group of rules that don't list their group (default=``"default"``)
+    """
+    header = _read_header(f)
+    for group, top_cat in six.iteritems(header["cat_groups"]):
+        if top_cat is not None:
+            fuzzer.set_cat_group_top_level_cat(group, top_cat)
+
+    for line in f:
+        if line.strip() == "":
+            continue
+        encoded = json.loads(line)
+        rule = _decode_def(encoded, fuzzer)
+        fuzzer.add_definition(
+            rule.cat, rule.name, rule,
+            no_prune=rule.no_prune,
+            gram_file=six.ensure_str(encoded.get("group", cat_group)),
+        )
+
+
+def read_header(f):
+    """Read the first line of the grammar file ``f``
+
+    :param f: The text file to read from
+    :returns: A tuple of a dict of the top-level category of each category group,
+        and a set of the categories the grammar defines rules in
+    """
+    header = _read_header(f)
+    return header["cat_groups"], set(header["cats"])
+
+
+def _read_header(f):
+    try:
+        header = json.loads(f.readline())
+    except ValueError:
+        header = None
+    if not isinstance(header, dict) or header.get("gramfuzz_grammar", None) != FORMAT:
+        raise errors.GramFuzzError("not a gramfuzz grammar file (format {})".format(FORMAT))
+
+    # names are native strings, the same as in grammars written in python
+    header["cat_groups"] = dict(
+        (six.ensure_str(group), None if top_cat is None else six.ensure_str(top_cat))
+        for group, top_cat in six.iteritems(header["cat_groups"])
+    )
+    header["cats"] = [six.ensure_str(cat) for cat in header["cats"]]
+    return header
+
+
+def _group_rules(fuzzer, cat_groups):
+    """Return a list of ``(category group, cat, rule)`` tuples for each rule
+    definition in ``fuzzer``, in the order the rules are defined in. Rules with
+    the same name that were defined in different category groups are assigned
+    to the groups in the order of ``fuzzer.cat_groups``.
+    """
+    rule_groups = {}
+    for cat, groups in six.iteritems(fuzzer.cat_groups):
+        for group, names in six.iteritems(groups):
+            for name in names:
+                rule_groups.setdefault((cat, name), []).append(group)
+
+    res = []
+    for cat, cat_defs in six.iteritems(fuzzer.defs):
+        for name, rules in six.iteritems(cat_defs):
+            groups = rule_groups.get((cat, name), [])
+            for idx, rule in enumerate(rules):
+                group = groups[idx] if idx < len(groups) else "default"
+                if cat_groups is None or group in cat_groups:
+                    res.append((group, cat, rule))
+    return res
+
+
+def _base_class(cls):
+    """Return the field class in :any:`gramfuzz.fields` that ``cls`` is, or
+    that ``cls`` only changes the option defaults of
+    """
+    changed = []
+    for klass in cls.__mro__:
+        name = klass.__name__
+        if name in OPTIONS and getattr(fields, name, None) is klass:
+            break
+        changed.extend(x for x in klass.__dict__.keys() if x not in _IGNORED_CLASS_ATTRS)
+    else:
+        raise errors.GramFuzzError(
+            "cannot export {!r}, only the fields of gramfuzz.fields can be exported".format(cls)
+        )
+
+    for attr in changed:
+        if attr not in OPTIONS[name]:
+            raise errors.GramFuzzError(
+                "cannot export field class {!r}, it defines {!r}".format(cls, attr)
+            )
+    return klass
+
+
+def _encode(val):
+    if isinstance(val, six.binary_type):
+        return val.decode("latin-1")
+    if isinstance(val, six.text_type):
+        return {"str": val}
+    if val is None or isinstance(val, (bool, float) + six.integer_types):
+        return val
+    if isinstance(val, (list, tuple)):
+        return [_encode(x) for x in val]
+    if isinstance(val, fields.MetaField):
+        if _base_class(val) is not val:
+            raise errors.GramFuzzError("cannot export field class {!r}".format(val))
+        return {"class": val.__name__}
+    if isinstance(val, fields.Field):
+        return _encode_field(val)
+    raise errors.GramFuzzError("cannot export value {!r}".format(val))
+
+
+def _encode_field(field):
+    cls = type(field)
+    base = _base_class(cls)
+    if base is cls and cls.__dict__.get("_shared_instance", None) is field:
+        return {"class": cls.__name__}
+
+    options = OPTIONS[base.__name__]
+    for attr in getattr(field, "__dict__", {}).keys():
+        if attr not in options and attr not in _IGNORED_ATTRS:
+            raise errors.GramFuzzError("cannot export {!r}, it sets {!r}".format(field, attr))
+
+    res = {"type": base.__name__}
+    if isinstance(field, fields.Ref):
+        res["refname"] = field.refname
+    if isinstance(field, fields.Def):
+        res["name"] = field.name
+
+    values = getattr(field, "values", None)
+    if isinstance(field, fields.PLUS):
+        # the values were wrapped in an And when the field was created
+        if len(values) != 1 or type(values[0]) is not fields.And or len(values[0].__dict__) > 0:
+            raise errors.GramFuzzError("cannot export {!r}".format(field))
+        values = values[0].values
+    if values is not None:
+        res["values"] = [_encode(x) for x in values]
+    if isinstance(field, fields.WeightedOr):
+        res["weights"] = list(field.weights)
+
+    for option in options:
+        val = getattr(field, option)
+        if val is getattr(base, option):
+            continue
+        res[option] = val if option in _STR_OPTIONS else _encode(val)
+
+    # a reference's own max recursion is kept even if it is the same as the
+    # max recursion of all references
+    if isinstance(field, fields.Ref) and field._own_max_recursion is not None:
+        res["max_recursion"] = _encode(field._own_max_recursion)
+
+    # the odds of Int fields are reset when min or max are set
+    if ("min" in res or "max" in res) and "odds" not in res:
+        res["odds"] = _encode(field.odds)
+
+    return res
+
+
+def _decode(val, fuzzer):
+    if isinstance(val, six.text_type):
+        return val.encode("latin-1")
+    if isinstance(val, list):
+        return [_decode(x, fuzzer) for x in val]
+    if isinstance(val, dict):
+        if "type" in val:
+            return _decode_field(val, fuzzer)
+        if "class" in val:
+            return _field_class(val["class"])
+        if "str" in val:
+            return val["str"]
+        raise errors.GramFuzzError("invalid value in grammar file: {!r}".format(val))
+    return val
+
+
+def _field_class(name):
+    if name not in OPTIONS:
+        raise errors.GramFuzzError("unknown field class in grammar file: {!r}".format(name))
+    return getattr(fields, name)
+
+
+def _decode_options(encoded, cls, fuzzer):
+    options = {}
+    for option in OPTIONS[cls.__name__]:
+        if option not in encoded:
+            continue
+        val = encoded[option]
+        options[option] = six.ensure_str(val) if option in _STR_OPTIONS else _decode(val, fuzzer)
+    return options
+
+
+def _decode_field(encoded, fuzzer):
+    cls = _field_class(encoded["type"])
+    if cls is fields.Def:
+        raise errors.GramFuzzError("rule definitions cannot be values")
+    options = _decode_options(encoded, cls, fuzzer)
+
+    if cls is fields.Ref:
+        return fields.Ref(six.ensure_str(encoded["refname"]), **options)
+
+    if issubclass(cls, fields.Int):
+        return cls(**options)
+
+    values = [_decode(x, fuzzer) for x in encoded.get("values", [])]
+    if cls is fields.WeightedOr:
+        return cls(*zip(values, encoded["weights"]), **options)
+    return cls(*values, **options)
+
+
+def _decode_def(encoded, fuzzer):
+    """Create a rule definition without adding it to the fuzzer the way
+    creating a ``Def`` does
+    """
+    options = _decode_options(encoded, fields.Def, fuzzer)
+    rule = fields.Def.__new__(fields.Def)
+    rule.name = six.ensure_str(encoded["name"])
+    rule.values = fields._normalize_values(_decode(x, fuzzer) for x in encoded.get("values", []))
+    rule._set_option("sep", options.get("sep", fields.Def.sep))
+    rule._set_option("cat", options.get("cat", fields.Def.cat))
+    rule._set_option("no_prune", options.get("no_prune", fields.Def.no_prune))
+    rule._set_option("max_recursion", options.get("max_recursion", fields.Def.max_recursion))
+    return rule
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+
+"""
+This module defines a non-recursive generation engine for gramfuzz.
+
+The default (``"recursive"``) engine builds values by having each field's
+``build()`` method call :any:`gramfuzz.utils.val` on its child values, which
+means every level of a derivation is another set of nested Python calls. Deep
+grammars run into Python's maximum recursion depth well before they run into
+the ``max_recursion`` reference limit.
+
+The ``"stack"`` engine defined here walks the field graph with an explicit work
+stack instead. Each core field (``And``, ``Q``, ``Def``, ``Join``, ``Or``,
+``WeightedOr``, ``Opt``, ``PLUS``, ``STAR`` and ``Ref``) is handled directly by
+the engine, and all other fields (``Int``, ``String``, custom ``Field``
+subclasses, etc.) are built by calling their ``build()`` method as usual.
+
+The random decisions made by each field are shared with the field's own
+``build()`` method (e.g. ``Or._pick``, ``Join._items``, ``Opt._skip``), so the
+output is byte-for-byte identical to the recursive engine for the same seed.
+
+The engine can be selected with :any:`gramfuzz.GramFuzzer.set_engine`:
+
+.. code-block:: python
+
+    fuzzer = gramfuzz.GramFuzzer(engine="stack")
+    fuzzer.load_grammar("python27.py")
+    fuzzer.gen(cat_group="python27", num=10, max_recursion=5000)
+"""
+
+
+from collections import deque
+
+import gramfuzz.context as context
+import gramfuzz.errors as errors
+import gramfuzz.fields as fields
+import gramfuzz.utils as utils
+
+
+# frame kinds
+_LEAF  = 0
+_AND   = 1
+_Q     = 2
+_DEF   = 3
+_JOIN  = 4
+_OR    = 5
+_OPT   = 6
+_STAR  = 7
+_REF   = 8
+
+# fields whose ``build()`` skips NOTHING values and catches OptGram/FlushGrams
+# errors from their values
+_OPT_CATCHERS = (_AND, _Q, _DEF, _JOIN)
+_FLUSH_CATCHERS = (_AND, _Q, _DEF)
+
+# the class that defines the ``build()`` method determines how the engine
+# handles a field
+_BUILD_KINDS = {
+    fields.And:         _AND,
+    fields.Q:           _Q,
+    fields.Def:         _DEF,
+    fields.Join:        _JOIN,
+    fields.Or:          _OR,
+    fields.WeightedOr:  _OR,
+    fields.Opt:         _OPT,
+    fields.STAR:        _STAR,
+    fields.Ref:         _REF,
+}
+
+_kinds = {}
+
+# markers for results that are not data. Leaf fields that return NOTHING
+# are skipped the same way as an Opt or STAR that was not chosen
+_SKIP = utils.NOTHING
+_START = object()
+_DONE = object()
+
+
+def _kind(cls):
+    """Return the frame kind for values of type ``cls``. Field subclasses
+    that override ``build()`` are treated as leaf values.
+    """
+    kind = _kinds.get(cls, None)
+    if kind is not None:
+        return kind
+
+    kind = _LEAF
+    if issubclass(cls, fields.Field):
+        for base in cls.__mro__:
+            if "build" in base.__dict__:
+                kind = _BUILD_KINDS.get(base, _LEAF)
+                break
+    _kinds[cls] = kind
+    return kind
+
+
+def build(val, pre=None, shortest=False):
+    """Build the provided value without recursing through each field's
+    ``build()`` method. This is a drop-in replacement for :any:`gramfuzz.utils.val`.
+
+    All output is written into a single ``bytearray``. Container fields
+    write their separators directly into the buffer, and ``Q`` fields quote
+    the data they wrote in place, so each output byte is only copied once
+    instead of once per nesting level.
+
+    :param val: The value to build
+    :param list pre: The prerequisites list
+    :param bool shortest: Whether or not the shortest reference-chain (most minimal) version of the field should be generated.
+    :returns: bytes, or :any:`gramfuzz.utils.NOTHING` if the value should be skipped
+    """
+    if pre is None:
+        pre = []
+
+    MF = fields.MetaField
+    kinds = _kinds
+    ctx = context.current()
+    recursion = ctx.recursion
+    budget = ctx.budget
+
+    # each frame is a list of
+    #   [kind, field, items, next_idx, start, shortest, count, mark, item]
+    # or [_REF, start] for references. ``start`` is the offset in ``buf`` where the
+    # field's data begins, ``count`` is the number of values that have been
+    # written, and ``mark`` is the offset where the current value (including
+    # its separator) begins. ``item`` is the offset where the current repetition
+    # of a ``Join`` item begins if a node of the budget was spent on it, else ``None``.
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    buf = bytearray()
+
+    res = None
+    descending = True
+    while True:
+        try:
+            if descending:
+                # build ``val`` until it either produces a result or pushes
+                # a new frame onto the stack
+                while True:
+                    if type(val) is bytes:
+                        res = val
+                        break
+                    if type(val) is MF:
+                        val = val.shared()
+
+                    kind = kinds.get(type(val), None)
+                    if kind is None:
+                        kind = _kind(type(val))
+
+                    if kind == _LEAF:
+                        res = utils.val(val, pre, shortest=shortest)
+                        break
+
+                    elif kind == _OR:
+                        val = val.values[val._pick(shortest)]
+
+                    elif kind == _REF:
+                        ctx.ref_level += 1
+                        push([_REF, len(buf)])
+                        if recursion is None:
+                            limited = ctx.ref_level >= val._recursion_limit(ctx)
+                        else:
+                            limited = recursion.enter(val, ctx.ref_level, val._recursion_limit(ctx))
+                        if budget is not None and budget.enter():
+                            shortest = True
+                        definition = val._resolve(ctx.staged_defs)
+                        shortest = (shortest or limited)
+                        val = definition
+
+                    else:
+                        if kind == _OPT:
+                            if val._skip(shortest):
+                                res = _SKIP
+                                break
+                            kind = _AND
+                            items = val.values
+                        elif kind == _STAR:
+                            if val._skip(shortest):
+                                res = _SKIP
+                                break
+                            kind = _JOIN
+                            items = val._items(shortest)
+                        elif kind == _JOIN:
+                            items = val._items(shortest)
+                        else:
+                            items = val.values
+
+                        offset = len(buf)
+                        push([kind, val, items, 0, offset, shortest, 0, offset, None])
+                        res = _START
+                        break
+                descending = False
+                continue
+
+            # deliver ``res`` to the frame on the top of the stack
+            if len(stack) == 0:
+                if res is _DONE:
+                    return bytes(buf)
+                return res
+
+            frame = stack[-1]
+            if frame[0] == _REF:
+                pop()
+                ctx.ref_level -= 1
+                if recursion is not None:
+                    recursion.exit()
+                if budget is not None:
+                    if res is _DONE:
+                        budget.exit(len(buf) - frame[1])
+                    elif res is _SKIP:
+                        budget.exit(0)
+                    else:
+                        budget.exit(len(res))
+                continue
+
+            if res is _SKIP:
+                del buf[frame[7]:]
+            elif res is not _START:
+                if res is not _DONE:
+                    buf += res
+                frame[6] += 1
+            if frame[8] is not None:
+                budget.exit(0 if res is _SKIP else len(buf) - frame[8])
+                frame[8] = None
+
+            items = frame[2]
+            idx = frame[3]
+            repeating = (budget is not None and frame[0] == _JOIN and frame[1].max is not None)
+            if idx > 0 and repeating and budget.exhausted:
+                # stop repeating the item once the budget is exhausted
+                idx = len(items)
+            if idx < len(items):
+                frame[3] = idx + 1
+                frame[7] = len(buf)
+                if frame[6] > 0:
+                    buf += frame[1].sep
+                val = items[idx]
+                shortest = frame[5]
+                if repeating:
+                    # spend a node on every repetition of the item
+                    if budget.enter():
+                        shortest = True
+                    frame[8] = len(buf)
+                descending = True
+                continue
+
+            pop()
+            if frame[0] == _Q:
+                start = frame[4]
+                quoted = frame[1]._quote(bytes(buf[start:]))
+                del buf[start:]
+                buf += quoted
+            res = _DONE
+
+        except Exception as e:
+            res = _unwind(stack, buf, e, pre, ctx)
+            descending = False
+
+
+def _unwind(stack, buf, e, pre, ctx):
+    """Unwind the stack until a frame is found that handles the exception
+    ``e`` the same way the field's ``build()`` method would have. The
+    exception is re-raised if no frame handles it.
+
+    :returns: The result that should be delivered to the frame that handled the exception
+    """
+    while len(stack) > 0:
+        frame = stack[-1]
+        kind = frame[0]
+
+        if kind == _REF:
+            stack.pop()
+            ctx.ref_level -= 1
+            if ctx.recursion is not None:
+                ctx.recursion.exit()
+            if ctx.budget is not None:
+                ctx.budget.exit()
+            continue
+
+        if kind == _JOIN and frame[8] is not None:
+            # the current repetition failed
+            ctx.budget.exit()
+            frame[8] = None
+
+        if kind in _OPT_CATCHERS and isinstance(e, errors.OptGram):
+            return _SKIP
+
+        if kind in _FLUSH_CATCHERS and isinstance(e, errors.FlushGrams):
+            # only the values that were built before the current one are
+            # flushed
+            start = frame[4]
+            res = deque([bytes(buf[start:frame[7]])])
+            del buf[start:]
+            frame[6] = 0
+            frame[1]._flush_grams(res, pre)
+            return _START
+
+        if kind == _DEF and isinstance(e, errors.GramFuzzError):
+            print("{} : {}".format(frame[1].name, str(e)))
+
+        stack.pop()
+
+    raise e
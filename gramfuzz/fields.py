@@ -21,6 +21,7 @@ Each field has a ``build()`` method, which accepts one argument
 """
 
 
+import bisect
 import codecs
 from collections import deque
 import json
@@ -30,10 +31,19 @@ import six
 
 
 from gramfuzz import GramFuzzer
+import gramfuzz.context as context
 import gramfuzz.errors as errors
 import gramfuzz.rand as rand
 import gramfuzz.utils as utils
-from gramfuzz.utils import binstr, maybe_binstr
+from gramfuzz.utils import binstr, maybe_binstr, normalize
+
+
+def _normalize_values(values):
+    """Return a list of the normalized ``values`` of a field (see
+    :any:`gramfuzz.utils.normalize`). The list is created from a tuple so that
+    it is not over-allocated.
+    """
+    return list(tuple(map(normalize, values)))
 
 
 class MetaField(type):
@@ -77,7 +87,7 @@ class MetaField(type):
         """Wraps this field and the other field in an ``And``
         """
         if isinstance(other, And) and other.rolling:
-            other.values.append(self)
+            other.values.append(normalize(self))
             return other
         else:
             return And(self, other, rolling=True)
@@ -86,10 +96,21 @@ class MetaField(type):
         """Wraps this field and the other field in an ``Or``
         """
         if isinstance(other, Or) and other.rolling:
-            other.values.append(self)
+            other.values.append(normalize(self))
             return other
         else:
             return Or(self, other, rolling=True)
+
+    def shared(cls):
+        """Return the instance of this field class that is built wherever the
+        class itself is used as a value, e.g. the ``UInt`` in ``And(UInt, ",")``.
+        The instance is created the first time it is needed.
+        """
+        inst = cls.__dict__.get("_shared_instance", None)
+        if inst is None:
+            inst = cls()
+            cls._shared_instance = inst
+        return inst
     
     def __repr__(self):
         return "<{}>".format(self.__name__)
@@ -97,8 +118,16 @@ class MetaField(type):
 class Field(six.with_metaclass(MetaField)):
     """The core class that all field classes are based one. Contains
     utility methods to determine probabilities/choices/min-max/etc.
+
+    The field classes define ``__slots__`` for the attributes every instance
+    has. Settings that have a class-level default (e.g. ``sep`` or ``odds``)
+    are only stored on an instance if they were changed for that instance,
+    so that large grammars don't keep a copy of every default in every field.
+    Subclasses can still add their own attributes.
     """
 
+    __slots__ = ("__dict__",)
+
     shortest_is_nothing = False
     """This is used during :any:`gramfuzz.GramFuzzer.find_shortest_paths`. Sometimes
     the fuzzer cannot know based on the values in a field what that field's
@@ -109,8 +138,9 @@ class Field(six.with_metaclass(MetaField)):
 
     *NOTE* when implementing a custom Field subclass and setting ``shortest_is_nothing``
     to ``True``, be sure to handle the case when ``build(shortest=True)``
-    is called so that a ``gramfuzz.errors.OptGram`` error is raised (which
-    skips the current field from being generated).
+    is called so that :any:`gramfuzz.utils.NOTHING` is returned (which
+    skips the current field from being generated). Raising a
+    ``gramfuzz.errors.OptGram`` error also works, but is much slower.
     """
 
     min = 0
@@ -140,7 +170,7 @@ class Field(six.with_metaclass(MetaField)):
         :param  other: Another ``Field`` class, instance, or python object to ``Or`` with
         """
         if isinstance(self, And) and self.rolling:
-            self.values.append(other)
+            self.values.append(normalize(other))
             return self
         elif isinstance(other, And) and other.rolling:
             other.values.append(self)
@@ -154,7 +184,7 @@ class Field(six.with_metaclass(MetaField)):
         :param  other: Another ``Field`` class, instance, or python object to ``Or`` with
         """
         if isinstance(self, Or) and self.rolling:
-            self.values.append(other)
+            self.values.append(normalize(other))
             return self
         elif isinstance(other, Or) and other.rolling:
             other.values.append(self)
@@ -162,35 +192,63 @@ class Field(six.with_metaclass(MetaField)):
         else:
             return Or(self, other, rolling=True)
 
+    _odds_cache = None
+    """The compiled ``odds`` table, and the ``odds`` list it was compiled from.
+    Stored on the instance the first time the field is built, so that
+    generating from several threads never changes a class. Assign a new list
+    to ``odds`` instead of changing the items of an ``odds`` list that has been used.
+    """
+
     def _odds_val(self):
         """Determine a new random value derived from the
         defined :any:`gramfuzz.fields.Field.odds` value.
 
         :returns: The derived value
         """
-        if len(self.odds) == 0:
-            self.odds = [(1.00, [self.min, self.max])]
+        return self._odds_table().sample()
 
-        rand_val = rand.random()
-        total = 0
-        for percent,v in self.odds:
-            if total <= rand_val < total+percent:
-                break
-            total += percent
+    def _odds_table(self):
+        """Return the compiled table of this field's ``odds``
+        """
+        odds = self.odds
+        # Int and its subclasses keep the cache in a slot, which is unset
+        # until the field is first built
+        cache = getattr(self, "_odds_cache", None)
+        if cache is None or cache[0] is not odds:
+            if len(odds) == 0:
+                cache = (odds, _OddsTable([(1.00, [self.min, self.max])]))
+            else:
+                cache = (odds, _OddsTable(odds))
+            self._odds_cache = cache
 
-        res = None
-        if isinstance(v, (tuple,list)):
-            rand_func = rand.randfloat if type(v[0]) is float else rand.randint
+        return cache[1]
+
+    def _set_option(self, name, value):
+        """Set the setting ``name`` of this field to ``value``. The value is only
+        stored on the instance if it is not the class's default value.
+        """
+        if value is not getattr(type(self), name, None):
+            setattr(self, name, value)
+    
+    def _flush_grams(self, res, pre):
+        """Move the values built so far in ``res`` into the prerequisites
+        (or the current scope's statements) after a ``FlushGrams`` error.
 
-            if len(v) == 2:
-                res = rand_func(v[0], v[1])
-            elif len(v) == 1:
-                res = v[0]
+        :param res: The values built so far (will be cleared)
+        :param list pre: The prerequisites list
+        """
+        prev = "".join(res)
+        res.clear()
+        fuzzer = GramFuzzer.instance()
+        # this is assuming a scope was pushed!
+        if len(fuzzer._scope_stack) == 1:
+            pre.append(prev)
         else:
-            res = v
+            stmts = fuzzer._curr_scope.setdefault("prev_append", deque())
+            stmts.extend(pre)
+            stmts.append(prev)
+            pre.clear()
 
-        return res
-    
     def __repr__(self):
         res = "<{}".format(self.__class__.__name__)
         if hasattr(self, "values"):
@@ -200,11 +258,119 @@ class Field(six.with_metaclass(MetaField)):
         return res
 
 
+# kinds of _OddsTable entries
+_ODDS_FIXED = 0
+_ODDS_INT   = 1
+_ODDS_FLOAT = 2
+_ODDS_RANGE = 3
+
+
+def _str_len(v):
+    return len(str(v))
+
+
+def _identity(v):
+    return v
+
+
+class _OddsTable(object):
+    """An ``odds`` list compiled into the running totals of its probabilities
+    and a typed entry for each of its values. Sampling takes one random float
+    and a binary search, and returns the same value walking the ``odds`` list
+    would have.
+    """
+
+    def __init__(self, odds):
+        """Compile ``odds`` (see :any:`gramfuzz.fields.Field.odds`)
+        """
+        self.cumulative = []
+        self.entries = []
+
+        total = 0
+        for percent,v in odds:
+            total += percent
+            self.cumulative.append(total)
+            self.entries.append(self._entry(v))
+
+        # a random value past the last total uses the last entry
+        self.last = len(self.entries) - 1
+
+        # func -> the average returned by mean(func)
+        self.means = {}
+
+    def _entry(self, v):
+        """Compile a single odds value into a ``(kind, a, b)`` tuple
+        """
+        if not isinstance(v, (tuple,list)):
+            return (_ODDS_FIXED, v, None)
+        if len(v) == 1:
+            return (_ODDS_FIXED, v[0], None)
+        if len(v) != 2:
+            return (_ODDS_FIXED, None, None)
+
+        if type(v[0]) is float:
+            # same as rand.randfloat(v[0], v[1])
+            return (_ODDS_FLOAT, v[0], v[1] - v[0])
+        if type(v[0]) in six.integer_types and type(v[1]) in six.integer_types and v[1] > v[0]:
+            # same as rand.randint(v[0], v[1])
+            return (_ODDS_RANGE, v[0], v[1] - v[0])
+        return (_ODDS_INT, v[0], v[1])
+
+    def sample(self):
+        """Return a new random value
+        """
+        idx = bisect.bisect_right(self.cumulative, rand.random())
+        kind, a, b = self.entries[min(idx, self.last)]
+        if kind == _ODDS_RANGE:
+            return a + rand.randbelow(b)
+        elif kind == _ODDS_FIXED:
+            return a
+        elif kind == _ODDS_FLOAT:
+            return rand.random() * b + a
+        return rand.randint(a, b)
+
+    def mean(self, func):
+        """Estimate the average of ``func`` called with the values the table
+        samples. Ranges count as the average of ``func`` at both of their ends.
+
+        :param function func: Called with a value, returns a number
+        """
+        if func in self.means:
+            return self.means[func]
+
+        total = 0.0
+        prev = 0.0
+        for idx, (kind, a, b) in enumerate(self.entries):
+            # a random value past the last total uses the last entry
+            end = 1.0 if idx == self.last else min(self.cumulative[idx], 1.0)
+            percent, prev = max(end - prev, 0.0), max(end, prev)
+            if percent == 0 or a is None:
+                continue
+            if kind == _ODDS_FIXED:
+                total += percent * func(a)
+                continue
+            if kind == _ODDS_RANGE:
+                b = a + b - 1
+            elif kind == _ODDS_FLOAT:
+                b = a + b
+            total += percent * (func(a) + func(b)) / 2.0
+
+        self.means[func] = total
+        return total
+
+
 class Int(Field):
     """Represents all Integers, with predefined odds that target
     boundary conditions.
     """
 
+    __slots__ = ("_odds_cache",)
+
+    value = None
+    """The hard-coded value of the field, which is built half of the time
+    (default=``None``)
+    """
+
     min = 0
     max = 0x10000003
 
@@ -231,14 +397,14 @@ class Int(Field):
         :param int max: The maximum value (if value is not specified)
         :param list odds: The probability list. See ``Field.odds`` for more information.
         """
-        self.value = value
+        self._set_option("value", value)
 
         if "min" in kwargs or "max" in kwargs:
             self.odds = []
 
-        self.min = kwargs.setdefault("min", self.min)
-        self.max = kwargs.setdefault("max", self.max)
-        self.odds = kwargs.setdefault("odds", self.odds)
+        self._set_option("min", kwargs.setdefault("min", self.min))
+        self._set_option("max", kwargs.setdefault("max", self.max))
+        self._set_option("odds", kwargs.setdefault("odds", self.odds))
     
     def build(self, pre=None, shortest=False):
         """Build the integer, optionally providing a ``pre`` list
@@ -258,10 +424,21 @@ class Int(Field):
 
         return self._odds_val()
 
+    def _mean_size(self):
+        """Return the average length of the values built from this field's
+        ``odds`` (not counting ``value``), used to estimate how large the rules
+        using the field are (see :any:`gramfuzz.GramFuzzer.preprocess_rules`)
+        """
+        if self.min == self.max:
+            return len(str(self.min))
+        return self._odds_table().mean(_str_len)
+
 
 class UInt(Int):
     """Defines an unsigned integer ``Field``.
     """
+    __slots__ = ()
+
     neg = False
 
     odds = [
@@ -278,6 +455,8 @@ class Float(Int):
     """Defines a float ``Field`` with odds that define float
     values
     """
+    __slots__ = ()
+
     odds = [
         (0.75,    [-100.0,100.0]),
         (0.05,    0),
@@ -290,6 +469,8 @@ class Float(Int):
 class UFloat(Float):
     """Defines an unsigned float field.
     """
+    __slots__ = ()
+
     odds = [
         (0.75,    [0.0,100.0]),
         (0.05,    0),
@@ -300,6 +481,8 @@ class UFloat(Float):
 class String(UInt):
     """Defines a string field
     """
+    __slots__ = ()
+
     min = 0
     max = 0x100
 
@@ -358,7 +541,7 @@ class String(UInt):
         """
         super(String, self).__init__(value, **kwargs)
 
-        self.charset = binstr(kwargs.setdefault("charset", self.charset))
+        self._set_option("charset", binstr(kwargs.setdefault("charset", self.charset)))
 
     def build(self, pre=None, shortest=False):
         """Build the String instance
@@ -376,13 +559,28 @@ class String(UInt):
         res = rand.data(length, self.charset)
         return res
 
+    def _mean_size(self):
+        """Return the average length of the strings built from this field's
+        ``odds`` (not counting ``value``)
+        """
+        if self.min == self.max:
+            return self.min
+        return self._odds_table().mean(_identity)
+
 class Join(Field):
     """A ``Field`` subclass that joins other values with a separator.
     This class works nicely with ``Opt`` values.
     """
+
+    __slots__ = ("values",)
     
     sep = b","
 
+    max = None
+    """The maximum number of times to build the first value, or ``None`` to
+    build each value once (default=``None``)
+    """
+
     def __init__(self, *values, **kwargs):
         """Create a new instance of the ``Join`` class.
 
@@ -395,9 +593,9 @@ class Join(Field):
             
                 Join(Int, max=5, sep=",")
         """
-        self.values = list(map(maybe_binstr, values))
-        self.sep = binstr(kwargs.setdefault("sep", self.sep))
-        self.max = kwargs.setdefault("max", None)
+        self.values = _normalize_values(values)
+        self._set_option("sep", binstr(kwargs.setdefault("sep", self.sep)))
+        self._set_option("max", kwargs.setdefault("max", self.max))
     
     def build(self, pre=None, shortest=False):
         """Build the ``Join`` field instance.
@@ -409,42 +607,88 @@ class Join(Field):
         if pre is None:
             pre = []
 
+        NOTHING = utils.NOTHING
+        budget = None
         if self.max is not None:
-            if shortest:
-                vals = [self.values[0]]
-            else:
-                # +1 to make it inclusive
-                vals = [self.values[0]] * rand.randint(1, self.max+1)
-        else:
-            vals = self.values
+            budget = context.current().budget
 
         joins = []
-        for val in vals:
+        for idx, val in enumerate(self._items(shortest)):
+            # stop repeating the item once the budget is exhausted
+            if idx > 0 and budget is not None and budget.exhausted:
+                break
             try:
-                v = utils.val(val, pre, shortest=shortest)
-                joins.append(v)
+                if budget is None:
+                    v = utils.val(val, pre, shortest=shortest)
+                else:
+                    v = self._build_item(val, pre, shortest, budget)
+                if v is not NOTHING:
+                    joins.append(v)
             except errors.OptGram as e:
                 continue
         return self.sep.join(joins)
 
+    def _build_item(self, val, pre, shortest, budget):
+        """Build a single repetition of the item ``val``, spending a node of
+        the budget ``budget`` on it
+
+        :param gramfuzz.context.Budget budget: The budget of the rule being generated
+        """
+        if budget.enter():
+            shortest = True
+        length = None
+        try:
+            v = utils.val(val, pre, shortest=shortest)
+            length = 0 if v is utils.NOTHING else len(v)
+            return v
+        finally:
+            budget.exit(length)
+
+    def _items(self, shortest=False):
+        """Return the list of values that should be joined for a single build.
+        Randomly repeats the first value if ``max`` is set.
+
+        :param bool shortest: Whether or not the shortest reference-chain (most minimal) version of the field should be generated.
+        """
+        if self.max is None:
+            return self.values
+        if shortest:
+            return [self.values[0]]
+        # +1 to make it inclusive
+        count = rand.randint(1, self.max+1)
+        budget = context.current().budget
+        if budget is not None:
+            count = budget.repeats(count, self._item_cost())
+        return [self.values[0]] * count
+
+    def _item_cost(self):
+        """Return the number of bytes (including the separator) and nodes a
+        repetition of the first value builds at least, if the ``GramFuzzer``
+        knows it (see :any:`gramfuzz.context.Budget`)
+        """
+        return GramFuzzer.instance()._budget_costs.get(self, None)
+
 
 class And(Field):
     """A ``Field`` subclass that concatenates two values together.
     This class works nicely with ``Opt`` values.
     """
 
+    __slots__ = ("values",)
+
     sep = b""
 
+    # to be used internally, is not intended to be set directly by a user
+    rolling = False
+
     def __init__(self, *values, **kwargs):
         """Create a new ``And`` field instance.
         
         :param list values: The list of values to be concatenated
         """
-        self.sep = binstr(kwargs.setdefault("sep", self.sep))
-        self.values = list(map(maybe_binstr, values))
-        # to be used internally, is not intended to be set directly by a user
-        self.rolling = kwargs.setdefault("rolling", False)
-        self.fuzzer = GramFuzzer.instance()
+        self._set_option("sep", binstr(kwargs.setdefault("sep", self.sep)))
+        self.values = _normalize_values(values)
+        self._set_option("rolling", kwargs.setdefault("rolling", self.rolling))
     
     def build(self, pre=None, shortest=False):
         """Build the ``And`` instance
@@ -455,23 +699,17 @@ class And(Field):
         if pre is None:
             pre = []
 
+        NOTHING = utils.NOTHING
         res = deque()
         for x in self.values:
             try:
-                res.append(utils.val(x, pre, shortest=shortest))
+                v = utils.val(x, pre, shortest=shortest)
+                if v is not NOTHING:
+                    res.append(v)
             except errors.OptGram as e:
                 continue
             except errors.FlushGrams as e:
-                prev = "".join(res)
-                res.clear()
-                # this is assuming a scope was pushed!
-                if len(self.fuzzer._scope_stack) == 1:
-                    pre.append(prev)
-                else:
-                    stmts = self.fuzzer._curr_scope.setdefault("prev_append", deque())
-                    stmts.extend(pre)
-                    stmts.append(prev)
-                    pre.clear()
+                self._flush_grams(res, pre)
                 continue
 
         return self.sep.join(res)
@@ -481,6 +719,8 @@ class Q(And):
     """A ``Field`` subclass that quotes whatever value is provided.
     """
 
+    __slots__ = ()
+
     escape = False
     """Whether or not the quoted data should be escaped (default=``False``). Uses ``repr(X)``
     """
@@ -501,9 +741,9 @@ class Q(And):
         :param str quote: The quote character to be used if ``escape`` and ``html_js_escape`` are ``False``
         """
         super(Q, self).__init__(*values, **kwargs)
-        self.escape = kwargs.setdefault("escape", self.escape)
-        self.html_js_escape = kwargs.setdefault("html_js_escape", self.html_js_escape)
-        self.quote = kwargs.setdefault("quote", self.quote)
+        self._set_option("escape", kwargs.setdefault("escape", self.escape))
+        self._set_option("html_js_escape", kwargs.setdefault("html_js_escape", self.html_js_escape))
+        self._set_option("quote", kwargs.setdefault("quote", self.quote))
 
     def _repr_escape(self, val):
         """Perform a repr escape on 'val', trimming the ``b`` off of the
@@ -523,7 +763,13 @@ class Q(And):
         :param bool shortest: Whether or not the shortest reference-chain (most minimal) version of the field should be generated.
         """
         res = super(Q, self).build(pre, shortest=shortest)
+        return self._quote(res)
+
+    def _quote(self, res):
+        """Quote (and possibly escape) the already-built data ``res``
 
+        :param bytes res: The data to quote
+        """
         if self.escape:
             return self._repr_escape(res)
         elif self.html_js_escape:
@@ -538,6 +784,11 @@ class Or(Field):
     at random as the result of a call to the ``build()`` method.
     """
 
+    __slots__ = ("values", "shortest_vals", "shortest_indices")
+
+    # to be used internally, is not intended to be set directly by a user
+    rolling = False
+
     def __init__(self, *values, **kwargs):
         """Create a new ``Or`` instance with the provide values
 
@@ -548,10 +799,10 @@ class Or(Field):
         self.shortest_vals = None
         self.shortest_indices = None
 
-        self.values = list(map(maybe_binstr, values))
+        self.values = _normalize_values(values)
         if "options" in kwargs and len(values) == 0:
-            self.values = list(map(maybe_binstr, kwargs["options"]))
-        self.rolling = kwargs.setdefault("rolling", False)
+            self.values = _normalize_values(kwargs["options"])
+        self._set_option("rolling", kwargs.setdefault("rolling", self.rolling))
     
     def build(self, pre=None, shortest=False):
         """Build the ``Or`` instance
@@ -569,12 +820,39 @@ class Or(Field):
         # 
         # see https://narly.me/posts/controlling-recursion-depth-in-grammars/
         # for an in-depth discussion
-        if shortest and self.shortest_vals is not None:
-            chosen_val = rand.choice(self.shortest_vals)
-        else:
-            chosen_val = rand.choice(self.values)
+        return utils.val(self.values[self._pick(shortest)], pre, shortest=shortest)
 
-        return utils.val(chosen_val, pre, shortest=shortest)
+    def _pick(self, shortest=False):
+        """Randomly choose the index of the value within ``self.values``
+        that should be built.
+
+        :param bool shortest: Whether or not the shortest reference-chain (most minimal)
+            version of the field should be generated.
+        :returns: int
+        """
+        if shortest and self.shortest_vals is not None:
+            return self.shortest_indices[rand.randint(len(self.shortest_indices))]
+        fitting = self._fitting()
+        if fitting:
+            return fitting[rand.randint(len(fitting))]
+        if fitting is not None and self.shortest_vals is not None:
+            # none of the values fit, build the cheapest ones
+            return self._pick(True)
+        return rand.randint(len(self.values))
+
+    def _fitting(self):
+        """Return the indices of the values that fit within the budget of the
+        rule being generated, or ``None`` if all of them fit
+        """
+        budget = context.current().budget
+        if budget is None:
+            return None
+        # the number of bytes and nodes each value builds at least, and the
+        # highest of them, if the GramFuzzer knows them
+        costs = GramFuzzer.instance()._budget_costs.get(self, None)
+        if costs is None or budget.fits(costs[1]):
+            return None
+        return budget.fitting(costs[0])
 
 
 class WeightedOr(Or):
@@ -601,6 +879,8 @@ class WeightedOr(Or):
         )
     """
 
+    __slots__ = ("weights", "_table", "_shortest_table", "_shortest_table_indices", "_fitting_tables")
+
     def __init__(self, *values, **kwargs):
         """Create a new ``WeightedOr`` instance with the provided values.
 
@@ -615,14 +895,23 @@ class WeightedOr(Or):
         self.shortest_indices = None
 
         vals = [x[0] for x in values]
-        self.values= list(map(maybe_binstr, vals))
+        self.values= _normalize_values(vals)
         self.weights = [x[1] for x in values]
 
         if abs(1.0 - sum(self.weights)) > 0.0001:
             raise("Weights in WeightedOr don't sum to 1.0: {}".format(self.weights))
         if "options" in kwargs and len(values) == 0:
-            self.values = list(map(maybe_binstr, kwargs["options"]))
-        self.rolling = kwargs.setdefault("rolling", False)
+            self.values = _normalize_values(kwargs["options"])
+        self._set_option("rolling", kwargs.setdefault("rolling", self.rolling))
+
+        self._table = rand.WeightedTable(self.weights)
+        # the table of the shortest values, and the shortest_indices it
+        # was created for
+        self._shortest_table = None
+        self._shortest_table_indices = None
+        # the tables of the values that fit within a budget, keyed by the
+        # indices of those values (created when first needed)
+        self._fitting_tables = None
 
     def build(self, pre=None, shortest=False):
         """
@@ -633,44 +922,87 @@ class WeightedOr(Or):
         if pre is None:
             pre = []
 
+        return utils.val(self.values[self._pick(shortest)], pre, shortest=shortest)
+
+    def _pick(self, shortest=False):
+        """Randomly choose the index of the value within ``self.values``
+        that should be built, using the weights of each value.
+
+        :param bool shortest: Whether or not the shortest reference-chain (most minimal)
+            version of the field should be generated.
+        :returns: int
+        """
         # self.shortest_vals will be set by the GramFuzzer and will
         # contain a list of value options that have a minimal reference chain
         # 
         # see https://narly.me/posts/controlling-recursion-depth-in-grammars/
         # for an in-depth discussion
         if shortest and self.shortest_vals is not None:
-            chosen_weights = [self.weights[idx] for idx in self.shortest_indices]
-            chosen_vals = self.shortest_vals
-
-            total_percent = sum(chosen_weights)
-            # scale the percent weights up if the new chosen weights don't sum
-            # to 1.0
-            if total_percent != 1.0:
-                scale = 1.0 / total_percent
-                chosen_weights = [x * scale for x in chosen_weights]
-        else:
-            chosen_weights = self.weights
-            chosen_vals = self.values
+            if self._shortest_table_indices is not self.shortest_indices:
+                self._make_shortest_table()
+            return self.shortest_indices[self._shortest_table.pick()]
+        fitting = self._fitting()
+        if fitting:
+            tables = self._fitting_tables
+            if tables is None:
+                tables = self._fitting_tables = {}
+            key = tuple(fitting)
+            if key not in tables:
+                tables[key] = self._make_fitting_table(fitting)
+            table = tables[key]
+            if table is not None:
+                return fitting[table.pick()]
+        if fitting is not None and self.shortest_vals is not None:
+            # none of the values fit, build the cheapest ones
+            return self._pick(True)
+        return self._table.pick()
+
+    def _make_shortest_table(self):
+        """Create the weighted table of the current ``shortest_indices``
+        """
+        chosen_weights = [self.weights[idx] for idx in self.shortest_indices]
+
+        total_percent = sum(chosen_weights)
+        # scale the percent weights up if the new chosen weights don't sum
+        # to 1.0
+        if total_percent != 1.0:
+            scale = 1.0 / total_percent
+            chosen_weights = [x * scale for x in chosen_weights]
+
+        self._shortest_table = rand.WeightedTable(chosen_weights)
+        self._shortest_table_indices = self.shortest_indices
 
-        val = rand.weighted_choice(chosen_vals, chosen_weights)
-        return utils.val(val, pre, shortest=shortest)
+    def _make_fitting_table(self, fitting):
+        """Create the weighted table of the values at the indices ``fitting``,
+        or return ``None`` if none of them can be chosen
+
+        :param list fitting: The indices of the values that fit within the budget
+        """
+        chosen_weights = [self.weights[idx] for idx in fitting]
+        total_percent = sum(chosen_weights)
+        if total_percent <= 0:
+            return None
+        scale = 1.0 / total_percent
+        return rand.WeightedTable([x * scale for x in chosen_weights])
 WOr = WeightedOr
 
 
 class Opt(And):
     """A ``Field`` subclass that randomly chooses to either build the
-    provided values (acts as an ``And`` in that case), or raise an
-    ``errors.OptGram`` exception.
+    provided values (acts as an ``And`` in that case), or return
+    :any:`gramfuzz.utils.NOTHING`.
 
-    When an ``errors.OptGram`` exception is raised, the current value being built
+    When ``NOTHING`` is returned, the current value being built
     is then skipped
     """
 
+    __slots__ = ()
+
     shortest_is_nothing = True
 
     prob = 0.5
-    """The probability of an ``Opt`` instance raising an ``errors.OptGram``
-    exception
+    """The probability of an ``Opt`` instance being skipped (building
+    to ``NOTHING``)
     """
 
     def __init__(self, *values, **kwargs):
@@ -681,7 +1013,7 @@ class Opt(And):
         of cancelling the current build.
         """
         super(Opt, self).__init__(*values, **kwargs)
-        self.prob = kwargs.setdefault("prob", self.prob)
+        self._set_option("prob", kwargs.setdefault("prob", self.prob))
 
     def build(self, pre=None, shortest=False):
         """Build the current ``Opt`` instance
@@ -692,11 +1024,19 @@ class Opt(And):
         if pre is None:
             pre = []
 
-        if shortest or rand.maybe(self.prob):
-            raise errors.OptGram
+        if self._skip(shortest):
+            return utils.NOTHING
 
         return super(Opt, self).build(pre, shortest=shortest)
 
+    def _skip(self, shortest=False):
+        """Randomly decide if this ``Opt`` should be skipped (not built)
+
+        :param bool shortest: Whether or not the shortest reference-chain (most minimal) version of the field should be generated.
+        :returns: bool
+        """
+        return shortest or rand.maybe(self.prob)
+
 # ----------------------------
 # Non-direct classes
 # ----------------------------
@@ -727,6 +1067,8 @@ class Def(Field):
     rules.
     """
 
+    __slots__ = ("name", "values")
+
     sep = b""
     """The separator of values for this rule definition (default=``""``)
     """
@@ -740,6 +1082,12 @@ class Def(Field):
     """The default category of this ``Def`` class (default=``"default"``)
     """
 
+    max_recursion = None
+    """The max recursion of references to this rule, or ``None`` to use the
+    max recursion of the references (default=``None``). If several definitions of
+    a rule set it, the lowest one is used. See :any:`gramfuzz.GramFuzzer.recursion`.
+    """
+
     def __init__(self, name, *values, **options):
         """Create a new rule definition. Simply instantiating a new rule definition
         will add it to the current ``GramFuzzer`` instance.
@@ -750,22 +1098,28 @@ class Def(Field):
         :param str cat: The category to create the rule in (default=``"default"``).
         :param bool no_prune: If this rule should not be pruned *EVEN IF* it is found to be
             unreachable (default=``False``)
+        :param int max_recursion: The max recursion of references to this rule (default=``None``)
         """
         self.name = name
-        self.options = options
-        self.values = list(map(maybe_binstr, values))
+        self.values = _normalize_values(values)
 
-        self.sep = binstr(self.options.setdefault("sep", self.sep))
-        self.cat = self.options.setdefault("cat", self.cat)
-        self.no_prune = self.options.setdefault("no_prune", self.no_prune)
+        self._set_option("sep", binstr(options.setdefault("sep", self.sep)))
+        self._set_option("cat", options.setdefault("cat", self.cat))
+        self._set_option("no_prune", options.setdefault("no_prune", self.no_prune))
+        self._set_option("max_recursion", options.setdefault("max_recursion", self.max_recursion))
 
-        self.fuzzer = GramFuzzer.instance()
+        fuzzer = GramFuzzer.instance()
 
-        frame,mod_path,_,_,_,_ = inspect.stack()[1]
+        # only the frame of the caller is needed, inspect.stack() would
+        # also read the source of every frame on the stack
+        frame = inspect.currentframe().f_back
+        mod_path = frame.f_code.co_filename
         module_name = os.path.basename(mod_path).replace(".pyc", "").replace(".py", "")
-        if "TOP_CAT" in frame.f_locals:
-            self.fuzzer.cat_group_defaults[module_name] = frame.f_locals["TOP_CAT"]
-        self.fuzzer.add_definition(self.cat, self.name, self, no_prune=self.no_prune, gram_file=module_name)
+        f_locals = frame.f_locals
+        if "TOP_CAT" in f_locals:
+            fuzzer.cat_group_defaults[module_name] = f_locals["TOP_CAT"]
+        del frame, f_locals
+        fuzzer.add_definition(self.cat, self.name, self, no_prune=self.no_prune, gram_file=module_name)
     
     def build(self, pre=None, shortest=False):
         """Build this rule definition
@@ -776,21 +1130,15 @@ class Def(Field):
         if pre is None:
             pre = []
 
+        NOTHING = utils.NOTHING
         res = deque()
         for value in self.values:
             try:
-                res.append(utils.val(value, pre, shortest=shortest))
+                v = utils.val(value, pre, shortest=shortest)
+                if v is not NOTHING:
+                    res.append(v)
             except errors.FlushGrams as e:
-                prev = "".join(res)
-                res.clear()
-                # this is assuming a scope was pushed!
-                if len(self.fuzzer._scope_stack) == 1:
-                    pre.append(prev)
-                else:
-                    stmts = self.fuzzer._curr_scope.setdefault("prev_append", deque())
-                    stmts.extend(pre)
-                    stmts.append(prev)
-                    pre.clear()
+                self._flush_grams(res, pre)
                 continue
             except errors.OptGram as e:
                 continue
@@ -800,7 +1148,20 @@ class Def(Field):
 
         return self.sep.join(res)
 
-REF_LEVEL = 1
+
+def _class_max_recursion(cls):
+    """Return the ``max_recursion`` set by the ``Ref`` subclass ``cls`` (or one
+    of its bases below ``Ref``), or ``None`` if it uses the max recursion of all
+    references
+    """
+    for klass in cls.__mro__:
+        if klass is Ref:
+            break
+        if "max_recursion" in klass.__dict__:
+            return klass.__dict__["max_recursion"]
+    return None
+
+
 class Ref(Field):
     """The ``Ref`` class is used to reference defined rules by their name. If a
     rule name is defined multiple times, one will be chosen at random.
@@ -823,21 +1184,56 @@ class Ref(Field):
     """The default category where the referenced rule definition will be looked for
     """
 
+    # _binding is the fuzzer the reference was bound with, its ``defs`` version,
+    # and the rule definitions returned by GramFuzzer.bind_ref for that version
+    __slots__ = ("refname", "_binding")
+
     max_recursion = 10
+    """The max recursion of all references (see :any:`gramfuzz.GramFuzzer.set_max_recursion`).
+    The ``max_recursion`` passed to :any:`gramfuzz.GramFuzzer.gen` replaces it
+    for the rules generated by that call only.
+    """
 
     failsafe = None
 
+    # the max recursion of this reference, if it was passed when the reference
+    # was created or set by a subclass, otherwise ``None`` to use the max
+    # recursion of all references
+    _own_max_recursion = None
+
     def __init__(self, refname, **kwargs):
         """Create a new ``Ref`` instance
 
         :param str refname: The name of the rule to reference
         :param str cat: The name of the category the rule is defined in
+        :param int max_recursion: The max recursion of this reference, instead of the
+            max recursion of all references (see :any:`gramfuzz.GramFuzzer.recursion`)
         """
         self.refname = refname
-        self.cat = kwargs.setdefault("cat", self.cat)
-        self.failsafe = kwargs.setdefault("failsafe", self.failsafe)
+        self._set_option("cat", kwargs.setdefault("cat", self.cat))
+        self._set_option("failsafe", kwargs.setdefault("failsafe", self.failsafe))
+        if "max_recursion" in kwargs:
+            self._set_option("_own_max_recursion", kwargs["max_recursion"])
+        else:
+            self._set_option("_own_max_recursion", _class_max_recursion(type(self)))
+        self._set_option("max_recursion", kwargs.setdefault("max_recursion", self.max_recursion))
+
+        self._binding = None
 
-        self.fuzzer = GramFuzzer.instance()
+    def _recursion_limit(self, ctx):
+        """Return the max recursion of this reference in the generation context
+        ``ctx``. References without their own max recursion use the context's
+        ``max_recursion``, if it is set, or the max recursion of all references.
+
+        :param gramfuzz.context.Context ctx: The generation context
+        :returns: The max recursion
+        """
+        limit = self._own_max_recursion
+        if limit is None:
+            limit = ctx.max_recursion
+            if limit is None:
+                limit = Ref.max_recursion
+        return limit
     
     def build(self, pre=None, shortest=False):
         """Build the ``Ref`` instance by fetching the rule from
@@ -846,28 +1242,80 @@ class Ref(Field):
         :param list pre: The prerequisites list
         :param bool shortest: Whether or not the shortest reference-chain (most minimal) version of the field should be generated.
         """
-        global REF_LEVEL
-        REF_LEVEL += 1
+        ctx = context.current()
+        ctx.ref_level += 1
+
+        recursion = ctx.recursion
+        if recursion is None:
+            limited = ctx.ref_level >= self._recursion_limit(ctx)
+        else:
+            limited = recursion.enter(self, ctx.ref_level, self._recursion_limit(ctx))
+
+        budget = ctx.budget
+        if budget is not None and budget.enter():
+            shortest = True
+        length = None
 
         try:
             if pre is None:
                 pre = []
 
-            #print("{:04d} - {} - {}:{}".format(REF_LEVEL, shortest, self.cat, self.refname))
+            #print("{:04d} - {} - {}:{}".format(ctx.ref_level, shortest, self.cat, self.refname))
 
-            definition = self.fuzzer.get_ref(self.cat, self.refname)
+            definition = self._resolve(ctx.staged_defs)
             res = utils.val(
                 definition,
                 pre,
-                shortest=(shortest or REF_LEVEL >= self.max_recursion)
+                shortest=(shortest or limited)
             )
 
+            if budget is not None:
+                length = 0 if res is utils.NOTHING else len(res)
             return res
 
         # this needs to happen no matter what
         finally:
-            REF_LEVEL -= 1
+            ctx.ref_level -= 1
+            if recursion is not None:
+                recursion.exit()
+            if budget is not None:
+                budget.exit(length)
     
+    def _resolve(self, staged_defs=None):
+        """Fetch one of the rule definitions this ``Ref`` refers to from
+        the ``GramFuzzer`` instance.
+
+        :param gramfuzz.context.StagedDefs staged_defs: The rule definitions staged in the current context, if any
+        :returns: gramfuzz.fields.Def
+        """
+        binding = None
+        if staged_defs is not None:
+            binding = staged_defs.bind_ref(self.cat, self.refname)
+        if binding is None:
+            binding = self._binding
+            if binding is None or binding[0] is not GramFuzzer.__instance__ or binding[1] != binding[0]._defs_version:
+                binding = self._bind()
+
+        # both bindings end with the rule definitions and the category's
+        # definitions for "*" references
+        rules = binding[-2]
+        cat_defs = binding[-1]
+        if cat_defs is not None:
+            # "*" references choose the name of the rule first
+            rules = cat_defs[rand.choice(rules)]
+        return rand.choice(rules)
+
+    def _bind(self):
+        """Bind this ``Ref`` to the rule definitions it refers to. Raises a
+        ``GramFuzzError`` if the referenced rule is not defined.
+
+        :returns: The new binding
+        """
+        fuzzer = GramFuzzer.instance()
+        rules, cat_defs = fuzzer.bind_ref(self.cat, self.refname)
+        self._binding = binding = (fuzzer, fuzzer._defs_version, rules, cat_defs)
+        return binding
+
     def __repr__(self):
         return "<{}[{}]>".format(self.__class__.__name__, self.refname)
 
@@ -882,11 +1330,13 @@ class PLUS(Join):
     The values are Anded together one or more times, up to ``max``
     times.
     """
+    __slots__ = ()
+
     sep = b""
 
+    max = 10
+
     def __init__(self, *values, **kwargs):
-        kwargs.setdefault("max", 10)
-        kwargs.setdefault("sep", self.sep)
         value = And(*values)
         super(PLUS, self).__init__(value, **kwargs)
 
@@ -896,6 +1346,8 @@ class STAR(PLUS):
     The values are Anded together zero or more times, up to ``max``
     times.
     """
+    __slots__ = ()
+
     shortest_is_nothing = True
 
     def build(self, pre=None, shortest=False):
@@ -907,9 +1359,15 @@ class STAR(PLUS):
         if pre is None:
             pre = []
 
-        if shortest:
-            raise errors.OptGram
-        elif rand.maybe():
-            return super(STAR, self).build(pre, shortest=shortest)
-        else:
-            raise errors.OptGram
+        if self._skip(shortest):
+            return utils.NOTHING
+
+        return super(STAR, self).build(pre, shortest=shortest)
+
+    def _skip(self, shortest=False):
+        """Randomly decide if this ``STAR`` should be skipped (zero repetitions)
+
+        :param bool shortest: Whether or not the shortest reference-chain (most minimal) version of the field should be generated.
+        :returns: bool
+        """
+        return shortest or not rand.maybe()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+
+"""
+This module generates rules in multiple worker processes. Use
+:any:`gramfuzz.GramFuzzer.gen_parallel` instead of using this module
+directly:
+
+.. code-block:: python
+
+    fuzzer = gramfuzz.GramFuzzer()
+    fuzzer.load_grammar("python27.py")
+    corpus = fuzzer.gen_parallel(cat_group="python27", num=100000, workers=8, seed=1337)
+
+Work is handed out to the workers in chunks of consecutive rule indices. Each
+rule is generated with a seed derived from the base seed and the rule's index,
+and finished chunks are handed back in index order, so the generated values do
+not depend on the number of workers or on how the chunks were scheduled.
+"""
+
+
+from collections import deque
+import multiprocessing
+import six
+
+
+import gramfuzz
+import gramfuzz.context as context
+import gramfuzz.errors as errors
+import gramfuzz.fields as fields
+import gramfuzz.rand as rand
+import gramfuzz.snapshot as snapshot
+
+
+# the maximum number of chunks per worker that may be generated (or waiting
+# to be consumed) at a time
+MAX_PENDING = 4
+
+# the fuzzer used by the current worker process. Set in the parent process
+# before the pool is started so that forked workers inherit it.
+_fuzzer = None
+
+
+def gen_samples(fuzzer, num, workers=None, seed=None, cat=None, preferred=None, preferred_ratio=0.5, max_recursion=None, chunksize=None, budget=None):
+    """Generate ``num`` rules from category ``cat`` of ``fuzzer`` using a pool
+    of ``workers`` processes. See :any:`gramfuzz.GramFuzzer.gen_parallel`.
+
+    :returns: A generator of lists, each containing the prerequisites of a single rule followed by the rule itself
+    """
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if seed is None:
+        seed = rand.randint(2**32)
+    if max_recursion is None:
+        max_recursion = fields.Ref.max_recursion
+    if chunksize is None:
+        chunksize = max(1, min(1000, num // (workers * MAX_PENDING * 4)))
+
+    gen_args = (seed, cat, preferred, preferred_ratio, max_recursion, budget)
+
+    if workers == 1:
+        return _gen_local(fuzzer, num, gen_args)
+    return _gen_pool(fuzzer, num, workers, chunksize, gen_args)
+
+
+def _gen_local(fuzzer, num, gen_args):
+    """Generate all rules in the current process
+    """
+    for sample in _gen_chunk(fuzzer, 0, num, gen_args):
+        yield sample
+
+
+def _gen_pool(fuzzer, num, workers, chunksize, gen_args):
+    """Generate all rules in a pool of worker processes. Chunks are submitted
+    in order, and at most ``workers * MAX_PENDING`` chunks are pending at a time.
+    Chunks that finish early are held until all chunks before them have been
+    handed back.
+    """
+    global _fuzzer
+
+    # make sure forked workers don't need to compile the rules themselves
+    fuzzer._get_builder()
+
+    # workers that are not forked load a snapshot of the rules instead of
+    # loading the grammar files again, when the rules can be snapshotted
+    # (workers are always forked on python 2)
+    rules_snapshot = None
+    if hasattr(multiprocessing, "get_start_method") and multiprocessing.get_start_method() != "fork":
+        try:
+            rules_snapshot = snapshot.dumps(fuzzer)
+        except errors.GramFuzzError:
+            pass
+
+    worker_args = (fuzzer._grammar_paths, rules_snapshot, fuzzer.engine, fuzzer.recursion, fuzzer.compile_cache)
+    _fuzzer = fuzzer
+    try:
+        pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(worker_args,))
+    finally:
+        _fuzzer = None
+
+    finished = False
+    try:
+        pending = deque()
+        next_start = 0
+        while next_start < num or len(pending) > 0:
+            while next_start < num and len(pending) < workers * MAX_PENDING:
+                count = min(chunksize, num - next_start)
+                pending.append(pool.apply_async(_worker_gen_chunk, (next_start, count, gen_args)))
+                next_start += count
+
+            for sample in pending.popleft().get():
+                yield sample
+
+        pool.close()
+        pool.join()
+        finished = True
+    finally:
+        if not finished:
+            pool.terminate()
+
+
+def _init_worker(worker_args):
+    """Initialize a worker process. Workers that were not forked from the
+    parent process load the parent's snapshot of the rules, or the grammar files
+    the parent had loaded if no snapshot could be created.
+    """
+    global _fuzzer
+    if _fuzzer is not None:
+        return
+
+    paths, rules_snapshot, engine, recursion, compile_cache = worker_args
+    _fuzzer = gramfuzz.GramFuzzer(engine=engine, recursion=recursion)
+    _fuzzer.compile_cache = compile_cache
+    if rules_snapshot is not None and snapshot.loads(_fuzzer, rules_snapshot):
+        return
+    for path in paths:
+        _fuzzer.load_grammar(path)
+
+
+def _worker_gen_chunk(start, count, gen_args):
+    return list(_gen_chunk(_fuzzer, start, count, gen_args))
+
+
+def _gen_chunk(fuzzer, start, count, gen_args):
+    """Generate ``count`` rules, starting at rule index ``start``. Each rule
+    is generated in a new generation context seeded from the rule's index, so
+    that no state (``state``, ``ref_level``, etc) is carried over from the rules
+    generated before it, no matter how the rules are split into chunks.
+    """
+    seed, cat, preferred, preferred_ratio, max_recursion, budget = gen_args
+
+    with context.use(context.Context()):
+        fuzzer._gen_setup(cat, None, preferred, True)
+        samples = fuzzer._gen_samples(None, cat, preferred, preferred_ratio, commit=False, max_recursion=max_recursion, budget=budget)
+
+    for idx in six.moves.range(start, start + count):
+        # the generator only uses the current context while generating
+        # a rule, never between yielding one rule and starting the next
+        with context.use(context.Context(seed=rand.sample_seed(seed, idx))):
+            sample = list(next(samples))
+        yield sample
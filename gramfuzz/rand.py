@@ -11,25 +11,76 @@ such as:
 * random floats between a range
 * return ``True`` or ``False`` based on a probability (the ``maybe`` function)
 * return random data
+
+All functions use the random number generator of the current generation context
+(see :any:`gramfuzz.context`). By default this is a ``random.Random`` instance,
+but any object with ``seed``, ``random``, ``randint`` and ``choice`` methods
+can be used, such as :any:`gramfuzz.rand.BufferedRandom`:
+
+.. code-block:: python
+
+    import gramfuzz.context
+    from gramfuzz.rand import BufferedRandom
+
+    with gramfuzz.context.use(gramfuzz.context.Context(rng=BufferedRandom(seed=1337))):
+        values = fuzzer.gen(cat="default", num=1000)
 """
 
 
-import random as r
+import binascii
+import bisect
+import hashlib
+import itertools
+import random as _random_mod
 import six
 
 
-RANDOM = r.Random()
-_randint = RANDOM.randint
-random = _random = RANDOM.random
-choice = _choice = RANDOM.choice
+import gramfuzz.context as context
+
+
+RANDOM = context.DEFAULT_RANDOM
+"""The random number generator of the main thread's default generation
+context. All functions in this module use the random number generator of
+the current thread's generation context (see :any:`gramfuzz.context`).
+"""
+
+_local = context._local
 
 
 def seed(val):
-    """Set the seed for any subsequent random values/choices
+    """Set the seed for any subsequent random values/choices made in
+    the current generation context
 
     :param val: The random seed value
     """
-    RANDOM.seed(val)
+    _local.context.random.seed(val)
+
+
+def random():
+    """Return a random float in the range [0.0, 1.0)
+
+    :returns: float
+    """
+    return _local.context.random.random()
+
+
+def choice(seq):
+    """Return a random element from the non-empty sequence ``seq``
+    """
+    return _local.context.random.choice(seq)
+
+
+def sample_seed(base, index):
+    """Derive the seed of a single sample from a base seed and the sample's
+    index. The same ``base`` and ``index`` always result in the same seed,
+    regardless of the process or Python version it is derived in.
+
+    :param base: The base seed value
+    :param int index: The index of the sample
+    :returns: int
+    """
+    key = "{}:{}".format(base, index).encode("utf-8")
+    return int(hashlib.sha1(key).hexdigest()[:16], 16)
 
 
 def weighted_choice(items, probabilities):
@@ -46,15 +97,95 @@ def weighted_choice(items, probabilities):
         # 30% chance of 2
         # 60% chance of 3
         weighted_choice([1, 2, 3], [0.1, 0.3, 0.6])
+
+    The :any:`gramfuzz.rand.WeightedTable` of ``probabilities`` is cached by
+    the identity of ``probabilities`` if it is a list or tuple, so that
+    choosing from the same probabilities repeatedly does not scan them
+    each time.
+    """
+    if type(probabilities) not in (list, tuple):
+        rand_val = _local.context.random.random()
+
+        total_probability = 0.0
+        for item, prob in zip(items, probabilities):
+            if total_probability <= rand_val < total_probability+prob:
+                return item
+            total_probability += prob
+        raise Exception("Probabilities did not add up to 1.0")
+
+    idx = _weighted_table(probabilities).pick()
+    if idx >= len(items):
+        raise Exception("Probabilities did not add up to 1.0")
+    return items[idx]
+
+
+# WeightedTables of the probabilities passed to weighted_choice(), keyed by
+# the id of the probabilities. Each entry also holds the probabilities and
+# a copy of them, so that a reused id or a list that was changed in place
+# does not use a stale table
+_WEIGHTED_TABLES = {}
+
+# the number of tables that are cached before the cache is cleared
+_WEIGHTED_TABLES_MAX = 256
+
+
+def _weighted_table(probabilities):
+    """Return the (cached) :any:`gramfuzz.rand.WeightedTable` of the list or
+    tuple ``probabilities``
     """
-    rand_val = RANDOM.random()
+    entry = _WEIGHTED_TABLES.get(id(probabilities))
+    if entry is None or entry[0] is not probabilities or entry[1] != probabilities:
+        if len(_WEIGHTED_TABLES) >= _WEIGHTED_TABLES_MAX:
+            _WEIGHTED_TABLES.clear()
+        entry = (probabilities, probabilities[:], WeightedTable(probabilities))
+        _WEIGHTED_TABLES[id(probabilities)] = entry
+    return entry[2]
+
+
+class WeightedTable(object):
+    """A precomputed table of probabilities to randomly choose indices from.
+    Choosing an index takes a single random float and a binary search, no
+    matter how many probabilities there are, and chooses the same index
+    :any:`gramfuzz.rand.weighted_choice` would have chosen with the same
+    random float.
+
+    .. code-block:: python
+
+        table = WeightedTable([0.1, 0.3, 0.6])
+        idx = table.pick()               # 0, 1 or 2
+        item = table.choice([1, 2, 3])
+    """
+
+    def __init__(self, probabilities):
+        """Create a new weighted table.
+
+        :param list probabilities: The probability of each index. The probabilities should add up to 1.0
+        """
+        self.cumulative = []
+        """The running totals of the probabilities"""
+
+        total_probability = 0.0
+        for prob in probabilities:
+            total_probability += prob
+            self.cumulative.append(total_probability)
 
-    total_probability = 0.0
-    for item, prob in zip(items, probabilities):
-        if total_probability <= rand_val < total_probability+prob:
-            return item
-        total_probability += prob
-    raise Exception("Probabilities did not add up to 1.0")
+    def pick(self):
+        """Randomly choose an index, weighted by the probabilities of the table
+
+        :returns: int
+        """
+        idx = bisect.bisect_right(self.cumulative, _local.context.random.random())
+        if idx == len(self.cumulative):
+            raise Exception("Probabilities did not add up to 1.0")
+        return idx
+
+    def choice(self, items):
+        """Randomly choose an item from ``items``, weighted by the probabilities
+        of the table
+
+        :param list items: The items to choose from, one for each probability
+        """
+        return items[self.pick()]
 
 
 def randint(a, b=None):
@@ -68,9 +199,27 @@ def randint(a, b=None):
     """
     # need to minus 1 b/c randint has an inclusive maximum
     if b is None:
-        return _randint(0, a-1)
+        return _local.context.random.randint(0, a-1)
     else:
-        return _randint(a, b-1)
+        return _local.context.random.randint(a, b-1)
+
+
+def randbelow(n):
+    """Return a random integer in the range [0, ``n``). This is the same as
+    ``randint(n)``, but faster.
+
+    :param int n: The maximum value to generate (non-inclusive, must be a positive int)
+    :returns: int
+    """
+    rng = _local.context.random
+    if _FAST_RANDBELOW and type(rng) is _random_mod.Random:
+        # what random.Random.randint() returns after checking its arguments
+        return rng._randbelow(n)
+    return rng.randint(0, n-1)
+
+
+# random.Random.randint() returns _randbelow() on Python 3
+_FAST_RANDBELOW = six.PY3
 
 
 def randfloat(a, b=None):
@@ -90,7 +239,7 @@ def randfloat(a, b=None):
         max_ = b
 
     diff = max_ - min_
-    res = _random()
+    res = _local.context.random.random()
     res *= diff
     res += min_
     return res
@@ -102,7 +251,7 @@ def maybe(prob=0.5):
     :param float prob: The probability ``True`` will be returned
     :returns: bool
     """
-    return _random() < prob
+    return _local.context.random.random() < prob
 
 
 def _binchoice(iterable):
@@ -119,4 +268,255 @@ def data(length, charset):
     :param str charset: The charset of characters to choose from
     :returns: str
     """
+    rng = _local.context.random
+    if type(charset) is bytes and 0 < len(charset) < 0x200 and length > 0:
+        if _FAST_DATA and type(rng) is _random_mod.Random:
+            return _data_words(rng, length, charset)
+        if type(rng) is BufferedRandom:
+            return rng._data(length, charset)
     return b"".join(_binchoice(charset) for x in six.moves.range(length))
+
+
+# random.Random.randint() draws each index with getrandbits() on Python 3,
+# which _data_words() relies on
+_FAST_DATA = six.PY3
+
+# per-charset lookup tables used by _data_words(), keyed by charset
+_DATA_TABLES = {}
+
+# maps the high byte of a 9-bit index to a byte mask
+_HIGH_MASK = b"\x00\xff" + b"\x00" * 0xfe
+
+
+def _data_tables(charset):
+    """Return the ``bytes.translate`` tables used by :any:`gramfuzz.rand._data_words`
+    for ``charset``:
+
+    * the table that maps indices below ``0x100`` to the charset's characters
+    * the indices below ``0x100`` that are not within the charset
+    * the table that maps the low byte of indices ``0x100`` and above to the
+      charset's characters, or to the marker byte if the index is not within
+      the charset
+    * the marker byte, a byte that is not in the charset (``None`` if every
+      byte is in the charset)
+    """
+    tables = _DATA_TABLES.get(charset)
+    if tables is None:
+        n = len(charset)
+        unused = set(six.moves.range(0x100)) - set(bytearray(charset))
+        marker = six.int2byte(min(unused)) if unused else None
+        padded = charset + (marker or b"\x00") * (0x200 - n)
+        tables = _DATA_TABLES[charset] = (
+            padded[:0x100],
+            bytes(bytearray(six.moves.range(min(n, 0x100), 0x100))),
+            padded[0x100:],
+            marker,
+        )
+    return tables
+
+
+def _data_words(rng, length, charset):
+    """Generate ``length`` random characters from ``charset`` (at most ``0x1ff``
+    characters long) using 32-bit words drawn from the ``random.Random`` ``rng``
+    without any Python-level work per character.
+
+    The result is identical to choosing each character with
+    ``random.Random.randint``, and ``rng`` is left in the same state:
+    ``randint(0, n-1)`` draws a 32-bit word with ``getrandbits`` and keeps its
+    top ``k`` bits (``k = n.bit_length()``), drawing another word if the index
+    is not below ``n``. Here the words for all remaining characters are drawn
+    with a single ``getrandbits`` call, and their indices are extracted,
+    filtered and mapped to characters at once with integer and ``bytes``
+    operations. Only as many words as there are characters left are drawn at
+    a time, so that no more words are drawn than ``randint`` would have drawn.
+    """
+    n = len(charset)
+    k = n.bit_length()
+    chars_lo, rejected_lo, chars_hi, marker = _data_tables(charset)
+    slot = _int_to_bytes((1 << k) - 1, 4)
+
+    res = []
+    need = length
+    while need > 0:
+        mask = _int_from_bytes(slot * need)
+        idx = _int_to_bytes((rng.getrandbits(32 * need) >> (32 - k)) & mask, 4 * need)
+        low = idx[0::4]
+
+        if k <= 8:
+            chars = low.translate(chars_lo, rejected_lo)
+        else:
+            # every index below 0x100 is within the charset. Indices 0x100
+            # and above are mapped with the high table, chosen with the high
+            # byte of each index
+            high = _int_from_bytes(idx[1::4].translate(_HIGH_MASK))
+            chars = _merge(low.translate(chars_lo), low.translate(chars_hi), high, need)
+            if marker is not None:
+                chars = chars.translate(None, marker)
+            else:
+                accepted = _merge(b"\x01" * need, low.translate(_accept_hi(n)), high, need)
+                chars = bytes(bytearray(itertools.compress(bytearray(chars), bytearray(accepted))))
+
+        res.append(chars)
+        need -= len(chars)
+
+    return b"".join(res)
+
+
+def _accept_hi(n):
+    """Map the low byte of indices ``0x100`` and above to ``1`` if the index is
+    below ``n``
+    """
+    return b"\x01" * (n - 0x100) + b"\x00" * (0x200 - n)
+
+
+def _merge(lo, hi, mask, count):
+    """Merge the bytes ``lo`` and ``hi``, using the bytes of ``hi`` wherever
+    the bytes of the integer ``mask`` are ``0xff``
+    """
+    lo = _int_from_bytes(lo)
+    hi = _int_from_bytes(hi)
+    return _int_to_bytes((lo & ~mask) | (hi & mask), count)
+
+
+if six.PY3:
+    def _int_from_bytes(data):
+        return int.from_bytes(data, "little")
+
+    def _int_to_bytes(val, length):
+        return val.to_bytes(length, "little")
+else:
+    def _int_from_bytes(data):
+        return int(binascii.hexlify(data[::-1]) or b"0", 16)
+
+    def _int_to_bytes(val, length):
+        return binascii.unhexlify(b"%0*x" % (2 * length, val))[::-1]
+
+
+# bounded integers in ranges up to this size are derived from a single float
+_FLOAT_RANGE = 2**32
+
+
+class BufferedRandom(_random_mod.Random):
+    """A ``random.Random`` that derives bounded integers and choices from a
+    single random float each. ``random.Random``'s ``randint`` and ``choice``
+    methods make several Python-level calls for every value, while ``random()``
+    is a single C-level call. See ``examples/rand_benchmark.py``.
+
+    Two backends are available to draw the floats:
+
+    * ``"python"`` - the inherited ``random.Random.random``. Buffering floats
+      from Python would only make each float slower than this C-level call.
+    * ``"numpy"`` - a NumPy ``Generator`` seeded with ``seed`` draws
+      ``block_size`` floats at a time, which are served one at a time without
+      any Python-level calls (requires NumPy to be installed). Serving a
+      buffered float is slower than ``random.Random.random``, but strings of
+      64 or more characters are generated with a single NumPy call, which
+      is several times faster for grammars that generate long strings.
+
+    Results are seed-stable: a ``BufferedRandom`` that is created with (or
+    reseeded with) the same seed, backend and block size always generates the
+    same data. It is not the data ``random.Random`` generates for the same seed,
+    so switching between ``random.Random`` and ``BufferedRandom`` changes the
+    generated data. Data of the ``"numpy"`` backend is only reproducible with
+    the same version of NumPy.
+
+    Integers in ranges of up to ``2**32`` values are derived from a single
+    53-bit float, which biases them by less than ``2**-21``.
+    """
+
+    backends = ["python", "numpy"]
+    """The available backends"""
+
+    def __new__(cls, seed=None, *args, **kwargs):
+        # random.Random's constructor only accepts the seed on Python 2 and
+        # Python 3 before 3.11
+        return super(BufferedRandom, cls).__new__(cls, seed)
+
+    def __init__(self, seed=None, backend="python", block_size=4096):
+        """Create a new buffered random number generator.
+
+        :param seed: The seed value (default=``None``, randomly seeded)
+        :param str backend: The backend to draw random floats with, one of :any:`gramfuzz.rand.BufferedRandom.backends`
+        :param int block_size: The number of floats the ``"numpy"`` backend draws at a time
+        """
+        if backend not in self.backends:
+            raise ValueError("Unknown random backend {!r}, expected one of {!r}".format(
+                backend, self.backends
+            ))
+        self.backend = backend
+        self.block_size = block_size
+        super(BufferedRandom, self).__init__(seed)
+
+    def seed(self, val=None, *args, **kwargs):
+        """Reseed the generator. Any buffered floats are discarded.
+
+        :param val: The seed value (default=``None``, randomly seeded)
+        """
+        super(BufferedRandom, self).seed(val, *args, **kwargs)
+        if self.backend == "numpy":
+            import numpy
+            if val is not None and not isinstance(val, six.integer_types):
+                val = sample_seed(val, 0)
+            elif val is not None:
+                val = abs(val)
+            self._gen = numpy.random.default_rng(val)
+            self.random = itertools.chain.from_iterable(self._blocks()).__next__
+
+    def _blocks(self):
+        """Yield blocks of ``block_size`` random floats drawn with NumPy
+        """
+        gen_random = self._gen.random
+        block_size = self.block_size
+        while True:
+            yield gen_random(block_size).tolist()
+
+    def randint(self, a, b):
+        """Return a random integer ``N`` such that ``a <= N <= b``
+
+        :returns: int
+        """
+        n = b - a + 1
+        if 0 < n <= _FLOAT_RANGE:
+            return a + int(self.random() * n)
+        return a + self._randbelow(n)
+
+    def choice(self, seq):
+        """Return a random element from the non-empty sequence ``seq``
+        """
+        n = len(seq)
+        if n <= _FLOAT_RANGE:
+            return seq[int(self.random() * n)]
+        return seq[self._randbelow(n)]
+
+    def _randbelow(self, n):
+        """Return a random integer in the range [0, ``n``) for ranges that are
+        too large to derive from a single float. The integer is built from
+        32 bits of several floats, and rejected if it is not below ``n``.
+        """
+        if n <= 0:
+            raise ValueError("empty range")
+        bits = n.bit_length()
+        chunks = (bits + 31) // 32
+        while True:
+            res = 0
+            for x in six.moves.range(chunks):
+                res = (res << 32) | int(self.random() * _FLOAT_RANGE)
+            res >>= (chunks * 32) - bits
+            if res < n:
+                return res
+
+    def _data(self, length, charset):
+        """Generate ``length`` random characters from the bytes ``charset``
+        (at most ``0x1ff`` characters long)
+        """
+        if self.backend == "numpy" and length >= _NUMPY_DATA_LENGTH:
+            import numpy
+            idx = self._gen.integers(0, len(charset), size=length)
+            return numpy.frombuffer(charset, dtype=numpy.uint8)[idx].tobytes()
+        # the inherited random.Random is seeded with the same seed
+        return _data_words(self, length, charset)
+
+
+# strings at least this long are generated with a single NumPy call by the
+# "numpy" backend of BufferedRandom, which is slower for shorter strings
+_NUMPY_DATA_LENGTH = 64
@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+
+"""
+This module saves the rules loaded into a :any:`gramfuzz.GramFuzzer` to a
+snapshot, and loads them back. Use :any:`gramfuzz.GramFuzzer.save_snapshot` and
+:any:`gramfuzz.GramFuzzer.load_snapshot` instead of using this module directly:
+
+.. code-block:: python
+
+    fuzzer = gramfuzz.GramFuzzer()
+    if not fuzzer.load_snapshot("python27.snapshot"):
+        fuzzer.load_grammar("python27.py")
+        fuzzer.preprocess_rules()
+        fuzzer.save_snapshot("python27.snapshot")
+
+A snapshot holds the rule definitions, category groups, ``no_prune`` rules and
+the preprocessed shortest reference-paths of a fuzzer. Loading a snapshot does
+not execute the grammar files, so none of the rules need to be defined or
+preprocessed again.
+
+Classes and functions that were defined in grammar files (or anywhere else they
+cannot be imported from by name, such as ``__main__``) are saved by value,
+together with the global variables of the grammar file they were defined in.
+Everything else is saved by reference, the same as with ``pickle``. Modules that
+grammar files import from their own directory are saved by value as well.
+
+Snapshots store a hash of every grammar file they were created from. Loading a
+snapshot fails if any of the grammar files changed since the snapshot was saved,
+or if the snapshot was saved with a different version of Python or gramfuzz.
+
+Snapshots are pickles, so only load snapshots you created yourself. Snapshots
+require Python 3.8+.
+"""
+
+
+import hashlib
+import importlib
+import io
+import marshal
+import os
+import pickle
+import sys
+import tempfile
+import types
+from six.moves import builtins
+
+
+import gramfuzz
+import gramfuzz.errors as errors
+import gramfuzz.fields as fields
+import gramfuzz.utils as utils
+
+
+# incremented whenever the format of snapshots changes
+FORMAT = 6
+
+# the attributes of a GramFuzzer that are saved in snapshots
+STATE_ATTRS = (
+    "defs",
+    "no_prunes",
+    "cat_groups",
+    "cat_group_defaults",
+    "unbound_refs",
+    "_defs_version",
+    "_rules_processed",
+    "_grammar_paths",
+    "_ref_lengths",
+    "_ref_rules",
+    "_ref_dependents",
+    "_ref_states",
+    "_rule_costs",
+    "_budget_costs",
+    "_new_defs",
+)
+
+_MAGIC = "gramfuzz-snapshot"
+
+
+def save(fuzzer, path):
+    """Save a snapshot of the rules of ``fuzzer`` to ``path``. The file
+    is written atomically.
+
+    :param gramfuzz.GramFuzzer fuzzer: The fuzzer to snapshot
+    :param str path: The path of the snapshot file
+    """
+    data = dumps(fuzzer)
+    path = os.path.abspath(path)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.rename(tmp_path, path)
+
+
+def load(fuzzer, path):
+    """Load the snapshot at ``path`` into ``fuzzer``
+
+    :param gramfuzz.GramFuzzer fuzzer: The fuzzer to load the rules into
+    :param str path: The path of the snapshot file
+    :returns: Whether the snapshot was loaded, ``False`` if it does not exist or is out of date
+    """
+    if not os.path.exists(path):
+        return False
+    with open(path, "rb") as f:
+        return loads(fuzzer, f.read())
+
+
+def dumps(fuzzer):
+    """Create a snapshot of the rules of ``fuzzer``
+
+    :param gramfuzz.GramFuzzer fuzzer: The fuzzer to snapshot
+    :returns: The snapshot as bytes
+    """
+    _check_supported()
+
+    payload = io.BytesIO()
+    pickler = _Pickler(payload, fuzzer)
+    try:
+        pickler.dump(dict((attr, getattr(fuzzer, attr)) for attr in STATE_ATTRS))
+    except (pickle.PicklingError, TypeError, AttributeError, ValueError) as e:
+        raise errors.GramFuzzError("could not create a snapshot of the rules: {}".format(e))
+
+    paths = list(fuzzer._grammar_paths) + sorted(pickler.module_paths)
+    header = (_MAGIC, FORMAT, _version_key(), [(path, _hash_file(path)) for path in paths])
+    return pickle.dumps(header, protocol=pickle.HIGHEST_PROTOCOL) + payload.getvalue()
+
+
+def loads(fuzzer, data):
+    """Load a snapshot created with :any:`gramfuzz.snapshot.dumps` into ``fuzzer``,
+    replacing its rules.
+
+    :param gramfuzz.GramFuzzer fuzzer: The fuzzer to load the rules into
+    :param bytes data: The snapshot
+    :returns: Whether the snapshot was loaded, ``False`` if it is out of date
+    """
+    _check_supported()
+
+    f = io.BytesIO(data)
+    header = pickle.load(f)
+    if not isinstance(header, tuple) or len(header) != 4 or header[0] != _MAGIC:
+        raise errors.GramFuzzError("not a gramfuzz snapshot")
+
+    magic, format_, version_key, sources = header
+    if format_ != FORMAT or version_key != _version_key():
+        return False
+    for path, digest in sources:
+        if not os.path.exists(path) or _hash_file(path) != digest:
+            return False
+
+    state = _Unpickler(f, fuzzer).load()
+    for attr in STATE_ATTRS:
+        setattr(fuzzer, attr, state[attr])
+    fuzzer._compiled = None
+    fuzzer._recursion_rules = None
+
+    # let grammar code import modules from the grammars' directories, the
+    # same as after load_grammar
+    for path in fuzzer._grammar_paths:
+        grammar_path = os.path.dirname(path)
+        if grammar_path not in sys.path:
+            sys.path.append(grammar_path)
+
+    return True
+
+
+def _check_supported():
+    if sys.version_info < (3, 8):
+        raise errors.GramFuzzError("snapshots require Python 3.8+")
+
+
+def _version_key():
+    """Return the versions a snapshot depends on: marshalled code only works
+    with the same Python version, and pickled fields with the same gramfuzz version
+    """
+    return (sys.implementation.cache_tag, gramfuzz.__version__)
+
+
+def _hash_file(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _global_names(code, names=None):
+    """Return the names of all global variables ``code`` (and any code nested in it)
+    may use
+    """
+    if names is None:
+        names = set()
+    names.update(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _global_names(const, names)
+    return names
+
+
+# ---------------------------------------------
+# functions used to recreate objects saved by value
+# ---------------------------------------------
+
+
+def _new_class(meta, name, bases, class_dict):
+    return meta(name, bases, class_dict)
+
+
+def _new_function(code, globals_, name, closure):
+    return types.FunctionType(marshal.loads(code), globals_, name, None, closure)
+
+
+def _new_cell():
+    return types.CellType()
+
+
+def _new_module(name):
+    return types.ModuleType(name)
+
+
+def _module_globals(module):
+    return module.__dict__
+
+
+def _nothing():
+    return utils.NOTHING
+
+
+class _ModuleGlobals(object):
+    """Stands in for the global variables of a grammar module saved by value,
+    so that its functions use the global variables of the recreated module
+    """
+
+    def __init__(self, module):
+        self.module = module
+
+    def __reduce__(self):
+        return _module_globals, (self.module,)
+
+
+class _Pickler(pickle.Pickler):
+    def __init__(self, file, fuzzer):
+        pickle.Pickler.__init__(self, file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.protocol = pickle.HIGHEST_PROTOCOL
+        self.fuzzer = fuzzer
+        self.grammar_dirs = set(os.path.dirname(path) for path in fuzzer._grammar_paths)
+
+        # the files of the modules that were saved by value
+        self.module_paths = set()
+
+    def persistent_id(self, obj):
+        if obj is self.fuzzer:
+            return "fuzzer"
+        if obj is builtins.__dict__:
+            return "builtins"
+        return None
+
+    def reducer_override(self, obj):
+        if isinstance(obj, fields.Ref):
+            return self._reduce_ref(obj)
+        if isinstance(obj, type):
+            if not self._by_reference(obj):
+                return self._reduce_class(obj)
+        elif isinstance(obj, types.FunctionType):
+            if not self._by_reference(obj):
+                return self._reduce_function(obj)
+        elif isinstance(obj, types.ModuleType):
+            return self._reduce_module(obj)
+        elif isinstance(obj, types.CellType):
+            return self._reduce_cell(obj)
+        elif isinstance(obj, (classmethod, staticmethod)):
+            return type(obj), (obj.__func__,)
+        elif isinstance(obj, property):
+            return property, (obj.fget, obj.fset, obj.fdel, obj.__doc__)
+        elif obj is utils.NOTHING:
+            return _nothing, ()
+        return NotImplemented
+
+    def _is_grammar_module(self, module):
+        path = getattr(module, "__file__", None)
+        return path is not None and os.path.dirname(os.path.abspath(path)) in self.grammar_dirs
+
+    def _by_reference(self, obj):
+        """Return whether ``obj`` (a class or function) can be imported by
+        name when the snapshot is loaded
+        """
+        module = sys.modules.get(getattr(obj, "__module__", None), None)
+        if module is None or module.__name__ == "__main__" or self._is_grammar_module(module):
+            return False
+
+        found = module
+        for name in obj.__qualname__.split("."):
+            found = getattr(found, name, None)
+        return found is obj
+
+    def _reduce_ref(self, ref):
+        # references bind to their rules again when they are first used
+        func, args, state = ref.__reduce_ex__(self.protocol)[:3]
+        if isinstance(state, tuple) and state[1] is not None and "_binding" in state[1]:
+            slot_state = dict(state[1])
+            slot_state["_binding"] = None
+            state = (state[0], slot_state)
+        return func, args, state
+
+    def _reduce_class(self, cls):
+        slots = cls.__dict__.get("__slots__", None)
+        if isinstance(slots, str):
+            slots = (slots,)
+
+        class_dict = {"__module__": cls.__module__, "__qualname__": cls.__qualname__}
+        if slots is not None:
+            class_dict["__slots__"] = slots
+
+        # everything else is set once the class exists, since class attributes
+        # may refer to the class itself
+        attrs = {}
+        for name, value in cls.__dict__.items():
+            if name in ("__dict__", "__weakref__") or name in class_dict:
+                continue
+            if slots is not None and name in slots:
+                continue
+            attrs[name] = value
+
+        return _new_class, (type(cls), cls.__name__, cls.__bases__, class_dict), (None, attrs)
+
+    def _reduce_function(self, func):
+        globals_ = func.__globals__
+        module = sys.modules.get(globals_.get("__name__", None), None)
+        if module is not None and module.__dict__ is globals_ and self._is_grammar_module(module):
+            globals_ = _ModuleGlobals(module)
+        elif globals_.get("GRAMFUZZER", None) is not self.fuzzer:
+            # only save the global variables the function uses from modules
+            # that are not grammars
+            names = _global_names(func.__code__)
+            globals_ = dict((name, value) for name, value in globals_.items() if name in names)
+            globals_["__builtins__"] = builtins.__dict__
+        # else the function was defined in a grammar file loaded with
+        # load_grammar, and all of the grammar's global variables are saved
+
+        attrs = {
+            "__defaults__": func.__defaults__,
+            "__kwdefaults__": func.__kwdefaults__,
+            "__qualname__": func.__qualname__,
+            "__module__": func.__module__,
+            "__doc__": func.__doc__,
+            "__dict__": func.__dict__,
+        }
+        args = (marshal.dumps(func.__code__), globals_, func.__name__, func.__closure__)
+        return _new_function, args, (None, attrs)
+
+    def _reduce_module(self, module):
+        if not self._is_grammar_module(module):
+            return importlib.import_module, (module.__name__,)
+
+        self.module_paths.add(os.path.abspath(module.__file__))
+        attrs = dict(module.__dict__)
+        for name in ("__builtins__", "__loader__", "__spec__"):
+            attrs.pop(name, None)
+        return _new_module, (module.__name__,), (None, attrs)
+
+    def _reduce_cell(self, cell):
+        try:
+            contents = cell.cell_contents
+        except ValueError:
+            return _new_cell, ()
+        return _new_cell, (), (None, {"cell_contents": contents})
+
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, file, fuzzer):
+        pickle.Unpickler.__init__(self, file)
+        self.fuzzer = fuzzer
+
+    def persistent_load(self, pid):
+        if pid == "fuzzer":
+            return self.fuzzer
+        if pid == "builtins":
+            return builtins.__dict__
+        raise pickle.UnpicklingError("unknown persistent id {!r}".format(pid))
@@ -7,6 +7,7 @@ Gramfuzz utility functions
 """
 
 
+import ast
 import six
 import sys
 
@@ -14,25 +15,82 @@ import sys
 import gramfuzz
 
 
+class _Nothing(object):
+    """The type of the :any:`gramfuzz.utils.NOTHING` sentinel
+    """
+
+    def __repr__(self):
+        return "NOTHING"
+
+    def __bool__(self):
+        return False
+    __nonzero__ = __bool__
+
+
+NOTHING = _Nothing()
+"""Returned by a field's ``build()`` method when the field built to nothing
+and should be skipped by its parent (e.g. an ``Opt`` that was not chosen, or
+a ``STAR`` with zero repetitions). Container fields check for ``NOTHING``
+instead of catching a :any:`gramfuzz.errors.OptGram` exception, which is much
+cheaper than raising one. Raising ``OptGram`` is still supported for custom
+fields.
+"""
+
+
+# kinds of values handled by val()
+_VAL_BYTES = 0
+_VAL_FIELD = 1
+_VAL_FIELD_CLASS = 2
+_VAL_OTHER = 3
+
+# the kind of value of each type val() has been called with
+_val_kinds = {six.binary_type: _VAL_BYTES}
+
+
+def _val_kind(cls):
+    """Return the kind of values of type ``cls``
+    """
+    fields = gramfuzz.fields
+    if cls is fields.MetaField:
+        kind = _VAL_FIELD_CLASS
+    elif issubclass(cls, fields.Field):
+        kind = _VAL_FIELD
+    else:
+        kind = _VAL_OTHER
+    _val_kinds[cls] = kind
+    return kind
+
+
 def val(val, pre=None, shortest=False):
     """Build the provided value, while properly handling
     native Python types, :any:`gramfuzz.fields.Field` instances, and :any:`gramfuzz.fields.Field`
     subclasses.
 
+    Values are dispatched on their type. Fields normalize their values when
+    they are created (see :any:`gramfuzz.utils.normalize`), so most values are
+    either ``bytes`` or ``Field`` instances and need no conversion.
+
     :param list pre: The prerequisites list
-    :returns: str
+    :returns: bytes, or :any:`gramfuzz.utils.NOTHING` if the value should be skipped
     """
     if pre is None:
         pre = []
 
-    fields = gramfuzz.fields
-    MF = fields.MetaField
-    F = fields.Field
-    if type(val) is MF:
-        val = val()
+    kind = _val_kinds.get(type(val), None)
+    if kind is None:
+        kind = _val_kind(type(val))
+
+    if kind == _VAL_BYTES:
+        return val
 
-    if isinstance(val, F):
+    if kind == _VAL_FIELD_CLASS:
+        val = val.shared()
+        kind = _VAL_FIELD
+
+    if kind == _VAL_FIELD:
         val = val.build(pre, shortest=shortest)
+        if type(val) is six.binary_type or val is NOTHING:
+            return val
 
     # for ints, floats, etc
     if not isinstance(val, six.string_types) \
@@ -42,12 +100,37 @@ def val(val, pre=None, shortest=False):
     return binstr(val)
 
 
+def normalize(val):
+    """Convert a value of a field to the form it is built from. Called for
+    each value when a field is created, so that :any:`gramfuzz.utils.val`
+    does not need to convert the value every time it is built:
+
+    * ``Field`` classes are replaced by their shared instance (see :any:`gramfuzz.fields.MetaField.shared`)
+    * strings, ints and floats are encoded as ``bytes``
+
+    Other values are returned unchanged.
+    """
+    if type(val) is gramfuzz.fields.MetaField:
+        return val.shared()
+    if isinstance(val, six.string_types):
+        return binstr(val)
+    if type(val) in _NUMBER_TYPES:
+        return binstr(str(val))
+    return val
+
+
+# types of values that are always built the same way
+_NUMBER_TYPES = six.integer_types + (float,)
+
+
 def binstr(val):
     """Ensure that ``val`` is of type ``bytes``
     """
     if isinstance(val, six.binary_type):
         return val
     if sys.version_info < (3, 0):
+        if isinstance(val, six.text_type):
+            return val.encode('utf8')
         return bytes(val)
     else:
         return bytes(val, 'utf8')
@@ -67,3 +150,92 @@ def file_open(path, mode):
     if six.PY3:
         kwargs["encoding"] = "utf-8"
     return open(path, mode, **kwargs)
+
+
+def _str_literal(node):
+    """Return the value of ``node`` if it is a string literal, else ``None``
+    """
+    if type(node).__name__ == "Str":
+        return node.s
+    if type(node).__name__ == "Constant" and isinstance(node.value, six.string_types):
+        return node.value
+    return None
+
+
+def _call_name(node):
+    func = node.func
+    if isinstance(func, ast.Attribute):
+        return func.attr
+    if isinstance(func, ast.Name):
+        return func.id
+    return None
+
+
+def grammar_categories(source, filename="<grammar>"):
+    """Find the categories that the grammar file source ``source`` defines
+    rules in without executing it, by looking for ``cat`` class attributes,
+    ``cat`` keyword arguments of calls to ``Def`` (and its subclasses) and
+    ``add_definition``, and the ``TOP_CAT`` variable.
+
+    :param str source: The source of the grammar file
+    :param str filename: The name of the grammar file, used in syntax errors
+    :returns: A tuple of the ``TOP_CAT`` of the grammar (or ``None``), and a set of
+        the categories, or ``None`` if not all categories could be determined
+    """
+    tree = ast.parse(source, filename)
+
+    top_cat = None
+    cats = set()
+    known = True
+    cat_classes = set()
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Assign):
+            for target in node.targets:
+                if isinstance(target, ast.Name) and target.id == "TOP_CAT":
+                    top_cat = _str_literal(node.value)
+
+        elif isinstance(node, ast.ClassDef):
+            for stmt in node.body:
+                if not isinstance(stmt, ast.Assign):
+                    continue
+                if not any(isinstance(t, ast.Name) and t.id == "cat" for t in stmt.targets):
+                    continue
+                cat = _str_literal(stmt.value)
+                if cat is None:
+                    known = False
+                else:
+                    cats.add(cat)
+                    cat_classes.add(node.name)
+
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call):
+            continue
+        name = _call_name(node)
+        if name is None:
+            continue
+
+        if name == "add_definition":
+            cat = _str_literal(node.args[0]) if len(node.args) > 0 else None
+        elif name.endswith("Def"):
+            cat_kwargs = [kw.value for kw in node.keywords if kw.arg == "cat"]
+            if len(cat_kwargs) > 0:
+                cat = _str_literal(cat_kwargs[0])
+            elif name == "Def":
+                cat = "default"
+            elif name in cat_classes:
+                continue
+            else:
+                cat = None
+        else:
+            continue
+
+        if cat is None:
+            known = False
+        else:
+            cats.add(cat)
+
+    if top_cat is not None:
+        cats.add(top_cat)
+
+    return top_cat, (cats if known else None)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+
+import os
+import six
+import sys
+import unittest
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+import gramfuzz
+import gramfuzz.context as context
+import gramfuzz.errors as errors
+from gramfuzz.fields import *
+
+
+if six.PY3:
+    import asyncio
+
+
+class Counter(Field):
+    """Counts how many times it has been built
+    """
+    count = 0
+
+    def build(self, pre=None, shortest=False):
+        Counter.count += 1
+        return b"c"
+
+
+@unittest.skipIf(six.PY2, "asyncio is not available")
+class TestAio(unittest.TestCase):
+    def setUp(self):
+        gramfuzz.GramFuzzer.__instance__ = None
+        self.fuzzer = gramfuzz.GramFuzzer()
+        self.loop = asyncio.new_event_loop()
+        Counter.count = 0
+
+        Def("item", Or(UInt, Q(String), And("[", Ref("item"), Opt(",", Ref("item")), "]")))
+        Def("counted", Counter, cat="counted")
+
+    def tearDown(self):
+        self.loop.close()
+
+    def _collect(self, it, limit=None):
+        res = []
+        while limit is None or len(res) < limit:
+            try:
+                res.append(self.loop.run_until_complete(it.__anext__()))
+            except StopAsyncIteration:
+                break
+        return res
+
+    def test_same_values_as_gen_iter(self):
+        for engine in gramfuzz.GramFuzzer.engines:
+            self.fuzzer.set_engine(engine)
+            with context.use(context.Context(seed=1337)):
+                expected = list(self.fuzzer.gen_iter(cat="default", num=250, max_recursion=8))
+
+            res = self._collect(self.fuzzer.agen(cat="default", num=250, max_recursion=8, seed=1337, chunksize=7))
+            self.assertEqual(res, expected, engine)
+
+    def test_forever(self):
+        res = self._collect(self.fuzzer.agen(cat="counted", chunksize=10), limit=1000)
+        self.assertEqual(res, [b"c"] * 1000)
+
+    def test_backpressure(self):
+        it = self.fuzzer.agen(cat="counted", chunksize=10, max_pending=2)
+        self._collect(it, limit=1)
+
+        # let the producer fill the queue
+        self.loop.run_until_complete(asyncio.sleep(0.2))
+
+        # at most max_pending chunks in the queue, one being consumed, and
+        # one waiting to be added to the queue
+        self.assertLessEqual(Counter.count, 10 * 4)
+        self.loop.run_until_complete(it.aclose())
+
+    def test_cancellation(self):
+        it = self.fuzzer.agen(cat="counted", chunksize=10)
+        self._collect(it, limit=5)
+        self.loop.run_until_complete(it.aclose())
+
+        # no more rules are generated once the iterator has been closed
+        self.loop.run_until_complete(asyncio.sleep(0.1))
+        count = Counter.count
+        self.loop.run_until_complete(asyncio.sleep(0.1))
+        self.assertEqual(Counter.count, count)
+
+    def test_errors_are_raised(self):
+        class Broken(Field):
+            def build(self, pre=None, shortest=False):
+                raise errors.GramFuzzError("broken")
+        Def("broken", Broken, cat="broken")
+
+        it = self.fuzzer.agen(cat="broken", num=10)
+        with self.assertRaises(errors.GramFuzzError):
+            self._collect(it)
+
+
+if __name__ == "__main__":
+    unittest.main()
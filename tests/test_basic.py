@@ -15,6 +15,7 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 
 import gramfuzz
 from gramfuzz.fields import *
+import gramfuzz.rand as rand
 import gramfuzz.utils as gutils
 
 
@@ -146,7 +147,55 @@ class TestFields(unittest.TestCase):
                 LOOP_NUM,
                 percent_off
             ))
-    
+
+    def test_odds_reassigned(self):
+        """Test that new odds are used after they are assigned to a field
+        """
+        i = UInt(odds=[(1.0, 5)])
+        self.assertEqual(i._odds_val(), 5)
+        i.odds = [(1.0, 7)]
+        self.assertEqual(i._odds_val(), 7)
+
+        # odds set on one instance don't change the odds of other instances
+        UInt()._odds_val()
+        self.assertIsNot(UInt._odds_cache, i._odds_cache)
+        self.assertEqual(i._odds_val(), 7)
+
+    def test_odds_matches_walk(self):
+        """Test that the compiled odds choose the same values as walking
+        the odds list
+        """
+        def walk(odds):
+            rand_val = rand.random()
+            total = 0
+            for percent,v in odds:
+                if total <= rand_val < total+percent:
+                    break
+                total += percent
+            if not isinstance(v, (tuple,list)):
+                return v
+            if len(v) == 1:
+                return v[0]
+            rand_func = rand.randfloat if type(v[0]) is float else rand.randint
+            return rand_func(v[0], v[1])
+
+        odds = [
+            (0.3, [1]),
+            (0.0, [100, 200]),
+            (0.3, 5),
+            (0.2, [1.5, 2.5]),
+            (0.1, [2**70, 2**71]),
+            (0.05, [-10, -5]),
+            (0.04, [3, 4.0]),
+        ]
+        for field in [Int(), UInt(), Float(), UFloat(), UInt(odds=odds)]:
+            rand.seed(1337)
+            res = [field._odds_val() for x in six.moves.range(2000)]
+            rand.seed(1337)
+            expected = [walk(field.odds) for x in six.moves.range(2000)]
+            self.assertEqual(res, expected)
+            self.assertEqual([type(x) for x in res], [type(x) for x in expected])
+
     @loop
     def test_float(self):
         f = Float
@@ -365,7 +414,21 @@ class TestFields(unittest.TestCase):
 
         for x in range(100):
             self.assertEqual(wor.build(shortest=True), b"SIMPLE")
-    
+
+    def test_weighted_or_shortest_indices_change(self):
+        """Make sure that WeightedOr uses the current shortest values after
+        they are changed.
+        """
+        wor = WOr(("a", 0.2), ("b", 0.3), ("c", 0.5))
+
+        wor.shortest_vals = [b"a"]
+        wor.shortest_indices = [0]
+        self.assertEqual(set(wor.build(shortest=True) for x in range(100)), set([b"a"]))
+
+        wor.shortest_vals = [b"b", b"c"]
+        wor.shortest_indices = [1, 2]
+        self.assertEqual(set(wor.build(shortest=True) for x in range(100)), set([b"b", b"c"]))
+
     def test_opt(self):
         hello_count = 0
         data = Join(UInt, Opt("hello"), sep="|")
@@ -383,6 +446,26 @@ class TestFields(unittest.TestCase):
             diff
         ))
     
+    def test_opt_returns_nothing(self):
+        self.assertIs(Opt("hello", prob=1.0).build(), gutils.NOTHING)
+        self.assertIs(Opt("hello").build(shortest=True), gutils.NOTHING)
+        self.assertIs(STAR("hello").build(shortest=True), gutils.NOTHING)
+        self.assertIs(gutils.val(Opt("hello", prob=1.0)), gutils.NOTHING)
+        self.assertEqual(And("a", Opt("hello", prob=1.0), "b", sep=",").build(), b"a,b")
+
+    def test_custom_field_skipping(self):
+        class ReturnsNothing(Field):
+            def build(self, pre=None, shortest=False):
+                return gutils.NOTHING
+
+        class RaisesOptGram(Field):
+            def build(self, pre=None, shortest=False):
+                raise gramfuzz.errors.OptGram
+
+        for skipped in [ReturnsNothing, RaisesOptGram]:
+            self.assertEqual(And("a", skipped, "b", sep=",").build(), b"a,b")
+            self.assertEqual(Join("a", skipped, "b", sep=",").build(), b"a,b")
+    
     def test_q_normal(self):
         data = Q("hello")
         res = data.build()
@@ -411,5 +494,89 @@ class TestFields(unittest.TestCase):
         self.assertEqual(def1, fetched_def)
 
 
+    def test_normalized_values(self):
+        a = And(UInt, "b", u"c", 1, 2.5, None)
+        self.assertIs(a.values[0], UInt.shared())
+        self.assertEqual(a.values[1:], [b"b", b"c", b"1", b"2.5", None])
+        self.assertEqual(a.build()[-10:], b"bc12.5None")
+
+        o = Int | Float
+        self.assertIs(o.values[0], Int.shared())
+        self.assertIs(o.values[1], Float.shared())
+        o = o | 5
+        self.assertEqual(o.values[2], b"5")
+
+        # subclasses have their own shared instance
+        class SubInt(Int):
+            pass
+        self.assertIsInstance(SubInt.shared(), SubInt)
+        self.assertIsNot(SubInt.shared(), Int.shared())
+
+    def test_val_types(self):
+        class Returns(Field):
+            def __init__(self, value):
+                self.value = value
+            def build(self, pre=None, shortest=False):
+                return self.value
+
+        self.assertEqual(gutils.val(b"a"), b"a")
+        self.assertEqual(gutils.val(u"a"), b"a")
+        self.assertEqual(gutils.val(5), b"5")
+        self.assertEqual(gutils.val(Returns(5)), b"5")
+        self.assertEqual(gutils.val(Returns(u"a")), b"a")
+        self.assertIs(gutils.val(Returns(gutils.NOTHING)), gutils.NOTHING)
+        self.assertRegexpMatches(gutils.val(UInt), gutils.binstr(r'^\d+$'))
+
+
+    def test_defaults_not_copied(self):
+        # fields that use the default settings don't store them
+        for field in [Int(), UInt(), String(), And("a"), Or("a"), Join("a"), Opt("a"), Q("a"), Ref("a")]:
+            self.assertEqual(vars(field), {}, repr(field))
+
+        j = Join("a", sep=";", max=3)
+        self.assertEqual(j.sep, b";")
+        self.assertEqual(j.max, 3)
+        self.assertEqual(Join.sep, b",")
+        self.assertIsNone(Join.max)
+        self.assertEqual(PLUS("a").max, 10)
+
+        s = String(min=1, max=2, charset="x")
+        self.assertEqual(s.build(), b"x")
+        self.assertEqual(String.charset, String.charset_alpha)
+
+        # building a field caches its odds table on the instance only
+        u = UInt()
+        u.build()
+        self.assertEqual(vars(u), {})
+        self.assertNotIn("_odds_cache", UInt.__dict__)
+        self.assertEqual(len(Int(min=1, max=2).__dict__), 3)
+
+    def test_subclass_attributes(self):
+        class Custom(And):
+            sep = b"-"
+            def __init__(self, *values, **kwargs):
+                super(Custom, self).__init__(*values, **kwargs)
+                self.extra = kwargs.get("extra", b"!")
+            def build(self, pre=None, shortest=False):
+                return super(Custom, self).build(pre, shortest=shortest) + self.extra
+
+        c = Custom("a", "b")
+        self.assertEqual(c.build(), b"a-b!")
+        self.assertEqual(Custom("a", extra=b"?").build(), b"a?")
+
+        class Counted(UInt):
+            counter = 0
+            def build(self, pre=None, shortest=False):
+                self.counter += 1
+                return super(Counted, self).build(pre, shortest=shortest)
+
+        counted = Counted()
+        for x in six.moves.range(10):
+            counted.build()
+        self.assertIs(type(counted), Counted)
+        self.assertEqual(counted.counter, 10)
+        self.assertEqual(Counted.counter, 0)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+import gramfuzz
+import gramfuzz.compiler as compiler
+from gramfuzz.fields import *
+import gramfuzz.rand as rand
+
+
+class TestCompiler(unittest.TestCase):
+    def setUp(self):
+        gramfuzz.GramFuzzer.__instance__ = None
+        self.fuzzer = gramfuzz.GramFuzzer()
+
+    def tearDown(self):
+        pass
+
+    def _define_grammar(self):
+        Def("top",
+            Join(
+                Ref("item"),
+                Opt(Q(Ref("item")), escape=True),
+                STAR(",", Ref("num")),
+                PLUS(Or("a", "b", Ref("num"))),
+                Q("constant"),
+                Or("c", Ref("*", cat="other")),
+            sep="|"),
+            cat="top",
+        )
+        Def("item", Or(Ref("item"), Ref("num"), Q(String(min=1, max=4))), And("[", Ref("item"), "]"))
+        Def("item", WOr(("x", 0.2), (Ref("item"), 0.5), (Join(Int, max=3), 0.3)))
+        Def("num", UInt, Opt(".", UInt, prob=0.3))
+        Def("num", Float)
+        Def("num", "1", 2, 3.0)
+        Def("a", Or("a", "b"), cat="other")
+        Def("b", "b", cat="other")
+
+    def _gen(self, engine, seed=1337, num=200, max_recursion=10):
+        self.fuzzer.set_engine(engine)
+        rand.seed(seed)
+        return list(self.fuzzer.gen(cat="top", num=num, max_recursion=max_recursion))
+
+    def test_same_output_as_recursive(self):
+        self._define_grammar()
+        self.assertEqual(self._gen("recursive"), self._gen("compiled"))
+
+    def test_same_output_shortest(self):
+        self._define_grammar()
+        self.assertEqual(
+            self._gen("recursive", max_recursion=1),
+            self._gen("compiled", max_recursion=1),
+        )
+
+    def test_overridden_helpers_are_not_inlined(self):
+        class AlwaysFirst(Or):
+            def _pick(self, shortest=False):
+                return 0
+
+        Def("top", AlwaysFirst("first", "second"), Or("a", "b"), cat="top")
+        self.fuzzer.set_engine("compiled")
+        for x in range(20):
+            res = self.fuzzer.gen(cat="top", num=1)[0]
+            self.assertIn(res, [b"firsta", b"firstb"])
+
+    def test_custom_fields_skipped(self):
+        class ReturnsNothing(Field):
+            def build(self, pre=None, shortest=False):
+                return gramfuzz.utils.NOTHING
+
+        class RaisesOptGram(Field):
+            def build(self, pre=None, shortest=False):
+                raise gramfuzz.errors.OptGram
+
+        Def("top", "a", ReturnsNothing, Ref("nothing"), RaisesOptGram, "b", sep=",", cat="top")
+        Def("nothing", Or(ReturnsNothing, RaisesOptGram))
+        # the "nothing" rule still builds to an empty string
+        self.assertEqual(self._gen("recursive", num=5), [b"a,,b"] * 5)
+        self.assertEqual(self._gen("compiled", num=5), [b"a,,b"] * 5)
+
+    def test_separators_and_quotes_in_buffer(self):
+        Def("top",
+            Q(Join(Opt("a"), Ref("skipped"), Ref("num"), STAR("b"), "c", sep=",")),
+            And(Opt("x"), Ref("skipped"), "y", sep="-"),
+            cat="top",
+        )
+        Def("num", Or(UInt, Opt("1")))
+        Def("skipped", "sometimes")
+        self.fuzzer.preprocess_rules()
+        # non-Def rule definitions are built with utils.val
+        self.fuzzer.add_definition("default", "skipped", Opt("never", prob=1.0))
+
+        results = {}
+        for engine in self.fuzzer.engines:
+            self.fuzzer.set_engine(engine)
+            rand.seed(1337)
+            results[engine] = list(self.fuzzer.gen(cat="top", num=200, auto_process=False))
+        self.assertEqual(results["stack"], results["recursive"])
+        self.assertEqual(results["compiled"], results["recursive"])
+
+    def test_deeply_nested_fields(self):
+        val = "leaf"
+        for x in range(compiler.MAX_NESTING * 3):
+            val = And(Or(val, Opt("opt")), Join(Int, max=2), sep=",")
+        Def("top", val, cat="top")
+        self.assertEqual(self._gen("recursive", num=5), self._gen("compiled", num=5))
+
+    def test_rules_added_after_compiling(self):
+        Def("top", Ref("dynamic"), cat="top")
+        Def("dynamic", "first")
+        self.fuzzer.set_engine("compiled")
+        self.fuzzer.preprocess_rules()
+        build = self.fuzzer._get_builder()
+
+        Def("dynamic", "second")
+        results = set(build(self.fuzzer.get_ref("top", "top")) for x in range(50))
+        self.assertEqual(results, set([b"first", b"second"]))
+
+    def test_recompiled_after_preprocessing(self):
+        Def("top", "hello", cat="top")
+        self.fuzzer.set_engine("compiled")
+        self.fuzzer.gen(cat="top", num=1)
+        compiled = self.fuzzer._compiled
+        self.assertIsNotNone(compiled)
+
+        Def("top", "there", cat="top")
+        self.assertIsNone(self.fuzzer._compiled)
+        self.fuzzer.gen(cat="top", num=1)
+        self.assertIsNot(compiled, self.fuzzer._compiled)
+
+    def test_compile_cache(self):
+        self._define_grammar()
+        self.fuzzer.preprocess_rules()
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            compiled = compiler.compile_rules(self.fuzzer, cache_dir=tmpdir)
+            cache_files = os.listdir(tmpdir)
+            self.assertEqual(len(cache_files), 1)
+
+            cached = compiler.compile_rules(self.fuzzer, cache_dir=tmpdir)
+            self.assertEqual(os.listdir(tmpdir), cache_files)
+            self.assertEqual(compiled.source, cached.source)
+
+            top = self.fuzzer.get_ref("top", "top")
+            rand.seed(1)
+            res1 = [compiled.build(top) for x in range(50)]
+            rand.seed(1)
+            res2 = [cached.build(top) for x in range(50)]
+            self.assertEqual(res1, res2)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_compile_cache_grammar_data(self):
+        # grammars may read data files, whose values end up in the compiled
+        # source without changing the grammar file
+        tmpdir = tempfile.mkdtemp()
+        try:
+            grammar_path = os.path.join(tmpdir, "data_grammar.py")
+            data_path = os.path.join(tmpdir, "words.txt")
+            with open(grammar_path, "w") as f:
+                f.write("\n".join([
+                    "import os",
+                    "from gramfuzz.fields import *",
+                    "with open(os.path.join(os.path.dirname(__file__), 'words.txt')) as f:",
+                    "    WORDS = f.read().split()",
+                    "Def('top', Or(*WORDS), cat='data')",
+                ]))
+            cache_dir = os.path.join(tmpdir, "cache")
+
+            results = []
+            for words in ("aaa bbb", "ccc ddd"):
+                with open(data_path, "w") as f:
+                    f.write(words)
+                gramfuzz.GramFuzzer.__instance__ = None
+                fuzzer = gramfuzz.GramFuzzer()
+                fuzzer.load_grammar(grammar_path)
+                fuzzer.preprocess_rules()
+                compiled = compiler.compile_rules(fuzzer, cache_dir=cache_dir)
+                top = fuzzer.get_ref("data", "top")
+                results.append(set(compiled.build(top) for x in range(50)))
+
+            self.assertEqual(results, [set([b"aaa", b"bbb"]), set([b"ccc", b"ddd"])])
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+
+import os
+import sys
+import threading
+import unittest
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+import gramfuzz
+import gramfuzz.context as context
+from gramfuzz.fields import *
+import gramfuzz.rand as rand
+
+
+class Depth(Field):
+    """Records how deeply nested the current value is in the context state
+    """
+    def __init__(self, *values):
+        self.values = values
+
+    def build(self, pre=None, shortest=False):
+        state = context.current().state
+        state["depth"] = state.get("depth", 0) + 1
+        try:
+            res = b"".join(gramfuzz.utils.val(v, pre, shortest=shortest) for v in self.values)
+            return res + str(state["depth"]).encode()
+        finally:
+            state["depth"] -= 1
+
+
+class TestContext(unittest.TestCase):
+    def setUp(self):
+        gramfuzz.GramFuzzer.__instance__ = None
+        self.fuzzer = gramfuzz.GramFuzzer()
+
+        Def("item", Or(
+            UInt,
+            Q(String),
+            And("[", Ref("item"), Opt(",", Ref("item")), "]"),
+            Depth("(", Ref("item"), ")"),
+        ))
+
+    def tearDown(self):
+        pass
+
+    def _gen_with_seed(self, seed, engine="recursive"):
+        self.fuzzer.set_engine(engine)
+        with context.use(context.Context(seed=seed)):
+            return self.fuzzer.gen(cat="default", num=50, max_recursion=8)
+
+    def test_threads_match_sequential(self):
+        for engine in gramfuzz.GramFuzzer.engines:
+            expected = [self._gen_with_seed(i, engine) for i in range(6)]
+            results = [None] * 6
+
+            def worker(idx):
+                with context.use(context.Context(seed=idx)):
+                    results[idx] = self.fuzzer.gen(cat="default", num=50, max_recursion=8)
+
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(6)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+            self.assertEqual(results, expected, engine)
+
+    def test_threads_max_recursion(self):
+        # threads generating with different max recursions don't change each
+        # other's, or the default max recursion of all references
+        default = Ref.max_recursion
+        for engine in gramfuzz.GramFuzzer.engines:
+            self.fuzzer.set_engine(engine)
+            expected = {}
+            for idx in range(6):
+                with context.use(context.Context(seed=idx)):
+                    expected[idx] = self.fuzzer.gen(cat="default", num=50, max_recursion=2 + idx * 3)
+            results = {}
+
+            def worker(idx):
+                with context.use(context.Context(seed=idx)):
+                    results[idx] = self.fuzzer.gen(cat="default", num=50, max_recursion=2 + idx * 3)
+
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(6)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+            self.assertEqual(results, expected, engine)
+            self.assertEqual(Ref.max_recursion, default)
+            self.assertIsNone(context.current().max_recursion)
+
+    def _max_nesting(self, data):
+        res = level = 0
+        for char in bytearray(data):
+            level += {ord("("): 1, ord(")"): -1}.get(char, 0)
+            res = max(res, level)
+        return res
+
+    def test_own_max_recursion_not_replaced(self):
+        # references with their own max recursion keep it, even if it is the
+        # same as the max recursion of all references
+        class LimitedRef(Ref):
+            max_recursion = 7
+
+        limits = [
+            (Ref("n", cat="own", max_recursion=Ref.max_recursion), Ref.max_recursion),
+            (Ref("n", cat="own", max_recursion=11), 11),
+            (LimitedRef("n", cat="own"), 7),
+        ]
+        for ref, expected in limits:
+            gramfuzz.GramFuzzer.__instance__ = None
+            fuzzer = gramfuzz.GramFuzzer()
+            Def("n", WeightedOr(("x", 0.01), (And("(", ref, ")"), 0.99)), cat="own")
+            for engine in gramfuzz.GramFuzzer.engines:
+                fuzzer.set_engine(engine)
+                res = fuzzer.gen(cat="own", num=20, max_recursion=3)
+                self.assertEqual(max(self._max_nesting(x) for x in res), expected - 1, (engine, expected))
+
+        # references without their own max recursion use the one passed to gen()
+        gramfuzz.GramFuzzer.__instance__ = None
+        fuzzer = gramfuzz.GramFuzzer()
+        Def("n", WeightedOr(("x", 0.01), (And("(", Ref("n", cat="own"), ")"), 0.99)), cat="own")
+        res = fuzzer.gen(cat="own", num=20, max_recursion=3)
+        self.assertEqual(max(self._max_nesting(x) for x in res), 2)
+
+    def test_use_restores_previous_context(self):
+        prev = context.current()
+        ctx = context.Context(seed=1)
+        with context.use(ctx) as used:
+            self.assertIs(used, ctx)
+            self.assertIs(context.current(), ctx)
+        self.assertIs(context.current(), prev)
+
+    def test_main_thread_uses_rand_module_rng(self):
+        self.assertIs(context.current().random, rand.RANDOM)
+
+        rand.seed(1337)
+        a = rand.randint(1000000)
+        rand.seed(1337)
+        self.assertEqual(rand.randint(1000000), a)
+        self.assertEqual(rand.RANDOM.getstate(), context.current().random.getstate())
+
+    def test_seed_is_per_thread(self):
+        rand.seed(1337)
+        expected = [rand.randint(1000000) for i in range(10)]
+
+        rand.seed(1337)
+        state = rand.RANDOM.getstate()
+
+        def worker():
+            self.assertIsNot(context.current().random, rand.RANDOM)
+            rand.seed(42)
+            rand.randint(1000000)
+
+        t = threading.Thread(target=worker)
+        t.start()
+        t.join()
+
+        # the other thread must not have touched the main thread's generator
+        self.assertEqual(rand.RANDOM.getstate(), state)
+        self.assertEqual([rand.randint(1000000) for i in range(10)], expected)
+
+    def test_ref_level_is_per_context(self):
+        ctx = context.Context(seed=1)
+        with context.use(ctx):
+            self.fuzzer.gen(cat="default", num=10)
+            self.assertEqual(ctx.ref_level, 1)
+        self.assertEqual(context.current().ref_level, 1)
+
+    def test_staged_defs_are_per_context(self):
+        ctx = context.Context(seed=1)
+        with context.use(ctx):
+            self.fuzzer.pre_revert()
+            self.fuzzer.add_definition("default", "pending", b"y")
+            self.assertEqual(list(ctx.staged_defs), [("default", "pending", b"y")])
+
+        # staged definitions of another context are not visible here
+        self.assertIsNone(context.current().staged_defs)
+        self.assertNotIn("pending", self.fuzzer.defs["default"])
+
+        with context.use(ctx):
+            self.fuzzer.post_revert("default", None, 1, 1, None)
+        self.assertIn("pending", self.fuzzer.defs["default"])
+
+    def test_pref_keys_are_per_context(self):
+        Def("a", "a", cat="prefs")
+        Def("b", "b", cat="prefs")
+        self.fuzzer.preprocess_rules()
+
+        ctx = context.Context(seed=1)
+        with context.use(ctx):
+            keys = self.fuzzer._get_pref_keys("prefs", ["a"])
+            self.assertEqual(list(keys), ["a"])
+            self.assertIs(self.fuzzer._get_pref_keys("prefs", ["a"]), keys)
+
+        # the lookup of another context does not replace this context's
+        self.assertEqual(list(self.fuzzer._get_pref_keys("prefs", ["b"])), ["b"])
+        with context.use(ctx):
+            self.assertIs(self.fuzzer._get_pref_keys("prefs", ["a"]), keys)
+
+            # the same preferences are looked up again after rule definitions
+            # are added
+            self.assertEqual(list(self.fuzzer._get_pref_keys("prefs", ["a", "c"])), ["a"])
+            self.fuzzer.add_definition("prefs", "c", b"c")
+            self.assertEqual(list(self.fuzzer._get_pref_keys("prefs", ["a", "c"])), ["a", "c"])
+
+    def test_staged_defs_created_on_first_add(self):
+        self.fuzzer.pre_revert()
+        self.assertIsNone(context.current().staged_defs)
+        self.fuzzer.post_revert("default", None, 1, 1, None)
+
+        self.fuzzer.pre_revert()
+        self.fuzzer.add_definition("default", "pending", b"y")
+        self.fuzzer.revert()
+        self.assertIsNone(context.current().staged_defs)
+        self.assertNotIn("pending", self.fuzzer.defs["default"])
+
+    def test_staged_defs_copy_on_write(self):
+        items = self.fuzzer.defs["default"]["item"]
+        staged = context.StagedDefs(self.fuzzer.defs)
+        staged.add("default", "item", b"y")
+        staged.add("default", "new", b"z")
+
+        self.assertEqual(len(items), 1)
+        self.assertEqual(staged.get("default", "item"), items + [b"y"])
+        self.assertIsNone(staged.get("default", "other"))
+        self.assertIsNone(staged.bind_ref("other", "item"))
+        self.assertEqual(staged.bind_ref("default", "new"), ([b"z"], None))
+        self.assertEqual(staged.bind_ref("default", "*")[0], ("item", "new"))
+
+    def test_staged_defs_visible_in_same_rule(self):
+        fuzzer = self.fuzzer
+
+        class Defines(Field):
+            def build(self, pre=None, shortest=False):
+                fuzzer.add_definition("staged_values", "defined", b"value")
+                return b"defined:"
+
+        # the staged rule is in a category of its own, so that generating from
+        # "staged" can't choose it once an earlier engine's run committed it
+        Def("top", Defines, Ref("defined", cat="staged_values"), cat="staged", no_prune=True)
+        fuzzer.preprocess_rules()
+
+        for engine in gramfuzz.GramFuzzer.engines:
+            fuzzer.set_engine(engine)
+            ctx = context.Context(seed=1)
+            with context.use(ctx):
+                res = fuzzer.gen(cat="staged", num=1)
+            self.assertEqual(list(res), [b"defined:value"])
+            self.assertIsNone(ctx.staged_defs)
+
+    def test_budget_same_output_for_all_engines(self):
+        Def("wide", Join(Ref("item"), sep=b";", max=20), cat="budget")
+
+        def gen(engine, budget=None):
+            self.fuzzer.set_engine(engine)
+            with context.use(context.Context(seed=1)):
+                return list(self.fuzzer.gen(cat="budget", num=50, max_recursion=20, budget=budget))
+
+        unlimited = gen("recursive")
+        for budget in [context.Budget(max_nodes=10), context.Budget(max_bytes=50)]:
+            expected = gen("recursive", budget)
+            self.assertLess(len(b"".join(expected)), len(b"".join(unlimited)))
+            for engine in gramfuzz.GramFuzzer.engines:
+                self.assertEqual(gen(engine, budget), expected, engine)
+
+    def test_budget_stops_join_repetitions(self):
+        Def("top", Join(Ref("x", cat="budget"), sep=b",", max=100), cat="budget")
+        Def("x", "x", cat="budget")
+
+        for engine in gramfuzz.GramFuzzer.engines:
+            self.fuzzer.set_engine(engine)
+            with context.use(context.Context(seed=1)):
+                res = self.fuzzer.gen(cat="budget", num=50, budget=context.Budget(max_nodes=7))
+            counts = set(x.count(b"x") for x in res)
+            # every repetition spends a node on itself and one on its
+            # reference
+            self.assertEqual(max(counts), 3, engine)
+
+    def test_budget_limits_joins_without_refs(self):
+        Def("top", Join(String(min=50, max=51), max=20000, sep=b","), cat="budget")
+
+        for engine in gramfuzz.GramFuzzer.engines:
+            self.fuzzer.set_engine(engine)
+            with context.use(context.Context(seed=1)):
+                res = self.fuzzer.gen(cat="budget", num=20, budget=context.Budget(max_bytes=1000, max_nodes=50))
+            for val in res:
+                self.assertLessEqual(len(val), 1000, engine)
+                self.assertGreater(len(val), 500, engine)
+
+    def test_budget_chooses_or_values_that_fit(self):
+        Def("top", Or(Join(b"x", max=1), Join(b"y" * 200, max=1)), cat="budget")
+
+        for engine in gramfuzz.GramFuzzer.engines:
+            self.fuzzer.set_engine(engine)
+            with context.use(context.Context(seed=1)):
+                limited = self.fuzzer.gen(cat="budget", num=50, budget=context.Budget(max_bytes=100))
+                unlimited = self.fuzzer.gen(cat="budget", num=50, budget=context.Budget(max_bytes=1000))
+            self.assertEqual(set(limited), set([b"x"]), engine)
+            self.assertEqual(set(unlimited), set([b"x", b"y" * 200]), engine)
+
+        costs = self.fuzzer._budget_costs[self.fuzzer.defs["budget"]["top"][0].values[0]]
+        self.assertEqual(costs, ([(1, 1), (200, 1)], (200, 1)))
+
+    def test_budget_weighted_or_tables_cached(self):
+        wor = WOr((Join(b"x", max=1), 0.2), (Join(b"z", max=1), 0.3), (Join(b"y" * 200, max=1), 0.5))
+        Def("top", wor, cat="budget")
+
+        for engine in gramfuzz.GramFuzzer.engines:
+            self.fuzzer.set_engine(engine)
+            with context.use(context.Context(seed=1)):
+                limited = self.fuzzer.gen(cat="budget", num=50, budget=context.Budget(max_bytes=100))
+            self.assertEqual(set(limited), set([b"x", b"z"]), engine)
+
+        # the scaled weights of the values that fit are only computed once
+        self.assertEqual(list(wor._fitting_tables.keys()), [(0, 1)])
+        self.assertEqual(wor._fitting_tables[(0, 1)].cumulative, [0.4, 1.0])
+
+    def test_budget_exhausted_builds_shortest(self):
+        Def("top", Ref("item"), cat="budget")
+        for engine in gramfuzz.GramFuzzer.engines:
+            self.fuzzer.set_engine(engine)
+            res = self.fuzzer.gen(cat="budget", num=20, budget=context.Budget(timeout=0))
+            for val in res:
+                # the shortest item values are ints and quoted strings
+                self.assertNotIn(b"[", val, engine)
+                self.assertNotIn(b"(", val, engine)
+
+    def test_budget_is_per_rule(self):
+        ctx = context.Context(seed=1)
+        budget = context.Budget(max_nodes=5)
+        with context.use(ctx):
+            for val in self.fuzzer.gen_iter(cat="default", num=10, max_recursion=8, budget=budget):
+                self.assertIsNone(ctx.budget)
+        self.assertEqual(budget.nodes, 0)
+        self.assertFalse(budget.exhausted)
+
+    def test_budget_counts_nested_bytes_once(self):
+        budget = context.Budget(max_bytes=10).start()
+        self.assertFalse(budget.enter())
+        self.assertFalse(budget.enter())
+        budget.exit(4)
+        self.assertFalse(budget.enter())
+        budget.exit()
+        budget.exit(9)
+        self.assertEqual(budget.nodes, 3)
+        self.assertEqual(budget.bytes, 9)
+        self.assertFalse(budget.exhausted)
+
+        self.assertFalse(budget.enter())
+        budget.exit(1)
+        self.assertTrue(budget.exhausted)
+        self.assertTrue(budget.enter())
+        budget.exit(0)
+
+
+if __name__ == "__main__":
+    unittest.main()
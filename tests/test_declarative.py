@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+import gramfuzz
+import gramfuzz.context as context
+import gramfuzz.declarative as declarative
+from gramfuzz.fields import *
+
+
+class TRef(Ref):
+    cat = "test_def"
+class TDef(Def):
+    cat = "test_def"
+
+
+def define_rules():
+    Def("top",
+        TRef("list"), " ", TRef("number"), " ", TRef("text"),
+    cat="test", sep="|")
+    TDef("list", Join(TRef("number"), sep=";", max=4), PLUS("+", UInt), STAR("*", Opt("?", prob=0.3)))
+    TDef("number", Or(UInt, Int(min=-5, max=5), Float, UFloat(min=0.5, max=2.5), Int(odds=[(0.5, 1), (0.5, [10, 20])])))
+    TDef("number", WeightedOr((b"\x00\xff", 0.2), (TRef("number"), 0.5), (UInt(5), 0.3)), no_prune=True, max_recursion=4)
+    TDef("text", Q(String(charset=b"ab\xff", min=1, max=4)), Q(TRef("text", max_recursion=3), escape=True), And("a", "b", sep=b"-"))
+    TDef("text", Q(u"é", quote=b"'"), Q(u"fixed", html_js_escape=True))
+
+
+class TestDeclarative(unittest.TestCase):
+    def setUp(self):
+        gramfuzz.GramFuzzer.__instance__ = None
+        self.fuzzer = gramfuzz.GramFuzzer()
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "grammar.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _gen(self, fuzzer, **kwargs):
+        with context.use(context.Context(seed=1337)):
+            return list(fuzzer.gen(num=100, max_recursion=5, **kwargs))
+
+    def _new_fuzzer(self):
+        gramfuzz.GramFuzzer.__instance__ = None
+        return gramfuzz.GramFuzzer()
+
+    def test_roundtrip(self):
+        define_rules()
+        self.fuzzer.set_cat_group_top_level_cat("test_declarative", "test")
+        self.fuzzer.export_grammar(self.path)
+        expected = self._gen(self.fuzzer, cat="test")
+
+        fuzzer = self._new_fuzzer()
+        fuzzer.load_grammar(self.path)
+
+        # exporting the loaded rules writes the same file
+        path = os.path.join(self.tmpdir, "again.json")
+        fuzzer.export_grammar(path)
+        with open(self.path) as f1, open(path) as f2:
+            self.assertEqual(f1.read(), f2.read())
+
+        self.assertEqual(self._gen(fuzzer, cat_group="test_declarative"), expected)
+        self.assertEqual(fuzzer.no_prunes, {"test_def": {"number": True}})
+        # rules are exported in the order of defs, which is arbitrary on python 2
+        self.assertEqual(sorted(fuzzer.cat_groups["test_def"]["test_declarative"]), ["list", "number", "number", "text", "text"])
+
+    def test_export_after_gen(self):
+        """Rules can still be exported after they were preprocessed and generated from
+        """
+        define_rules()
+        self.fuzzer.set_cat_group_top_level_cat("test_declarative", "test")
+        expected = self._gen(self.fuzzer, cat="test", budget=context.Budget(max_nodes=20))
+        self.fuzzer.export_grammar(self.path)
+
+        fuzzer = self._new_fuzzer()
+        fuzzer.load_grammar(self.path)
+        res = self._gen(fuzzer, cat_group="test_declarative", budget=context.Budget(max_nodes=20))
+        self.assertEqual(res, expected)
+
+    def test_format(self):
+        Def("a", Or("x", UInt), TRef("b"), cat="c")
+        f = io.StringIO()
+        declarative.dump(self.fuzzer, f)
+        lines = [json.loads(line) for line in f.getvalue().splitlines()]
+        self.assertEqual(lines, [
+            {"gramfuzz_grammar": 1, "cat_groups": {"test_declarative": None}, "cats": ["c"]},
+            {
+                "group": "test_declarative", "cat": "c", "name": "a",
+                "values": [
+                    {"type": "Or", "values": ["x", {"class": "UInt"}]},
+                    {"type": "Ref", "refname": "b", "cat": "test_def"},
+                ],
+            },
+        ])
+
+    def test_ref_own_max_recursion(self):
+        # the reference's own max recursion is kept, even if it is the same as
+        # the max recursion of all references
+        Def("a", TRef("b", max_recursion=Ref.max_recursion), TRef("b"), cat="c")
+        f = io.StringIO()
+        declarative.dump(self.fuzzer, f)
+        values = json.loads(f.getvalue().splitlines()[1])["values"]
+        self.assertEqual(values[0]["max_recursion"], Ref.max_recursion)
+        self.assertNotIn("max_recursion", values[1])
+
+    def test_non_ascii_names(self):
+        Def("nämé", Ref("öther", cat="cät"), "-", Or(u"é", "x"), cat="cät")
+        Def("öther", "other", cat="cät")
+        self.fuzzer.export_grammar(self.path)
+        expected = self._gen(self.fuzzer, cat="cät")
+
+        fuzzer = self._new_fuzzer()
+        fuzzer.load_grammar(self.path)
+        self.assertEqual(sorted(fuzzer.defs["cät"].keys()), sorted(["nämé", "öther"]))
+        self.assertEqual(self._gen(fuzzer, cat="cät"), expected)
+
+    def test_export_cat_groups(self):
+        define_rules()
+        Def("other", "other", cat="test")
+        self.fuzzer.cat_groups["test"]["other_group"] = self.fuzzer.cat_groups["test"].pop("test_declarative")
+
+        self.fuzzer.export_grammar(self.path, cat_groups=["other_group"])
+        fuzzer = self._new_fuzzer()
+        fuzzer.load_grammar(self.path)
+        self.assertEqual(sorted(fuzzer.defs["test"].keys()), ["other", "top"])
+        self.assertNotIn("test_def", fuzzer.defs)
+
+    def test_custom_field(self):
+        class Custom(Field):
+            def build(self, pre=None, shortest=False):
+                return b"custom"
+
+        class CustomRef(Ref):
+            def build(self, pre=None, shortest=False):
+                return b"custom"
+
+        for value in [Custom, Custom(), CustomRef("a"), Or(Custom)]:
+            gramfuzz.GramFuzzer.__instance__ = None
+            fuzzer = gramfuzz.GramFuzzer()
+            Def("a", value)
+            with self.assertRaises(gramfuzz.errors.GramFuzzError):
+                fuzzer.export_grammar(self.path)
+            self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_not_a_grammar(self):
+        with open(self.path, "w") as f:
+            f.write('{"something": "else"}\n')
+        with self.assertRaises(gramfuzz.errors.GramFuzzError):
+            self.fuzzer.load_grammar(self.path)
+
+    def test_lazy(self):
+        define_rules()
+        self.fuzzer.set_cat_group_top_level_cat("test_declarative", "test")
+        self.fuzzer.export_grammar(self.path)
+        expected = self._gen(self.fuzzer, cat="test")
+
+        fuzzer = self._new_fuzzer()
+        fuzzer.load_grammar(self.path, lazy=True)
+        self.assertEqual(fuzzer.defs, {})
+        self.assertEqual(self._gen(fuzzer, cat_group="test_declarative"), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
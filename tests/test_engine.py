@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+
+import os
+import sys
+import unittest
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+import gramfuzz
+import gramfuzz.context
+import gramfuzz.engine
+from gramfuzz.fields import *
+import gramfuzz.rand as rand
+import gramfuzz.utils as gutils
+
+
+class TestStackEngine(unittest.TestCase):
+    def setUp(self):
+        gramfuzz.GramFuzzer.__instance__ = None
+        self.fuzzer = gramfuzz.GramFuzzer()
+        self._max_recursion = Ref.max_recursion
+
+    def tearDown(self):
+        Ref.max_recursion = self._max_recursion
+
+    def _define_grammar(self):
+        Def("top",
+            Join(
+                Ref("item"),
+                Opt(Q(Ref("item")), escape=True),
+                STAR(",", Ref("num")),
+                PLUS(Or("a", "b", Ref("num"))),
+            sep="|"),
+            cat="top",
+        )
+        Def("item", Or(Ref("item"), Ref("num"), Q(String(min=1, max=4))), And("[", Ref("item"), "]"))
+        Def("item", WOr(("x", 0.2), (Ref("item"), 0.5), (Join(Int, max=3), 0.3)))
+        Def("num", UInt, Opt(".", UInt, prob=0.3))
+        Def("num", Float)
+
+    def _gen(self, engine, seed=1337, num=200, max_recursion=10):
+        self.fuzzer.set_engine(engine)
+        rand.seed(seed)
+        return list(self.fuzzer.gen(cat="top", num=num, max_recursion=max_recursion))
+
+    def test_same_output_as_recursive(self):
+        self._define_grammar()
+        recursive = self._gen("recursive")
+        stack = self._gen("stack")
+        self.assertEqual(recursive, stack)
+
+    def test_same_output_shortest(self):
+        self._define_grammar()
+        recursive = self._gen("recursive", max_recursion=1)
+        stack = self._gen("stack", max_recursion=1)
+        self.assertEqual(recursive, stack)
+
+    def test_deeper_than_python_recursion_limit(self):
+        depth = sys.getrecursionlimit()
+        for x in range(depth):
+            Def("r{}".format(x), "a", Ref("r{}".format(x + 1)))
+        Def("r{}".format(depth), "END")
+        Ref.max_recursion = depth * 2
+
+        top = self.fuzzer.get_ref("default", "r0")
+        res = gramfuzz.engine.build(top)
+        self.assertEqual(res, b"a" * depth + b"END")
+
+        with self.assertRaises(RuntimeError):
+            gutils.val(top)
+
+    def test_opt_at_top_level(self):
+        res = gramfuzz.engine.build(Opt("hello", prob=1.0))
+        self.assertIs(res, gutils.NOTHING)
+
+    def test_custom_field_opt_gram(self):
+        class Nothing(Field):
+            def build(self, pre=None, shortest=False):
+                raise gramfuzz.errors.OptGram
+
+        res = gramfuzz.engine.build(And("a", Nothing, "b", sep=","))
+        self.assertEqual(res, b"a,b")
+
+    def test_custom_field_nothing(self):
+        class Nothing(Field):
+            def build(self, pre=None, shortest=False):
+                return gutils.NOTHING
+
+        res = gramfuzz.engine.build(And("a", Nothing, "b", sep=","))
+        self.assertEqual(res, b"a,b")
+
+    def test_undefined_ref(self):
+        Def("test", "a", Ref("undefined"))
+        Ref.max_recursion = 10
+        level = gramfuzz.context.current().ref_level
+
+        with self.assertRaises(gramfuzz.errors.GramFuzzError):
+            gramfuzz.engine.build(self.fuzzer.get_ref("default", "test"))
+
+        # ref levels should be restored, even when errors occur
+        self.assertEqual(gramfuzz.context.current().ref_level, level)
+
+    def test_unknown_engine(self):
+        with self.assertRaises(gramfuzz.errors.GramFuzzError):
+            self.fuzzer.set_engine("unknown")
+
+
+if __name__ == "__main__":
+    unittest.main()
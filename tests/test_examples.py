@@ -12,6 +12,7 @@ import os
 import random
 import subprocess
 import sys
+import time
 import unittest
 
 
@@ -20,6 +21,7 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 
 import gramfuzz
 from gramfuzz.fields import *
+import gramfuzz.rand
 import gramfuzz.utils as gutils
 
 
@@ -45,6 +47,23 @@ class TestExamples(unittest.TestCase):
 
             self.assertNotIn(b"ERROR", stdout)
 
+    def test_python27_recursion_modes(self):
+        # large groups of rules that recurse through each other must not
+        # make the counted recursion modes generate runaway samples
+        gram_path = os.path.join(os.path.dirname(__file__), "..", "examples", "grams", "python27.py")
+        for recursion in gramfuzz.GramFuzzer.recursion_modes:
+            gramfuzz.GramFuzzer.__instance__ = None
+            fuzzer = gramfuzz.GramFuzzer()
+            fuzzer.load_grammar(gram_path)
+            fuzzer.set_recursion(recursion)
+            gramfuzz.rand.seed(1337)
+
+            start = time.time()
+            for x in range(10):
+                sample = fuzzer.gen(cat_group="python27", num=1, max_recursion=10)
+                self.assertLess(sum(len(v) for v in sample), 1024 * 1024, recursion)
+            self.assertLess(time.time() - start, 30, recursion)
+
 
 if __name__ == "__main__":
     unittest.main()
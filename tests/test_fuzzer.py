@@ -2,6 +2,7 @@
 # encoding: utf-8
 
 
+import itertools
 import os
 import shutil
 import sys
@@ -29,6 +30,106 @@ class TestFuzzer(unittest.TestCase):
         self.fuzzer.set_max_recursion(100)
         self.assertEqual(Ref.max_recursion, 100)
 
+    def test_set_recursion(self):
+        self.fuzzer.set_recursion("scc")
+        self.assertEqual(self.fuzzer.recursion, "scc")
+        with self.assertRaises(gramfuzz.errors.GramFuzzError):
+            self.fuzzer.set_recursion("other")
+
+    def _define_recursion_grammar(self):
+        # a long chain of helper rules in front of a recursive rule
+        Def("top", Ref("h0", cat="rec"), cat="top")
+        for idx in range(8):
+            Def("h{}".format(idx), Ref("h{}".format(idx + 1), cat="rec"), cat="rec")
+        Def("h8", Ref("list", cat="rec"), cat="rec")
+        Def("list", Or("x", And("[", Ref("list", cat="rec"), "]")), cat="rec")
+
+    def _gen_recursion(self, recursion, max_recursion=5):
+        res = None
+        for engine in gramfuzz.GramFuzzer.engines:
+            self.fuzzer.set_engine(engine)
+            self.fuzzer.set_recursion(recursion)
+            gramfuzz.rand.seed(1337)
+            engine_res = list(self.fuzzer.gen(cat="top", num=100, max_recursion=max_recursion))
+            if res is None:
+                res = engine_res
+            self.assertEqual(engine_res, res, engine)
+        return res
+
+    def test_recursion_global(self):
+        self._define_recursion_grammar()
+        self.assertEqual(set(self._gen_recursion("global")), set([b"x"]))
+
+    def test_recursion_rule(self):
+        self._define_recursion_grammar()
+        self.assertEqual(set(self._gen_recursion("global", max_recursion=10)), set([b"x"]))
+        res = self._gen_recursion("rule", max_recursion=10)
+        # the helper rules are not counted, but the reference depth is
+        # still capped at 1.2 times the max recursion
+        self.assertEqual(max(x.count(b"[") for x in res), 1)
+
+    def test_recursion_scc(self):
+        Def("top", Ref("a", cat="rec"), cat="top")
+        Def("a", Or("a", And("(", Ref("b", cat="rec"), ")")), cat="rec")
+        Def("b", Or("b", And("[", Ref("a", cat="rec"), "]")), cat="rec")
+
+        rule_res = self._gen_recursion("rule")
+        scc_res = self._gen_recursion("scc")
+        self.assertEqual(max(x.count(b"(") + x.count(b"[") for x in scc_res), 3)
+        # each rule is counted separately, until the reference depth cap
+        self.assertEqual(max(x.count(b"(") for x in rule_res), 2)
+        self.assertEqual(max(x.count(b"(") + x.count(b"[") for x in rule_res), 4)
+
+    def _max_nesting(self, data):
+        res = level = 0
+        for char in bytearray(data):
+            if char == ord(b"("):
+                level += 1
+                res = max(res, level)
+            elif char == ord(b")"):
+                level -= 1
+        return res
+
+    def test_recursion_depth_cap(self):
+        # a ring of rules that each reference the next one three times would
+        # nest 5 times per rule (40 levels) if only the rules were counted
+        Def("top", Ref("r0", cat="rec"), cat="top")
+        for idx in range(8):
+            next_ref = Ref("r{}".format((idx + 1) % 8), cat="rec")
+            Def("r{}".format(idx), Or("x", And("(", next_ref, next_ref, next_ref, ")")), cat="rec")
+
+        rule_res = self._gen_recursion("rule", max_recursion=6)
+        scc_res = self._gen_recursion("scc", max_recursion=6)
+        # the reference depth is capped at 7.2, the top-level reference is at depth 2
+        self.assertEqual(max(self._max_nesting(x) for x in rule_res), 6)
+        self.assertEqual(max(self._max_nesting(x) for x in scc_res), 4)
+        # at most 3**6 leaves and (3**6 - 1) / 2 pairs of parentheses
+        self.assertLess(max(len(x) for x in rule_res), 3 ** 6 * 2)
+
+    def test_recursion_overrides(self):
+        Def("top", Ref("list", cat="rec", max_recursion=2), cat="top")
+        Def("top", Ref("tree", cat="rec"), cat="top")
+        Def("list", Or("x", And("[", Ref("list", cat="rec"), "]")), cat="rec")
+        Def("tree", Or("y", And("(", Ref("tree", cat="rec"), ")")), cat="rec", max_recursion=4)
+
+        for recursion in ("global", "rule"):
+            res = self._gen_recursion(recursion, max_recursion=8)
+            self.assertEqual(set(res), set([b"x", b"y", b"(y)", b"((y))"]))
+
+    def test_rule_components(self):
+        Def("a", Ref("b"), Opt(Ref("a")))
+        Def("b", Or("b", Ref("c")))
+        Def("c", Ref("a"))
+        Def("d", Ref("a"), Ref("*", cat="other"))
+        Def("e", Ref("d"), cat="other")
+        Def("f", "f", cat="other")
+
+        components = self.fuzzer._find_rule_components()
+        self.assertEqual(components[("default", "a")], components[("default", "b")])
+        self.assertEqual(components[("default", "a")], components[("default", "c")])
+        self.assertEqual(components[("default", "d")], components[("other", "e")])
+        self.assertEqual(len(set(components.values())), 3)
+
     def test_default_cat_for_cat_group(self):
         named_tmp = tempfile.NamedTemporaryFile()
         named_tmp.write(gutils.binstr(r"""
@@ -49,6 +150,34 @@ Def("c", UInt, cat="other")
         self.assertIn(cat_group, self.fuzzer.cat_group_defaults)
         self.assertEqual(self.fuzzer.cat_group_defaults[cat_group], "other")
 
+    def test_def_cat_group(self):
+        """Rules are added to the category group of the file that defined them
+        """
+        named_tmp = tempfile.NamedTemporaryFile(suffix=".py")
+        named_tmp.write(gutils.binstr(r"""
+from gramfuzz.fields import *
+
+TOP_CAT = "grouped"
+
+class GDef(Def):
+    def __init__(self, name, *values):
+        Def.__init__(self, name, *values, cat="grouped")
+
+Def("a", "a", cat="grouped")
+GDef("b", "b")
+        """))
+        named_tmp.flush()
+        self.fuzzer.load_grammar(named_tmp.name)
+        cat_group = os.path.basename(named_tmp.name).replace(".py", "")
+        named_tmp.close()
+
+        Def("c", "c", cat="grouped")
+
+        self.assertEqual(list(self.fuzzer.cat_groups["grouped"][cat_group]), ["a", "b"])
+        self.assertEqual(list(self.fuzzer.cat_groups["grouped"]["test_fuzzer"]), ["c"])
+        self.assertEqual(self.fuzzer.cat_group_defaults[cat_group], "grouped")
+        self.assertNotIn("test_fuzzer", self.fuzzer.cat_group_defaults)
+
     def test_gen_cat_group(self):
         named_tmp = tempfile.NamedTemporaryFile()
         named_tmp.write(gutils.binstr(r"""
@@ -200,6 +329,91 @@ Def("file2def", "hi from file2", cat="file2")
         finally:
             shutil.rmtree(tmpdir)
 
+    def test_lazy_load_grammar(self):
+        tmpdir = tempfile.mkdtemp()
+
+        grammars = {
+            "lazy_a": r"""
+from gramfuzz.fields import *
+
+TOP_CAT = "lazy_a"
+
+Def("a", Ref("b", cat="lazy_b"), Ref("d", cat="lazy_d"), cat="lazy_a")
+            """,
+            "lazy_b": r"""
+from gramfuzz.fields import *
+
+class BDef(Def):
+    cat = "lazy_b"
+
+BDef("b", "b")
+            """,
+            "lazy_c": r"""
+from gramfuzz.fields import *
+
+Def("c", "c", cat="lazy_c")
+            """,
+            # imports lazy_e itself, so lazy_e must not be loaded again
+            "lazy_d": r"""
+from gramfuzz.fields import *
+
+import lazy_e
+
+Def("d", Ref("e", cat=lazy_e.TOP_CAT), cat="lazy_d")
+            """,
+            "lazy_e": r"""
+from gramfuzz.fields import *
+
+TOP_CAT = "lazy_e"
+
+Def("e", "e", cat="lazy_e")
+            """,
+        }
+
+        try:
+            for name, source in grammars.items():
+                with open(os.path.join(tmpdir, name + ".py"), "wb") as f:
+                    f.write(gutils.binstr(source))
+            for name in sorted(grammars.keys()):
+                self.fuzzer.load_grammar(os.path.join(tmpdir, name + ".py"), lazy=True)
+
+            self.assertEqual(self.fuzzer.defs, {})
+            self.assertEqual(self.fuzzer.cat_group_defaults["lazy_a"], "lazy_a")
+
+            res = self.fuzzer.gen(cat_group="lazy_a", num=1)[0]
+            self.assertEqual(res, b"be")
+            self.assertEqual(sorted(self.fuzzer.defs.keys()), ["lazy_a", "lazy_b", "lazy_d", "lazy_e"])
+            self.assertEqual(len(self.fuzzer.defs["lazy_e"]["e"]), 1)
+
+            res = self.fuzzer.gen(cat="lazy_c", num=1)[0]
+            self.assertEqual(res, b"c")
+            self.assertEqual(self.fuzzer._lazy_grammars, [])
+
+        # always clean up
+        finally:
+            sys.modules.pop("lazy_e", None)
+            shutil.rmtree(tmpdir)
+
+    def test_grammar_categories(self):
+        top_cat, cats = gutils.grammar_categories(r"""
+TOP_CAT = "top"
+
+class ODef(Def):
+    cat = "other"
+
+Def("a", Ref("b", cat=OTHER))
+ODef("b", "b")
+GRAMFUZZER.add_definition("added", "c", "c")
+        """)
+        self.assertEqual(top_cat, "top")
+        self.assertEqual(cats, set(["top", "other", "default", "added"]))
+
+        # the categories of Defs with categories that are not string literals
+        # are not known
+        top_cat, cats = gutils.grammar_categories('Def("a", "a", cat=OTHER)')
+        self.assertIsNone(top_cat)
+        self.assertIsNone(cats)
+
     # see #4 - auto process during gen()
     def test_auto_process(self):
         named_tmp = tempfile.NamedTemporaryFile()
@@ -230,6 +444,106 @@ Def("not_reachable", Ref("doesnt_exist", cat="other"), cat="other")
             "referenced definition ('not_reachable') not defined"
         )
 
+    def test_unbound_refs(self):
+        Def("test", Or("hello", Ref("doesnt_exist")))
+        self.fuzzer.preprocess_rules()
+
+        self.assertEqual(len(self.fuzzer.unbound_refs), 1)
+        cat, rule_name, ref = self.fuzzer.unbound_refs[0]
+        self.assertEqual((cat, rule_name, ref.refname), ("default", "test", "doesnt_exist"))
+
+        with self.assertRaises(gramfuzz.errors.GramFuzzError):
+            ref.build()
+
+        # the reference is bound once the rule is defined
+        Def("doesnt_exist", "world")
+        self.fuzzer.preprocess_rules()
+        self.assertEqual(len(self.fuzzer.unbound_refs), 0)
+        self.assertEqual(ref.build(), b"world")
+
+    def test_bound_refs_follow_definitions(self):
+        Def("a", "a1")
+        ref = Ref("a")
+        star = Ref("*")
+        self.fuzzer.preprocess_rules()
+
+        self.assertEqual(set(ref.build() for x in range(100)), set([b"a1"]))
+        self.assertEqual(set(star.build() for x in range(100)), set([b"a1"]))
+
+        Def("a", "a2")
+        Def("b", "b1")
+        self.assertEqual(set(ref.build() for x in range(100)), set([b"a1", b"a2"]))
+        self.assertEqual(set(star.build() for x in range(100)), set([b"a1", b"a2", b"b1"]))
+
+    def test_bound_refs_match_get_ref(self):
+        Def("a", "a1")
+        Def("a", "a2")
+        Def("b", "b1")
+        self.fuzzer.preprocess_rules()
+
+        for refname in ["a", "*"]:
+            gramfuzz.rand.seed(1337)
+            expected = [self.fuzzer.get_ref("default", refname) for x in range(100)]
+            ref = Ref(refname)
+            gramfuzz.rand.seed(1337)
+            self.assertEqual([ref._resolve() for x in range(100)], expected)
+
+    def _define_gen_grammar(self):
+        class WithPre(Field):
+            def build(self, pre=None, shortest=False):
+                pre.append(b"pre")
+                return b"val"
+
+        Def("a", Or("a", "b"), Opt("c"), cat="gen")
+        Def("b", WithPre, cat="gen")
+
+    def test_gen_iter(self):
+        self._define_gen_grammar()
+
+        gramfuzz.rand.seed(1337)
+        expected = list(self.fuzzer.gen(cat="gen", num=100))
+
+        gramfuzz.rand.seed(1337)
+        iterated = self.fuzzer.gen_iter(cat="gen", num=100)
+        self.assertNotIsInstance(iterated, list)
+        self.assertEqual(list(iterated), expected)
+        self.assertIn(b"pre", expected)
+
+    def test_gen_iter_forever(self):
+        Def("a", "hello", cat="gen")
+        res = list(itertools.islice(self.fuzzer.gen_iter(cat="gen"), 1000))
+        self.assertEqual(res, [b"hello"] * 1000)
+
+    def test_gen_sink(self):
+        self._define_gen_grammar()
+
+        gramfuzz.rand.seed(1337)
+        expected = list(self.fuzzer.gen(cat="gen", num=100))
+
+        gramfuzz.rand.seed(1337)
+        sunk = []
+        res = self.fuzzer.gen(cat="gen", num=100, sink=sunk.append)
+        self.assertIsNone(res)
+        self.assertEqual(sunk, expected)
+
+    def test_gen_iter_staged_defs(self):
+        fuzzer = self.fuzzer
+
+        class Defines(Field):
+            def build(self, pre=None, shortest=False):
+                fuzzer.add_definition("gen", "defined", "value")
+                return b"defined"
+
+        Def("a", Defines, cat="gen")
+        fuzzer.preprocess_rules()
+
+        iterated = fuzzer.gen_iter(cat="gen", num=2)
+        self.assertEqual(next(iterated), b"defined")
+        # staged definitions are committed before the value is yielded
+        self.assertEqual(len(fuzzer.defs["gen"]["defined"]), 1)
+        self.assertEqual(next(iterated), b"defined")
+        self.assertEqual(len(fuzzer.defs["gen"]["defined"]), 2)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+
+import os
+import sys
+import unittest
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+import gramfuzz
+from gramfuzz.fields import *
+import gramfuzz.rand as rand
+
+
+class TestParallel(unittest.TestCase):
+    def setUp(self):
+        gramfuzz.GramFuzzer.__instance__ = None
+        self.fuzzer = gramfuzz.GramFuzzer()
+
+        class WithPre(Field):
+            def build(self, pre=None, shortest=False):
+                pre.append(b"pre")
+                return b"val"
+
+        Def("top", Ref("item"), Opt(",", Ref("item")), cat="top")
+        Def("top", WithPre, cat="top")
+        Def("item", Or(UInt, Q(String), And("[", Ref("item"), "]")))
+
+    def tearDown(self):
+        pass
+
+    def test_same_output_for_any_number_of_workers(self):
+        single = self.fuzzer.gen_parallel(cat="top", num=200, workers=1, seed=1337)
+        self.assertEqual(len(single), 200 + single.count(b"pre"))
+
+        for workers in [2, 3]:
+            res = self.fuzzer.gen_parallel(cat="top", num=200, workers=workers, seed=1337, chunksize=7)
+            self.assertEqual(res, single)
+
+    def test_state_is_not_shared_between_samples(self):
+        import gramfuzz.context as context
+
+        class Counter(Field):
+            def build(self, pre=None, shortest=False):
+                state = context.current().state
+                state["count"] = state.get("count", 0) + 1
+                return str(state["count"]).encode()
+
+        Def("counter", Counter, cat="counter")
+        single = self.fuzzer.gen_parallel(cat="counter", num=12, workers=1, seed=5, chunksize=3)
+        self.assertEqual(list(single), [b"1"] * 12)
+
+        for workers in [2, 4]:
+            res = self.fuzzer.gen_parallel(cat="counter", num=12, workers=workers, seed=5, chunksize=3)
+            self.assertEqual(res, single)
+
+    def test_samples_are_reproducible(self):
+        res = self.fuzzer.gen_parallel(cat="top", num=50, workers=2, seed=1337)
+        res = [x for x in res if x != b"pre"]
+        for idx in [0, 17, 49]:
+            sample = self.fuzzer.gen_parallel(cat="top", num=idx + 1, workers=1, seed=1337)
+            self.assertEqual(sample[-1], res[idx])
+
+    def test_budget(self):
+        import gramfuzz.context as context
+        budget = context.Budget(max_nodes=2)
+        single = self.fuzzer.gen_parallel(cat="top", num=50, workers=1, seed=1337, max_recursion=20, budget=budget)
+        res = self.fuzzer.gen_parallel(cat="top", num=50, workers=2, seed=1337, max_recursion=20, budget=budget)
+        self.assertEqual(res, single)
+        self.assertNotEqual(res, self.fuzzer.gen_parallel(cat="top", num=50, workers=1, seed=1337, max_recursion=20))
+
+    def test_recursion(self):
+        self.fuzzer.set_recursion("rule")
+        single = self.fuzzer.gen_parallel(cat="top", num=50, workers=1, seed=1337, max_recursion=5)
+        res = self.fuzzer.gen_parallel(cat="top", num=50, workers=2, seed=1337, max_recursion=5)
+        self.assertEqual(res, single)
+
+    def test_sink(self):
+        expected = self.fuzzer.gen_parallel(cat="top", num=50, workers=2, seed=1)
+        sunk = []
+        self.assertIsNone(self.fuzzer.gen_parallel(cat="top", num=50, workers=2, seed=1, sink=sunk.append))
+        self.assertEqual(sunk, list(expected))
+
+    def test_global_random_state_unchanged(self):
+        rand.seed(5)
+        expected = rand.random()
+        rand.seed(5)
+        self.fuzzer.gen_parallel(cat="top", num=10, workers=1, seed=1)
+        self.assertEqual(rand.random(), expected)
+
+    def test_staged_defs_are_discarded(self):
+        fuzzer = self.fuzzer
+
+        class Defines(Field):
+            def build(self, pre=None, shortest=False):
+                fuzzer.add_definition("top", "defined", "value")
+                return b"defined"
+
+        Def("defines", Defines, cat="other")
+        fuzzer.gen_parallel(cat="other", num=5, workers=1, seed=1)
+        self.assertNotIn("defined", fuzzer.defs["top"])
+
+
+if __name__ == "__main__":
+    unittest.main()
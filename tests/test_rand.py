@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+
+import os
+import random
+import sys
+import unittest
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+import gramfuzz
+import gramfuzz.context as context
+from gramfuzz.fields import *
+import gramfuzz.rand as rand
+
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class OtherRandom(random.Random):
+    """A random number generator that is not a ``random.Random``, as far as the
+    fast paths of ``gramfuzz.rand`` are concerned
+    """
+
+
+class TestData(unittest.TestCase):
+    def setUp(self):
+        gramfuzz.GramFuzzer.__instance__ = None
+        self.fuzzer = gramfuzz.GramFuzzer()
+
+    def tearDown(self):
+        pass
+
+    def _data_by_char(self, length, charset):
+        return b"".join(rand._binchoice(charset) for x in range(length))
+
+    def test_data_matches_randint(self):
+        charsets = [
+            b"a",
+            b"ab",
+            b"abcd",
+            String.charset_alpha,
+            String.charset_all,
+            bytes(bytearray(range(0x80))),
+            bytes(bytearray(range(0x81))),
+            bytes(bytearray(range(0x100))),
+            # all byte values, and longer than 0x100
+            bytes(bytearray(range(0x100))) + b"abc",
+        ]
+        for charset in charsets:
+            for length in [0, 1, 2, 100, 3000]:
+                rand.seed(1337)
+                expected = self._data_by_char(length, charset)
+                state = rand.RANDOM.getstate()
+
+                rand.seed(1337)
+                res = rand.data(length, charset)
+                self.assertEqual(res, expected, (len(charset), length))
+                self.assertEqual(rand.RANDOM.getstate(), state, (len(charset), length))
+
+    def test_data_other_rngs(self):
+        with context.use(context.Context(rng=OtherRandom(1))):
+            res = rand.data(100, b"abc")
+        self.assertEqual(len(res), 100)
+        self.assertEqual(set(bytearray(res)), set(bytearray(b"abc")))
+
+
+class TestRandbelow(unittest.TestCase):
+    def setUp(self):
+        gramfuzz.GramFuzzer.__instance__ = None
+
+    def tearDown(self):
+        pass
+
+    def test_matches_randint(self):
+        for n in [1, 2, 10, 2**31, 2**70]:
+            rand.seed(1337)
+            expected = [rand.randint(n) for x in range(500)]
+            rand.seed(1337)
+            self.assertEqual([rand.randbelow(n) for x in range(500)], expected)
+
+    def test_other_rngs(self):
+        with context.use(context.Context(rng=OtherRandom(1))):
+            res = [rand.randbelow(3) for x in range(500)]
+        self.assertEqual(set(res), set([0, 1, 2]))
+
+
+class TestWeightedTable(unittest.TestCase):
+    def setUp(self):
+        gramfuzz.GramFuzzer.__instance__ = None
+
+    def tearDown(self):
+        pass
+
+    def test_matches_weighted_choice(self):
+        probabilities = [
+            [1.0],
+            [0.1, 0.3, 0.6],
+            [0.5, 0.0, 0.5],
+            [1.0 / 300] * 300,
+        ]
+        for probs in probabilities:
+            items = list(range(len(probs)))
+            table = rand.WeightedTable(probs)
+
+            rand.seed(1337)
+            expected = [rand.weighted_choice(items, probs) for x in range(2000)]
+            rand.seed(1337)
+            self.assertEqual([table.pick() for x in range(2000)], expected)
+            rand.seed(1337)
+            self.assertEqual([table.choice(items) for x in range(2000)], expected)
+
+        # zero-probability items are never chosen
+        table = rand.WeightedTable([0.5, 0.0, 0.5])
+        self.assertNotIn(1, set(table.pick() for x in range(2000)))
+
+    def test_bad_probabilities(self):
+        table = rand.WeightedTable([0.0, 0.0])
+        with self.assertRaises(Exception):
+            table.pick()
+
+    def _weighted_choice_scan(self, items, probabilities):
+        rand_val = rand.random()
+        total_probability = 0.0
+        for item, prob in zip(items, probabilities):
+            if total_probability <= rand_val < total_probability+prob:
+                return item
+            total_probability += prob
+        raise Exception("Probabilities did not add up to 1.0")
+
+    def test_weighted_choice_cached(self):
+        items = ["a", "b", "c"]
+        for probs in [[0.1, 0.3, 0.6], (0.5, 0.0, 0.5)]:
+            rand.seed(1337)
+            expected = [self._weighted_choice_scan(items, probs) for x in range(2000)]
+            rand.seed(1337)
+            self.assertEqual([rand.weighted_choice(items, probs) for x in range(2000)], expected)
+
+        # probabilities that are not a list or tuple are not cached
+        rand.seed(1337)
+        expected = [self._weighted_choice_scan(items, [0.2, 0.8, 0.0]) for x in range(200)]
+        rand.seed(1337)
+        res = [rand.weighted_choice(items, iter([0.2, 0.8, 0.0])) for x in range(200)]
+        self.assertEqual(res, expected)
+
+        probs = [0.1, 0.3, 0.6]
+        rand.weighted_choice(items, probs)
+        table = rand._weighted_table(probs)
+        self.assertIs(rand._weighted_table(probs), table)
+
+        # probabilities that are changed in place get a new table
+        probs[:] = [0.0, 0.0, 1.0]
+        self.assertIsNot(rand._weighted_table(probs), table)
+        self.assertEqual(set(rand.weighted_choice(items, probs) for x in range(200)), set(["c"]))
+
+    def test_weighted_choice_bad_probabilities(self):
+        with self.assertRaises(Exception):
+            rand.weighted_choice([1, 2], [0.0, 0.0])
+        # more probabilities than items
+        rand.seed(1337)
+        with self.assertRaises(Exception):
+            for x in range(200):
+                rand.weighted_choice([1], [0.0, 1.0])
+
+
+class TestBufferedRandom(unittest.TestCase):
+    def setUp(self):
+        gramfuzz.GramFuzzer.__instance__ = None
+        self.fuzzer = gramfuzz.GramFuzzer()
+
+    def tearDown(self):
+        pass
+
+    def _backends(self):
+        res = ["python"]
+        if numpy is not None:
+            res.append("numpy")
+        return res
+
+    def _draw(self, rng):
+        res = []
+        for x in range(2000):
+            res.append((
+                rng.random(),
+                rng.randint(0, 9),
+                rng.randint(-5, 5),
+                rng.choice("abcdef"),
+                rng.randint(0, 2**70),
+            ))
+        return res
+
+    def test_seed_stable(self):
+        for backend in self._backends():
+            expected = self._draw(rand.BufferedRandom(seed=1337, backend=backend))
+
+            for block_size in [1, 7, 1000]:
+                rng = rand.BufferedRandom(1337, backend, block_size)
+                self.assertEqual(self._draw(rng), expected, backend)
+
+            rng.seed(1337)
+            self.assertEqual(self._draw(rng), expected, backend)
+
+            self.assertNotEqual(self._draw(rand.BufferedRandom(seed=1338, backend=backend)), expected)
+
+    def test_data_seed_stable(self):
+        for backend in self._backends():
+            res = []
+            for x in range(2):
+                with context.use(context.Context(rng=rand.BufferedRandom(seed=1337, backend=backend))):
+                    res.append([(rand.randint(10), rand.data(length, b"abc")) for length in [1, 10, 100, 3000]])
+            self.assertEqual(res[0], res[1], backend)
+
+            for length, charset in [(10, b"abc"), (100, b"abc"), (3000, String.charset_all)]:
+                with context.use(context.Context(rng=rand.BufferedRandom(seed=1, backend=backend))):
+                    data = rand.data(length, charset)
+                self.assertEqual(len(data), length)
+                self.assertEqual(set(bytearray(data)), set(bytearray(charset)))
+
+    def test_python_backend_floats(self):
+        # floats come straight from random.Random
+        rng = rand.BufferedRandom(seed=1337)
+        orig = random.Random(1337)
+        self.assertEqual([rng.random() for x in range(100)], [orig.random() for x in range(100)])
+
+        # bounded integers use a single float each
+        self.assertEqual(rng.randint(0, 9), int(orig.random() * 10))
+        self.assertEqual(rng.getstate(), orig.getstate())
+
+    def test_ranges(self):
+        for backend in self._backends():
+            rng = rand.BufferedRandom(seed=1, backend=backend)
+            self.assertEqual(set(rng.randint(3, 7) for x in range(2000)), set(range(3, 8)))
+            self.assertEqual(set(rng.choice("abc") for x in range(2000)), set("abc"))
+            self.assertEqual(rng.randint(4, 4), 4)
+
+            for x in range(2000):
+                self.assertLess(rng.randint(0, 2**64 + 1), 2**64 + 2)
+                self.assertTrue(0.0 <= rng.random() < 1.0)
+
+            with self.assertRaises(ValueError):
+                rng.randint(5, 4)
+            with self.assertRaises(IndexError):
+                rng.choice([])
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            rand.BufferedRandom(backend="nope")
+
+    def test_rand_functions(self):
+        with context.use(context.Context(rng=rand.BufferedRandom(seed=1))):
+            rand.seed(1337)
+            self.assertEqual(set(rand.randint(5) for x in range(1000)), set(range(5)))
+            self.assertEqual(set(rand.randint(2, 4) for x in range(1000)), set([2, 3]))
+            self.assertEqual(set(rand.randbelow(3) for x in range(1000)), set([0, 1, 2]))
+            self.assertEqual(set(rand.choice([1, 2]) for x in range(1000)), set([1, 2]))
+            self.assertIn(rand.weighted_choice([1, 2], [0.5, 0.5]), [1, 2])
+            self.assertEqual(len(rand.data(10, b"abc")), 10)
+
+    def test_gen_reproducible(self):
+        Def("item", Or(UInt, Q(String), And("[", Ref("item"), Opt(",", Ref("item")), "]")))
+
+        for backend in self._backends():
+            res = []
+            for engine in gramfuzz.GramFuzzer.engines:
+                self.fuzzer.set_engine(engine)
+                with context.use(context.Context(rng=rand.BufferedRandom(seed=1337, backend=backend))):
+                    res.append(self.fuzzer.gen(cat="default", num=100, max_recursion=8))
+
+            # every engine generates the same data
+            for engine_res in res[1:]:
+                self.assertEqual(engine_res, res[0], backend)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -110,6 +110,151 @@ class TestShortestPath(unittest.TestCase):
             # it may have the comma at the end
             self.assertIn(res, [b"THE NAME", b"THE NAME,"])
 
+    def test_field_instances(self):
+        # field instances don't reference any rules, the same as field classes
+        test1 = Def("test1", UInt(), Ref("test2"))
+        test2 = Def("test2", UInt, "blah")
+
+        self.fuzzer.preprocess_rules()
+
+        self.assertIn("test1", self.fuzzer.defs["default"])
+        self.assertIn("test2", self.fuzzer.defs["default"])
+
+    def test_long_chain(self):
+        # every rule can only be resolved after the rule defined after it
+        num = 2000
+        for x in six.moves.range(num):
+            Def("chain{}".format(x), "c", Ref("chain{}".format(x + 1)))
+        Def("chain{}".format(num), "end")
+
+        self.fuzzer.preprocess_rules()
+
+        self.assertEqual(len(self.fuzzer.defs["default"]), num + 1)
+        res = self.fuzzer.defs["default"]["chain{}".format(num - 10)][0].build(shortest=True)
+        self.assertEqual(res, b"c" * 10 + b"end")
+
+    def test_prune_keeps_bound_refs(self):
+        test1 = Def("test1", Ref("test2"))
+        test2_bad = Def("test2", Ref("test2"), Ref("test4")) # <-- can never terminate
+        test2 = Def("test2", "blah2")
+        Def("test3", Ref("test4")) # <-- undefined, pruned entirely
+
+        self.fuzzer.preprocess_rules()
+
+        test2_rules = self.fuzzer.defs["default"]["test2"]
+        self.assertEqual(test2_rules, [test2])
+        self.assertNotIn("test3", self.fuzzer.defs["default"])
+        self.assertIs(test1.values[0]._binding[2], test2_rules)
+        for x in six.moves.range(100):
+            self.assertEqual(test1.build(), b"blah2")
+
+    def test_incremental(self):
+        test1 = Def("test1", Or(
+            Ref("test2"),
+            And("a", Ref("test3")),
+        ))
+        Def("test3", Ref("test4"))
+        Def("test4", Ref("test6"))
+        Def("test6", "b")
+
+        self.fuzzer._update_rules()
+        self.assertEqual(test1.build(shortest=True), b"ab")
+
+        # only the new rules should be processed from now on
+        self.fuzzer._find_shortest_paths = lambda: self.fail("all rules were processed")
+
+        test2 = Def("test2", Ref("test5"))
+        Def("test5", "blah") # <-- this blah should be generated
+        self.fuzzer._update_rules()
+
+        self.assertIn("test2", self.fuzzer.defs["default"])
+        for x in six.moves.range(100):
+            self.assertEqual(test1.build(shortest=True), b"blah")
+
+    def test_incremental_prune(self):
+        Def("test1", "blah")
+        self.fuzzer._update_rules()
+
+        Def("test2", Ref("test3")) # <-- test3 is never defined
+        test4 = Def("test4", Ref("test5"), no_prune=True)
+        self.fuzzer._update_rules()
+
+        self.assertNotIn("test2", self.fuzzer.defs["default"])
+        self.assertIn("test4", self.fuzzer.defs["default"])
+        self.assertEqual([x[1] for x in self.fuzzer.unbound_refs], ["test4"])
+
+        Def("test5", "blah5")
+        self.fuzzer._update_rules()
+
+        self.assertEqual(self.fuzzer.unbound_refs, [])
+        self.assertEqual(test4.build(shortest=True), b"blah5")
+
+    def test_cheapest_value(self):
+        test1 = Def("test1", Or(
+            String(min=50, max=60),
+            Join(UInt, UInt, UInt, sep=","),
+            b"short", # <-- this short should be generated
+        ))
+
+        self.fuzzer.preprocess_rules()
+
+        self.assertEqual(test1.values[0].shortest_vals, [b"short"])
+        for x in six.moves.range(100):
+            self.assertEqual(test1.build(shortest=True), b"short")
+
+    def test_cheapest_rule(self):
+        test1 = Def("test1", Or(
+            Ref("test2"),
+            Ref("test3"),
+            And("(", Ref("test1"), ")"),
+        ))
+        Def("test2", String(min=100, max=101))
+        Def("test3", "blah3") # <-- this blah3 should be generated
+        Def("test3", Q(Ref("test2")))
+
+        self.fuzzer.preprocess_rules()
+
+        self.assertEqual(self.fuzzer._rule_costs[("default", "test2")], (100, 0))
+        self.assertEqual(self.fuzzer._rule_costs[("default", "test3")], (5, 0))
+        self.assertEqual(self.fuzzer._rule_costs[("default", "test1")], (5, 1))
+        self.assertEqual(test1.values[0].shortest_indices, [1])
+
+    def test_shortest_path_before_cost(self):
+        # the cheaper value references more rules
+        test1 = Def("test1", Or(
+            Ref("test2"),
+            String(min=10, max=11), # <-- this string should be generated
+        ))
+        Def("test2", Ref("test3"))
+        Def("test3", "b")
+
+        self.fuzzer.preprocess_rules()
+
+        for x in six.moves.range(100):
+            self.assertEqual(len(test1.build(shortest=True)), 10)
+
+    def test_incremental_cost(self):
+        test1 = Def("test1", Or(
+            Ref("test2"),
+            Ref("test3"),
+        ))
+        Def("test2", "blah2")
+        Def("test3", "blah3blah3")
+
+        self.fuzzer._update_rules()
+        self.assertEqual(test1.build(shortest=True), b"blah2")
+
+        # only the new rules should be processed from now on
+        self.fuzzer._find_shortest_paths = lambda: self.fail("all rules were processed")
+
+        Def("test3", "b3") # <-- test3 should be generated
+        self.fuzzer._update_rules()
+
+        self.assertEqual(self.fuzzer._rule_costs[("default", "test3")], (2, 0))
+        self.assertEqual(test1.values[0].shortest_indices, [1])
+        res = set(test1.build(shortest=True) for x in six.moves.range(100))
+        self.assertEqual(res, set([b"blah3blah3", b"b3"]))
+
 
 if __name__ == "__main__":
     unittest.main()
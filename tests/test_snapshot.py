@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+import gramfuzz
+import gramfuzz.context as context
+import gramfuzz.parallel as parallel
+import gramfuzz.snapshot as snapshot
+from gramfuzz.fields import *
+
+
+GRAMMAR = """
+import gramfuzz
+from gramfuzz.fields import *
+
+TOP_CAT = "snap"
+
+SEP = b"-"
+
+class Twice(Field):
+    def __init__(self, value):
+        self.value = value
+
+    def build(self, pre=None, shortest=False):
+        res = gramfuzz.utils.val(self.value, pre, shortest=shortest)
+        return join(res, res)
+
+def join(a, b):
+    return a + SEP + b
+
+Def("top", Twice(Ref("item")), cat="snap")
+Def("item", Or(UInt, Q(String), And("[", Ref("item"), "]")))
+"""
+
+
+@unittest.skipIf(sys.version_info < (3, 8), "snapshots require Python 3.8+")
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        gramfuzz.GramFuzzer.__instance__ = None
+        self.tmp_dir = tempfile.mkdtemp()
+        self.grammar_path = os.path.join(self.tmp_dir, "snap_grammar.py")
+        with open(self.grammar_path, "w") as f:
+            f.write(GRAMMAR)
+
+        self.fuzzer = gramfuzz.GramFuzzer()
+        self.fuzzer.load_grammar(self.grammar_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _gen(self, fuzzer):
+        with context.use(context.Context(seed=1337)):
+            return list(fuzzer.gen(cat="snap", num=50, max_recursion=5))
+
+    def _new_fuzzer(self):
+        gramfuzz.GramFuzzer.__instance__ = None
+        return gramfuzz.GramFuzzer()
+
+    def test_roundtrip(self):
+        # rules that were not defined in a grammar file are saved as well
+        class Upper(Field):
+            def build(self, pre=None, shortest=False):
+                return b"UPPER"
+        Def("top", Upper, cat="snap")
+
+        expected = self._gen(self.fuzzer)
+        data = snapshot.dumps(self.fuzzer)
+
+        fuzzer = self._new_fuzzer()
+        self.assertTrue(snapshot.loads(fuzzer, data))
+        self.assertTrue(fuzzer._rules_processed)
+        self.assertEqual(self._gen(fuzzer), expected)
+        self.assertIn(b"UPPER", expected)
+
+    def test_refs_are_unbound(self):
+        self.fuzzer.preprocess_rules()
+        fuzzer = self._new_fuzzer()
+        snapshot.loads(fuzzer, snapshot.dumps(self.fuzzer))
+
+        ref = fuzzer.defs["snap"]["top"][0].values[0].value
+        self.assertIsInstance(ref, Ref)
+        self.assertIsNone(ref._binding)
+
+    def test_save_load(self):
+        path = os.path.join(self.tmp_dir, "rules.snapshot")
+        expected = self._gen(self.fuzzer)
+
+        fuzzer = self._new_fuzzer()
+        self.assertFalse(fuzzer.load_snapshot(path))
+
+        self.fuzzer.save_snapshot(path)
+        self.assertTrue(fuzzer.load_snapshot(path))
+        self.assertEqual(self._gen(fuzzer), expected)
+        self.assertEqual(fuzzer.cat_group_defaults, {"snap_grammar": "snap"})
+
+    def test_stale_grammar(self):
+        data = snapshot.dumps(self.fuzzer)
+        with open(self.grammar_path, "a") as f:
+            f.write("\nDef(\"other\", \"other\", cat=\"snap\")\n")
+
+        fuzzer = self._new_fuzzer()
+        self.assertFalse(snapshot.loads(fuzzer, data))
+        self.assertEqual(fuzzer.defs, {})
+
+    def test_not_a_snapshot(self):
+        import pickle
+        with self.assertRaises(gramfuzz.errors.GramFuzzError):
+            snapshot.loads(self._new_fuzzer(), pickle.dumps("something else"))
+
+    def test_init_worker(self):
+        expected = self._gen(self.fuzzer)
+        worker_args = ([], snapshot.dumps(self.fuzzer), self.fuzzer.engine, self.fuzzer.recursion, self.fuzzer.compile_cache)
+
+        gramfuzz.GramFuzzer.__instance__ = None
+        parallel._init_worker(worker_args)
+        try:
+            self.assertEqual(self._gen(parallel._fuzzer), expected)
+        finally:
+            parallel._fuzzer = None
+
+
+if __name__ == "__main__":
+    unittest.main()